@@ -0,0 +1,311 @@
+"""Бенчмарк этапов обработки на синтетических выгрузках
+
+Генерирует выгрузки заданных размеров (generate_chat_export.py), прогоняет
+на них этапы create_library.py по отдельности и дописывает результаты
+в JSON Lines файл, по одной записи на размер выгрузки, чтобы версии можно
+было сравнивать между собой. Пример:
+
+    python benchmark.py --scales 10k,100k --repeat 3
+
+Кроме времени, в отдельном прогоне под tracemalloc измеряется память,
+которую QAGrouper держит для разобранных сообщений (MessageStore и индексы).
+
+С --long-answers вместо этапов измеряется разбор очень длинных ответов
+из многих абзацев: время на абзац не должно расти с длиной ответа,
+а пик памяти разбора - расти быстрее самих абзацев.
+
+    python benchmark.py --long-answers 1k,10k,100k
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+from create_library import (
+    ChatParser,
+    QAGrouper,
+    DatabaseManager,
+    create_interactive_html,
+)
+from generate_chat_export import ExportSettings, parse_scale, write_chat_export
+
+STAGES = ['parse', 'group', 'sqlite', 'json', 'html']
+
+
+def _git_revision() -> Optional[str]:
+    """Текущий коммит репозитория с пометкой о незакоммиченных изменениях"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ('-dirty' if status else '')
+
+
+def _export_path(data_dir: str, settings: ExportSettings) -> str:
+    """Путь к выгрузке; имя зависит от всех параметров генератора"""
+    name = '_'.join(f'{key}-{value}' for key, value in asdict(settings).items())
+    return os.path.join(data_dir, f'chat_{name}.docx')
+
+
+def _timed(function: Callable[[], Any], verbose: bool) -> tuple:
+    """Выполняет function и возвращает (результат, секунды)"""
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+    return result, elapsed
+
+
+def _traced(function: Callable[[], Any], verbose: bool) -> tuple:
+    """Выполняет function под tracemalloc и возвращает (результат, байт после, пик байт)
+
+    Память считается от начала вызова; трассировка замедляет код,
+    поэтому время в таком прогоне не измеряется.
+    """
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        tracemalloc.start()
+        try:
+            result = function()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, current, peak
+
+
+def measure_memory(docx_file: str, verbose: bool = False) -> Dict[str, Any]:
+    """Память группировщика: сообщения разбираются потоком прямо в QAGrouper"""
+    def index_messages():
+        grouper = QAGrouper()
+        for _ in grouper.index_messages(ChatParser().iter_messages(docx_file)):
+            pass
+        return grouper
+
+    grouper, current, peak = _traced(index_messages, verbose)
+    return {
+        'messages': len(grouper.messages),
+        'grouper_bytes': current,
+        'peak_bytes': peak,
+    }
+
+
+def run_pipeline(docx_file: str, work_dir: str, streaming: bool = True,
+                 verbose: bool = False) -> Dict[str, Any]:
+    """Один прогон всех этапов; возвращает время этапов и размеры результатов"""
+    timings = {}
+    db_path = os.path.join(work_dir, 'chat_database.db')
+    json_file = os.path.join(work_dir, 'библиотека_вопросов_ответов.json')
+    html_dir = os.path.join(work_dir, 'src')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    messages, timings['parse'] = _timed(
+        lambda: ChatParser().parse_word_document(docx_file, streaming=streaming), verbose)
+    qa_pairs, timings['group'] = _timed(
+        lambda: QAGrouper(messages).group_questions_answers(), verbose)
+    db_manager = DatabaseManager(db_path)
+    _, timings['sqlite'] = _timed(lambda: db_manager.save_to_sqlite(messages, qa_pairs), verbose)
+    _, timings['json'] = _timed(lambda: db_manager.create_json_database(qa_pairs, json_file), verbose)
+    _, timings['html'] = _timed(lambda: create_interactive_html(qa_pairs, html_dir), verbose)
+
+    return {
+        'timings': timings,
+        'counts': {
+            'messages': len(messages),
+            'violetta_answers': sum(msg.is_violetta_answer for msg in messages),
+            'qa_pairs': len(qa_pairs),
+        },
+        'output_bytes': {
+            'docx': os.path.getsize(docx_file),
+            'sqlite': os.path.getsize(db_path),
+            'json': os.path.getsize(json_file),
+            'html': os.path.getsize(os.path.join(html_dir, 'index.html')),
+            'data_json': os.path.getsize(os.path.join(html_dir, 'data.json')),
+        },
+    }
+
+
+def benchmark_scale(settings: ExportSettings, data_dir: str, repeat: int,
+                    streaming: bool = True, verbose: bool = False) -> Dict[str, Any]:
+    """Прогоняет бенчмарк на выгрузке одного размера repeat раз"""
+    docx_file = _export_path(data_dir, settings)
+    if not os.path.exists(docx_file):
+        print(f"📝 Генерация выгрузки на {settings.messages} сообщений...")
+        write_chat_export(docx_file + '.tmp', settings)
+        os.replace(docx_file + '.tmp', docx_file)
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='chat_benchmark_') as work_dir:
+        for run in range(1, repeat + 1):
+            print(f"⏱️  {settings.messages} сообщений, прогон {run}/{repeat}...")
+            runs.append(run_pipeline(docx_file, work_dir, streaming, verbose))
+    print(f"📏 {settings.messages} сообщений, память группировщика...")
+    memory = measure_memory(docx_file, verbose)
+
+    stages = {}
+    for stage in STAGES:
+        seconds = [result['timings'][stage] for result in runs]
+        best = min(seconds)
+        stages[stage] = {
+            'seconds': [round(value, 6) for value in seconds],
+            'best': round(best, 6),
+            'messages_per_second': round(settings.messages / best) if best else None,
+        }
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parser_version': ChatParser().version,
+        'streaming': streaming,
+        'repeat': repeat,
+        'generator': asdict(settings),
+        'stages': stages,
+        'memory': memory,
+        'counts': runs[-1]['counts'],
+        'output_bytes': runs[-1]['output_bytes'],
+    }
+
+
+def long_answer_paragraphs(paragraphs: int, answers: int = 3) -> List[str]:
+    """Абзацы выгрузки из answers ответов Виолетты по paragraphs абзацев с тегами"""
+    lines = []
+    for number in range(1, answers + 1):
+        lines.append(f"Сообщение #{number}")
+        lines.append(f"От: Виолетта Макеева (@violetta_makeeva) • Дата: 01.01.2025 10:00 • ID: {number}")
+        for paragraph in range(paragraphs):
+            lines.append(f"Абзац {paragraph} длинного ответа про запуск и клиентов #ответвиолетты "
+                         f"#тема{paragraph % 10}")
+        lines.append("――――――――――")
+    return lines
+
+
+def benchmark_long_answers(paragraph_counts: List[int], repeat: int,
+                           verbose: bool = False) -> List[Dict[str, Any]]:
+    """Время разбора длинных ответов ChatParser в зависимости от числа абзацев"""
+    results = []
+    for paragraphs in paragraph_counts:
+        lines = long_answer_paragraphs(paragraphs)
+        print(f"⏱️  Ответы по {paragraphs} абзацев...")
+        def parse(lines=lines):
+            return list(ChatParser().iter_paragraph_messages(lines))
+
+        seconds = [_timed(parse, verbose)[1] for _ in range(repeat)]
+        best = min(seconds)
+        _, _, peak = _traced(parse, verbose)
+        results.append({
+            'benchmark': 'long_answers',
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'paragraphs': paragraphs,
+            'paragraphs_total': len(lines),
+            'seconds': [round(value, 6) for value in seconds],
+            'best': round(best, 6),
+            'microseconds_per_paragraph': round(best / len(lines) * 1e6, 3),
+            'peak_bytes': peak,
+        })
+    return results
+
+
+def _print_long_answers_table(results: List[Dict[str, Any]]):
+    """Сводная таблица микробенчмарка длинных ответов"""
+    header = f"{'абзацев':>10} {'время':>10} {'мкс/абзац':>10} {'пик МБ':>10}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result['paragraphs']:>10} {result['best']:>9.3f}s "
+              f"{result['microseconds_per_paragraph']:>10.2f} {result['peak_bytes'] / 2**20:>10.1f}")
+
+
+def _print_table(results: List[Dict[str, Any]]):
+    """Сводная таблица: лучшее время этапов и память группировщика по размерам выгрузки"""
+    header = (f"{'сообщений':>10} " + ' '.join(f'{stage:>9}' for stage in STAGES)
+              + f" {'всего':>9} {'память МБ':>10}")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        best = [result['stages'][stage]['best'] for stage in STAGES]
+        print(f"{result['generator']['messages']:>10} "
+              + ' '.join(f'{value:>8.3f}s' for value in best) + f" {sum(best):>8.3f}s"
+              + f" {result['memory']['grouper_bytes'] / 2**20:>10.1f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Командная строка бенчмарка"""
+    defaults = ExportSettings()
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов обработки выгрузки чата")
+    parser.add_argument('--scales', default='10k',
+                        help="размеры выгрузок через запятую: 10k,100k,1M")
+    parser.add_argument('--repeat', type=int, default=3, help="число прогонов на размер")
+    parser.add_argument('--output', default='benchmark_results.jsonl',
+                        help="JSON Lines файл, в который дописываются результаты")
+    parser.add_argument('--data-dir', default='.benchmark_data',
+                        help="папка для сгенерированных выгрузок, они переиспользуются")
+    parser.add_argument('--python-docx', action='store_true',
+                        help="читать документ через python-docx вместо потокового парсера")
+    parser.add_argument('--verbose', action='store_true', help="не скрывать вывод этапов")
+    parser.add_argument('--long-answers', metavar='PARAGRAPHS',
+                        help="микробенчмарк разбора длинных ответов: числа абзацев через запятую")
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--reply-depth', type=int, default=defaults.reply_depth)
+    parser.add_argument('--question-parts', type=int, default=defaults.question_parts)
+    parser.add_argument('--multipart-ratio', type=float, default=defaults.multipart_ratio)
+    parser.add_argument('--tag-density', type=float, default=defaults.tag_density)
+    parser.add_argument('--chatter-ratio', type=float, default=defaults.chatter_ratio)
+    parser.add_argument('--continuation-ratio', type=float, default=defaults.continuation_ratio)
+    args = parser.parse_args(argv)
+
+    if args.long_answers:
+        results = benchmark_long_answers([parse_scale(value) for value in args.long_answers.split(',')],
+                                         args.repeat, args.verbose)
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        print()
+        _print_long_answers_table(results)
+        print(f"\n💾 Результаты дописаны в {args.output}")
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for scale in args.scales.split(','):
+        settings = ExportSettings(
+            messages=parse_scale(scale),
+            seed=args.seed,
+            reply_depth=args.reply_depth,
+            question_parts=args.question_parts,
+            multipart_ratio=args.multipart_ratio,
+            tag_density=args.tag_density,
+            chatter_ratio=args.chatter_ratio,
+            continuation_ratio=args.continuation_ratio,
+        )
+        result = benchmark_scale(settings, args.data_dir, args.repeat,
+                                 streaming=not args.python_docx, verbose=args.verbose)
+        results.append(result)
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    print()
+    _print_table(results)
+    print(f"\n💾 Результаты дописаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
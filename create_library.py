@@ -1,14 +1,331 @@
 import re
 import json
+import hashlib
+import base64
+import gzip
+import itertools
 import sqlite3
-from datetime import datetime
-from collections import defaultdict, Counter
+import shutil
+import glob
+import zlib
+import contextlib
+from array import array
+from datetime import datetime, timezone
+from collections import defaultdict, Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import os
+import functools
+import pickle
+import time
+import cProfile
+import inspect
+import tracemalloc
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Callable
 from dataclasses import dataclass
 from docx import Document
 
+try:
+    import brotli
+except ImportError:  # Сжатые копии .br пишутся, только если установлен brotli
+    brotli = None
+
+# Пространства имен WordprocessingML, используемые потоковым парсером
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+OFFICE_DOCUMENT_REL = ('http://schemas.openxmlformats.org/officeDocument/2006/'
+                       'relationships/officeDocument')
+
+# Токенизатор полнотекстового индекса: регистр и диакритика не учитываются
+FTS_TOKENIZER = 'unicode61 remove_diacritics 2'
+
+# Поисковый индекс веб-приложения: n-граммы слов нормализованного текста.
+# Разделители слов - то же, что /[^\p{L}\p{N}_]+/gu в браузере
+SEARCH_INDEX_NGRAM = 3
+SEARCH_SEPARATOR_PATTERN = re.compile(r'\W+')
+
+# Формат даты в заголовке сообщения; MessageStore хранит такие даты как Unix-время
+MESSAGE_DATE_FORMAT = '%d.%m.%Y %H:%M'
+MESSAGE_DATE_PATTERN = re.compile(r'(\d{2})\.(\d{2})\.(\d{4}) (\d{2}):(\d{2})')
+# Тексты MessageStore сжимаются блоками по столько сообщений; столько
+# распакованных блоков держится в кеше
+MESSAGE_TEXT_BLOCK = 64
+MESSAGE_TEXT_CACHE_BLOCKS = 8
+
+# Выкладка веб-приложения (StaticAssets): длина хеша содержимого в именах
+# файлов и минимальный размер файла, для которого пишутся сжатые копии
+STATIC_HASH_LENGTH = 10
+STATIC_COMPRESS_MIN_SIZE = 1024
+STATIC_CHUNK_SIZE = 1024 * 1024
+
+# JSON-база библиотеки (DatabaseManager.create_json_database, QAJsonWriter)
+LIBRARY_JSON_FILE = "библиотека_вопросов_ответов.json"
+LIBRARY_DESCRIPTION = "База знаний вопросов и ответов из психологической мастер-группы"
+# Файлы, которые создает сборка: их старые версии удаляются из src/
+STATIC_GENERATED_PATTERN = re.compile(
+    r'(index\.html|asset-manifest\.json|styles(\.[0-9a-f]+)?\.css|data(\.[0-9a-f]+)?\.json'
+    r'|data/(qa-\d+|search-index|manifest)(\.[0-9a-f]+)?\.json)(\.gz|\.br)?')
+
+# Этапы сборки библиотеки в порядке выполнения (main, --stages)
+PIPELINE_STAGES = ('parse', 'group', 'sqlite', 'json', 'html')
+# Правило сборки пар из цепочек ответов по умолчанию (THREAD_POLICIES)
+DEFAULT_THREAD_POLICY = 'reply'
+
+class _StageFrame:
+    """Открытый этап на стеке профилировщика"""
+    __slots__ = ('name', 'wall_start', 'cpu_start', 'memory_start',
+                 'child_wall', 'child_cpu', 'peak_memory')
+    
+    def __init__(self, name: str, wall_start: float, cpu_start: float, memory_start: int):
+        self.name = name
+        self.wall_start = wall_start
+        self.cpu_start = cpu_start
+        self.memory_start = memory_start
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.peak_memory = memory_start
+
+class _StageContext:
+    """Контекст одного вызова этапа; items можно задать внутри блока"""
+    
+    def __init__(self, stage_profiler: 'StageProfiler', name: str, items: Optional[int] = None):
+        self.stage_profiler = stage_profiler
+        self.name = name
+        self.items = items
+    
+    def __enter__(self):
+        if self.stage_profiler.enabled:
+            self.stage_profiler._enter(self.name)
+        return self
+    
+    def __exit__(self, *exc_info):
+        if self.stage_profiler.enabled:
+            self.stage_profiler._exit(self.name, self.items or 0)
+        return False
+
+class StageProfiler:
+    """Сбор времени, CPU, пиковой памяти и числа элементов по этапам обработки
+    
+    Этапы вложены друг в друга: потоковые этапы (чтение docx, разбор,
+    индексация) выполняются внутри потребляющих их этапов записи в SQLite.
+    Поэтому для каждого этапа считается и собственное время (self), без
+    вложенных этапов, и полное (total). Пиковая память (tracemalloc)
+    учитывает вложенные этапы. Выключенный профилировщик почти ничего
+    не стоит: iterate() возвращает поток без обертки.
+    
+    Разбор в дочерних процессах (parse_documents) не профилируется:
+    в основном процессе видно только время ожидания результатов.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self._stack: List[_StageFrame] = []
+        self._cprofile = None
+        self._wall_start = 0.0
+        self._cpu_start = 0.0
+        self._wall_total = 0.0
+        self._cpu_total = 0.0
+        self._peak_memory = 0
+    
+    def start(self, trace_memory: bool = True, cprofile: bool = False):
+        """Включает сбор статистики; cprofile=True дополнительно запускает cProfile"""
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._stack = []
+        self._peak_memory = 0
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+    
+    def stop(self):
+        """Выключает сбор статистики; собранные данные сохраняются для отчета"""
+        if not self.enabled:
+            return
+        self._wall_total = time.perf_counter() - self._wall_start
+        self._cpu_total = time.process_time() - self._cpu_start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self.trace_memory:
+            self._peak_memory = max(self._peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.enabled = False
+    
+    def stage(self, name: str, items: Optional[int] = None) -> _StageContext:
+        """Контекстный менеджер для одного вызова этапа"""
+        return _StageContext(self, name, items)
+    
+    def iterate(self, name: str, iterable: Iterable[Any]) -> Iterable[Any]:
+        """Учитывает время получения каждого элемента потока как этап name"""
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iter(iterable))
+    
+    def _iterate(self, name: str, iterator: Iterator[Any]) -> Iterator[Any]:
+        while True:
+            self._enter(name)
+            items = 0
+            try:
+                item = next(iterator)
+                items = 1
+            except StopIteration:
+                return
+            finally:
+                self._exit(name, items)
+            yield item
+    
+    def _enter(self, name: str):
+        if name not in self.stages:
+            # Этапы в отчете идут в порядке первого входа
+            self.stages[name] = {
+                'calls': 0, 'items': 0,
+                'wall_self': 0.0, 'wall_total': 0.0,
+                'cpu_self': 0.0, 'cpu_total': 0.0,
+                'peak_memory': 0, 'memory_delta': 0,
+            }
+        memory = 0
+        if self.trace_memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent.peak_memory = max(parent.peak_memory, peak)
+            tracemalloc.reset_peak()
+        self._stack.append(_StageFrame(name, time.perf_counter(), time.process_time(), memory))
+    
+    def _exit(self, name: str, items: int = 0):
+        wall_end = time.perf_counter()
+        cpu_end = time.process_time()
+        frame = self._stack.pop()
+        wall = wall_end - frame.wall_start
+        cpu = cpu_end - frame.cpu_start
+        
+        stats = self.stages[name]
+        stats['calls'] += 1
+        stats['items'] += items
+        stats['wall_total'] += wall
+        stats['wall_self'] += wall - frame.child_wall
+        stats['cpu_total'] += cpu
+        stats['cpu_self'] += cpu - frame.child_cpu
+        
+        if self.trace_memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            frame.peak_memory = max(frame.peak_memory, peak)
+            stats['peak_memory'] = max(stats['peak_memory'], frame.peak_memory)
+            stats['memory_delta'] += memory - frame.memory_start
+            self._peak_memory = max(self._peak_memory, frame.peak_memory)
+            tracemalloc.reset_peak()
+        
+        if self._stack:
+            parent = self._stack[-1]
+            parent.child_wall += wall
+            parent.child_cpu += cpu
+            parent.peak_memory = max(parent.peak_memory, frame.peak_memory)
+    
+    def report(self) -> Dict[str, Any]:
+        """Отчет в виде словаря, пригодного для JSON"""
+        stages = []
+        for name, stats in self.stages.items():
+            wall_self = stats['wall_self']
+            stages.append({
+                'stage': name,
+                'calls': stats['calls'],
+                'items': stats['items'],
+                'wall_self_seconds': round(wall_self, 6),
+                'wall_total_seconds': round(stats['wall_total'], 6),
+                'cpu_self_seconds': round(stats['cpu_self'], 6),
+                'cpu_total_seconds': round(stats['cpu_total'], 6),
+                'items_per_second': round(stats['items'] / wall_self) if wall_self > 0 else None,
+                'peak_memory_bytes': stats['peak_memory'] if self.trace_memory else None,
+                'memory_delta_bytes': stats['memory_delta'] if self.trace_memory else None,
+            })
+        return {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'trace_memory': self.trace_memory,
+            'cprofile': self._cprofile is not None,
+            'wall_seconds': round(self._wall_total, 6),
+            'cpu_seconds': round(self._cpu_total, 6),
+            'peak_memory_bytes': self._peak_memory if self.trace_memory else None,
+            'stages': stages,
+        }
+    
+    def write_report(self, report_file: str) -> str:
+        """Сохраняет отчет в JSON"""
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        return report_file
+    
+    def dump_cprofile(self, output_file: str) -> Optional[str]:
+        """Сохраняет статистику cProfile (для pstats или snakeviz)"""
+        if self._cprofile is None:
+            return None
+        self._cprofile.dump_stats(output_file)
+        return output_file
+    
+    def print_summary(self):
+        """Печатает сводную таблицу по этапам"""
+        report = self.report()
+        header = (f"{'Этап':<16} {'вызовы':>8} {'элементы':>9} {'время':>9} "
+                  f"{'всего':>9} {'CPU':>9} {'пик памяти':>11}")
+        print("\n⏱️  Профиль этапов (время без вложенных этапов / полное):")
+        print(header)
+        print('-' * len(header))
+        for stage in report['stages']:
+            peak = stage['peak_memory_bytes']
+            peak_text = f"{peak / 1024 / 1024:>8.1f} МБ" if peak is not None else f"{'-':>11}"
+            print(f"{stage['stage']:<16} {stage['calls']:>8} {stage['items']:>9} "
+                  f"{stage['wall_self_seconds']:>8.3f}s {stage['wall_total_seconds']:>8.3f}s "
+                  f"{stage['cpu_self_seconds']:>8.3f}s {peak_text}")
+        print('-' * len(header))
+        peak = report['peak_memory_bytes']
+        peak_text = f", пик памяти {peak / 1024 / 1024:.1f} МБ" if peak is not None else ""
+        print(f"Всего: {report['wall_seconds']:.3f}s, CPU {report['cpu_seconds']:.3f}s{peak_text}")
+
+# Общий профилировщик процесса; включается в main(profile_report=...)
+profiler = StageProfiler()
+
+def _count_items(result: Any) -> int:
+    """Число элементов результата этапа: само число или длина коллекции"""
+    if isinstance(result, bool):
+        return 0
+    if isinstance(result, int):
+        return result
+    if isinstance(result, (list, tuple, dict, set)):
+        return len(result)
+    return 0
+
+def profile_stage(name: str, count: Optional[Callable[..., int]] = None):
+    """Декоратор: учитывает вызовы функции как этап name профилировщика
+    
+    Для генераторов учитывается время получения каждого элемента. Для
+    обычных функций число элементов берется из count(*args, **kwargs),
+    а без него - из результата (_count_items).
+    """
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                return profiler.iterate(name, function(*args, **kwargs))
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return function(*args, **kwargs)
+                with profiler.stage(name) as stage:
+                    result = function(*args, **kwargs)
+                    stage.items = count(*args, **kwargs) if count else _count_items(result)
+                return result
+        return wrapper
+    return decorator
+
 @dataclass
 class ChatMessage:
     """Класс для представления сообщения чата"""
@@ -21,77 +338,507 @@ class ChatMessage:
     tags: List[str]
     is_violetta_answer: bool = False
 
+class StoredMessage:
+    """Сообщение из MessageStore с теми же полями, что у ChatMessage
+    
+    Легкое представление: хранит только хранилище и позицию, значения
+    полей восстанавливаются из столбцов при обращении. Только для чтения.
+    """
+    __slots__ = ('store', 'index')
+    
+    def __init__(self, store: 'MessageStore', index: int):
+        self.store = store
+        self.index = index
+    
+    @property
+    def message_number(self) -> str:
+        return self.store.decode_number(self.store.numbers[self.index])
+    
+    @property
+    def sender(self) -> str:
+        return self.store.senders[self.store.sender_ids[self.index]]
+    
+    @property
+    def date(self) -> str:
+        return self.store.date(self.index)
+    
+    @property
+    def timestamp(self) -> Optional[int]:
+        """Дата как Unix-время (дата выгрузки считается UTC), None - если не разобрана"""
+        return None if self.index in self.store.raw_dates else self.store.timestamps[self.index]
+    
+    @property
+    def message_id(self) -> str:
+        return self.store.decode_number(self.store.ids[self.index])
+    
+    @property
+    def reply_to(self) -> str:
+        return self.store.decode_number(self.store.reply_to[self.index])
+    
+    @property
+    def text(self) -> str:
+        return self.store.text(self.index)
+    
+    @property
+    def tags(self) -> List[str]:
+        return self.store.message_tags(self.index)
+    
+    @property
+    def is_violetta_answer(self) -> bool:
+        return bool(self.store.violetta[self.index])
+    
+    def __repr__(self) -> str:
+        return f"StoredMessage(message_number={self.message_number!r}, message_id={self.message_id!r})"
+
+class MessageStore:
+    """Компактное хранилище сообщений для выгрузок на миллионы сообщений
+    
+    Поля хранятся столбцами в array вместо отдельного объекта ChatMessage
+    со своим __dict__ и строками на каждое сообщение. Номера, ID и reply_to -
+    целые числа (-1 - пустое значение), отправители и теги - номера
+    в общих таблицах senders и tags, даты разбираются один раз в Unix-время.
+    Значения, которые не переводятся в число без потерь (например, ID
+    с ведущим нулем или дата в другом формате), хранятся строками
+    отдельно, поэтому сообщение восстанавливается точно.
+    
+    Тексты по умолчанию хранятся в UTF-8 и сжимаются zlib блоками по
+    MESSAGE_TEXT_BLOCK сообщений; несколько последних распакованных блоков
+    кешируются, поэтому чтение подряд или в пределах цепочки почти не
+    замедляется. compress_texts=False хранит тексты обычными строками.
+    
+    Позиция сообщения - порядок добавления; store[i] и итерация отдают
+    StoredMessage, с которыми работают QAGrouper и DatabaseManager.
+    """
+    
+    def __init__(self, messages: Iterable[Any] = (), compress_texts: bool = True):
+        self.numbers = array('q')
+        self.ids = array('q')
+        self.reply_to = array('q')
+        self.sender_ids = array('l')
+        self.timestamps = array('q')
+        self.violetta = bytearray()
+        self.compress_texts = compress_texts
+        # Несжатые тексты или тексты текущего, еще не сжатого блока
+        self._texts = []
+        self._text_blocks = []
+        # Конец текста сообщения в байтах распакованного блока
+        self._text_ends = array('l')
+        self._block_cache = OrderedDict()
+        # Теги сообщения i - tag_refs[tag_offsets[i]:tag_offsets[i + 1]]
+        self.tag_refs = array('l')
+        self.tag_offsets = array('q', [0])
+        
+        self.senders = []
+        self.tags = []
+        # Строковые значения номеров и ID, которые не записываются числом
+        self.irregular = []
+        # Позиция -> исходная строка даты, если она не разобрана
+        self.raw_dates = {}
+        self._sender_codes = {}
+        self._tag_codes = {}
+        self._irregular_codes = {}
+        # Код message_id -> позиция последнего сообщения с этим ID
+        self.positions = {}
+        
+        for msg in messages:
+            self.append(msg)
+    
+    def __len__(self) -> int:
+        return len(self.numbers)
+    
+    def __getitem__(self, index: int) -> StoredMessage:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        return StoredMessage(self, index % len(self))
+    
+    def __iter__(self) -> Iterator[StoredMessage]:
+        return (StoredMessage(self, index) for index in range(len(self)))
+    
+    def append(self, msg: Any) -> int:
+        """Добавляет сообщение (ChatMessage или с теми же полями), возвращает его позицию"""
+        index = len(self.numbers)
+        message_id = self._encode_number(msg.message_id)
+        self.numbers.append(self._encode_number(msg.message_number))
+        self.ids.append(message_id)
+        self.reply_to.append(self._encode_number(msg.reply_to))
+        self.sender_ids.append(self._code(msg.sender, self.senders, self._sender_codes))
+        self.timestamps.append(self._encode_date(index, msg.date))
+        self.violetta.append(bool(msg.is_violetta_answer))
+        self._append_text(msg.text)
+        self.tag_refs.extend(self._code(tag, self.tags, self._tag_codes) for tag in msg.tags)
+        self.tag_offsets.append(len(self.tag_refs))
+        if message_id != -1:
+            self.positions[message_id] = index
+        return index
+    
+    def find(self, message_id: str) -> Optional[int]:
+        """Позиция сообщения с данным ID или None"""
+        return self.positions.get(self.lookup_number(message_id))
+    
+    def get(self, message_id: str) -> Optional[StoredMessage]:
+        """Сообщение с данным ID или None"""
+        index = self.find(message_id) if message_id else None
+        return None if index is None else StoredMessage(self, index)
+    
+    def lookup_number(self, value: str) -> Optional[int]:
+        """Код номера или ID без добавления в таблицы; None - такого значения нет"""
+        if not value:
+            return -1
+        if self._is_canonical_number(value):
+            return int(value)
+        code = self._irregular_codes.get(value)
+        return None if code is None else -2 - code
+    
+    def sender_code(self, sender: str) -> Optional[int]:
+        """Номер отправителя в таблице senders или None"""
+        return self._sender_codes.get(sender)
+    
+    def decode_number(self, code: int) -> str:
+        if code >= 0:
+            return str(code)
+        return '' if code == -1 else self.irregular[-2 - code]
+    
+    def order(self, index: int) -> tuple:
+        """Ключ сортировки позиций: номер сообщения, затем позиция в документе"""
+        code = self.numbers[index]
+        if code >= 0:
+            return code, index
+        number = self.decode_number(code)
+        return (int(number) if number.isdigit() else 0), index
+    
+    def date(self, index: int) -> str:
+        raw = self.raw_dates.get(index)
+        if raw is not None:
+            return raw
+        return datetime.fromtimestamp(self.timestamps[index], timezone.utc).strftime(MESSAGE_DATE_FORMAT)
+    
+    def text(self, index: int) -> str:
+        if not self.compress_texts:
+            return self._texts[index]
+        block, item = divmod(index, MESSAGE_TEXT_BLOCK)
+        if block == len(self._text_blocks):
+            return self._texts[item]
+        data = self._block_cache.get(block)
+        if data is None:
+            data = self._block_cache[block] = zlib.decompress(self._text_blocks[block])
+            if len(self._block_cache) > MESSAGE_TEXT_CACHE_BLOCKS:
+                self._block_cache.popitem(last=False)
+        else:
+            self._block_cache.move_to_end(block)
+        start = self._text_ends[index - 1] if item else 0
+        return data[start:self._text_ends[index]].decode('utf-8')
+    
+    def _append_text(self, text: str):
+        self._texts.append(text)
+        if not self.compress_texts or len(self._texts) < MESSAGE_TEXT_BLOCK:
+            return
+        # Блок заполнен: тексты склеиваются в UTF-8 и сжимаются
+        encoded = [text.encode('utf-8') for text in self._texts]
+        end = 0
+        for data in encoded:
+            end += len(data)
+            self._text_ends.append(end)
+        self._text_blocks.append(zlib.compress(b''.join(encoded)))
+        self._texts = []
+    
+    def message_tags(self, index: int) -> List[str]:
+        return [self.tags[code] for code in self.tag_refs[self.tag_offsets[index]:self.tag_offsets[index + 1]]]
+    
+    @staticmethod
+    def _is_canonical_number(value: str) -> bool:
+        """Строка, которая без потерь переводится в int и обратно"""
+        return (value.isascii() and value.isdigit() and len(value) <= 18
+                and (value == '0' or value[0] != '0'))
+    
+    def _encode_number(self, value: str) -> int:
+        if not value:
+            return -1
+        if self._is_canonical_number(value):
+            return int(value)
+        return -2 - self._code(value, self.irregular, self._irregular_codes)
+    
+    def _encode_date(self, index: int, value: str) -> int:
+        match = MESSAGE_DATE_PATTERN.fullmatch(value)
+        if match:
+            day, month, year, hour, minute = map(int, match.groups())
+            if year >= 1970:
+                try:
+                    return int(datetime(year, month, day, hour, minute, tzinfo=timezone.utc).timestamp())
+                except ValueError:
+                    pass
+        self.raw_dates[index] = value
+        return 0
+    
+    @staticmethod
+    def _code(value: str, table: List[str], codes: Dict[str, int]) -> int:
+        """Номер строки в таблице; новая строка добавляется в конец"""
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(table)
+            table.append(value)
+        return code
+
+def _find_main_document_part(archive: zipfile.ZipFile) -> str:
+    """Находит путь к основной части документа по _rels/.rels"""
+    try:
+        rels = ET.fromstring(archive.read('_rels/.rels'))
+    except KeyError:
+        return 'word/document.xml'
+    
+    for rel in rels.iter(f'{REL_NS}Relationship'):
+        if rel.get('Type') == OFFICE_DOCUMENT_REL:
+            return posixpath.normpath(rel.get('Target', '').lstrip('/'))
+    
+    return 'word/document.xml'
+
+def _paragraph_text(paragraph: ET.Element) -> str:
+    """Собирает текст абзаца по тем же правилам, что и python-docx"""
+    parts = []
+    for child in paragraph:
+        if child.tag == f'{W_NS}r':
+            runs = (child,)
+        elif child.tag == f'{W_NS}hyperlink':
+            runs = child.findall(f'{W_NS}r')
+        else:
+            continue
+        
+        for run in runs:
+            for item in run:
+                tag = item.tag
+                if tag == f'{W_NS}t':
+                    parts.append(item.text or '')
+                elif tag in (f'{W_NS}tab', f'{W_NS}ptab'):
+                    parts.append('\t')
+                elif tag == f'{W_NS}cr':
+                    parts.append('\n')
+                elif tag == f'{W_NS}br':
+                    if item.get(f'{W_NS}type', 'textWrapping') == 'textWrapping':
+                        parts.append('\n')
+                elif tag == f'{W_NS}noBreakHyphen':
+                    parts.append('-')
+    return ''.join(parts)
+
+@profile_stage('docx')
+def iter_docx_paragraphs(docx_file: str) -> Iterator[str]:
+    """Потоково перебирает тексты абзацев верхнего уровня документа
+    
+    Возвращает те же строки, что и Document(docx_file).paragraphs, но
+    держит в памяти только текущий абзац: обработанные элементы сразу
+    удаляются из дерева.
+    """
+    with zipfile.ZipFile(docx_file) as archive:
+        part_name = _find_main_document_part(archive)
+        with archive.open(part_name) as document_xml:
+            depth = 0
+            body = None
+            for event, element in ET.iterparse(document_xml, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2 and element.tag == f'{W_NS}body':
+                        body = element
+                    continue
+                
+                # Дочерний элемент <w:body> полностью прочитан
+                if depth == 3 and body is not None:
+                    if element.tag == f'{W_NS}p':
+                        yield _paragraph_text(element)
+                    body.clear()
+                depth -= 1
+
+def _chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Разбивает поток элементов на списки длиной не более size"""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _message_hash(message: ChatMessage) -> str:
+    """Хеш содержимого сообщения для обнаружения изменений при синхронизации"""
+    payload = json.dumps([message.message_number, message.sender, message.date,
+                          message.reply_to, message.text, sorted(set(message.tags)),
+                          message.is_violetta_answer], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _qa_pair_key(qa_pair: Dict[str, Any]) -> str:
+    """Ключ пары вопрос-ответ: отсортированные ID сообщений вопроса"""
+    return json.dumps(sorted(qa_pair['question_ids']))
+
+def _fold_yo(text: str) -> str:
+    """Заменяет ё на е для поиска"""
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+def _sql_fold_yo(expression: str) -> str:
+    """SQL-выражение, заменяющее ё на е, как _fold_yo"""
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+class _MessageDraft:
+    """Сообщение, которое еще собирает парсер
+    
+    Абзацы текста копятся списком, теги - словарем без повторов; в поля
+    ChatMessage они переносятся один раз в finish().
+    """
+    __slots__ = ('message', 'text_parts', 'tags')
+    
+    def __init__(self, message: ChatMessage):
+        self.message = message
+        self.text_parts = []
+        self.tags = {}
+    
+    def finish(self) -> ChatMessage:
+        self.message.text = '\n'.join(self.text_parts)
+        self.message.tags = list(self.tags)
+        return self.message
+
 class ChatParser:
     """Парсер для обработки документов чата"""
     
+    # Увеличивается при изменении логики разбора, которое не видно по регулярному
+    # выражению и маркерам ниже; вместе с ними определяет версию в ключе кэша разбора
+    PARSER_VERSION = 3
+    
+    # Разделитель сообщений, символы строк-разделителей и тег ответа Виолетты
+    MESSAGE_SEPARATOR = '――――――'
+    SEPARATOR_CHARS = ('―', '─')
+    VIOLETTA_TAG = 'ответвиолетты'
+    
     def __init__(self):
-        self.message_patterns = {
-            'message_start': re.compile(r'Сообщение\s*#(\d+)'),
-            'sender': re.compile(r'От:\s*([^•]+?)\s*•'),
-            'date': re.compile(r'Дата:\s*([^•]+?)\s*•'),
-            'message_id': re.compile(r'ID:\s*(\d+)'),
-            'reply_to': re.compile(r'Ответ на сообщение:\s*(\d+)'),
-            'tags': re.compile(r'#[\wа-яА-ЯёЁ\d_-]+', re.IGNORECASE)
-        }
+        # Начало сообщения, поля заголовка и теги за один проход по строке.
+        # Каждая альтернатива поглощает только свой маркер, а значение забирает
+        # опережающей проверкой, поэтому маркеры внутри значения тоже находятся;
+        # _scan_line берет первое совпадение каждого поля
+        self.line_pattern = re.compile(r'''
+              Сообщение(?=\s*\#(\d+))
+            | От:(?=\s*([^•]+?)\s*•)
+            | Дата:(?=\s*([^•]+?)\s*•)
+            | ID:(?=\s*(\d+))
+            | Ответ\ на\ сообщение:(?=\s*(\d+))
+            | \#(?=([\wа-яА-ЯёЁ\d_-]+))
+        ''', re.VERBOSE)
+    
+    @property
+    def version(self) -> str:
+        """Версия парсера: PARSER_VERSION и отпечаток line_pattern и маркеров"""
+        fingerprint = json.dumps([
+            self.PARSER_VERSION, self.line_pattern.pattern, self.line_pattern.flags,
+            self.MESSAGE_SEPARATOR, self.SEPARATOR_CHARS, self.VIOLETTA_TAG,
+        ], ensure_ascii=False)
+        return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]
     
-    def parse_word_document(self, docx_file: str) -> List[ChatMessage]:
-        """Парсит Word-документ и извлекает структурированные данные"""
+    def parse_word_document(self, docx_file: str, streaming: bool = False) -> List[ChatMessage]:
+        """Парсит Word-документ и извлекает структурированные данные
+        
+        При streaming=True документ не загружается целиком через python-docx:
+        word/document.xml читается из архива по одному абзацу.
+        """
+        return list(self.iter_messages(docx_file, streaming=streaming))
+    
+    @profile_stage('parse')
+    def iter_messages(self, docx_file: str, streaming: bool = True) -> Iterator[ChatMessage]:
+        """Лениво извлекает сообщения из Word-документа по одному
+        
+        Сообщение отдается сразу после того, как начинается следующее, поэтому
+        в памяти держится только текущее сообщение. Статистика печатается,
+        когда документ прочитан до конца.
+        """
         
         print("📖 Чтение Word-документа...")
         
         if not os.path.exists(docx_file):
             raise FileNotFoundError(f"Файл {docx_file} не найден")
         
-        doc = Document(docx_file)
-        messages = []
+        if streaming:
+            paragraph_texts = iter_docx_paragraphs(docx_file)
+        else:
+            paragraph_texts = (paragraph.text for paragraph in Document(docx_file).paragraphs)
+        
+        yield from self.iter_paragraph_messages(paragraph_texts)
+    
+    def iter_paragraph_messages(self, paragraph_texts: Iterable[str]) -> Iterator[ChatMessage]:
+        """Извлекает сообщения из последовательности текстов абзацев
+        
+        Абзацы текста и теги сообщения копятся в _MessageDraft и переносятся
+        в ChatMessage один раз, когда сообщение закончено, поэтому разбор
+        линеен по длине сообщения.
+        """
+        message_count = 0
+        violetta_answers = 0
+        unique_tags = set()
         current_message = None
         
-        for paragraph in doc.paragraphs:
-            text = paragraph.text.strip()
+        for paragraph_text in itertools.chain(paragraph_texts, [None]):
+            # None отмечает конец документа и завершает последнее сообщение
+            text = paragraph_text.strip() if paragraph_text is not None else None
             
-            if not text:
+            if text == "":
                 continue
                 
+            line = self._scan_line(text) if text is not None else None
+            
             # Определяем начало нового сообщения
-            if self._is_message_start(text):
-                # Сохраняем предыдущее сообщение
-                if current_message and current_message.text:
-                    messages.append(current_message)
+            if text is None or self._is_message_start(line):
+                # Отдаем предыдущее сообщение
+                if current_message and current_message.text_parts:
+                    message = current_message.finish()
+                    # Определяем ответ Виолетты по тегу
+                    self._identify_violetta_answer(message)
+                    
+                    message_count += 1
+                    violetta_answers += message.is_violetta_answer
+                    unique_tags.update(message.tags)
+                    yield message
+                
+                if text is None:
+                    break
                 
                 # Создаем новое сообщение
-                current_message = self._create_new_message(text)
+                current_message = _MessageDraft(self._create_new_message(line.get('message_start', '')))
                 continue
             
             # Обрабатываем содержимое сообщения
             if current_message is not None:
-                self._process_message_content(current_message, text)
-        
-        # Добавляем последнее сообщение
-        if current_message and current_message.text:
-            messages.append(current_message)
-        
-        print(f"📝 Извлечено сообщений: {len(messages)}")
+                self._process_message_content(current_message, text, line)
         
-        # Определяем ответы Виолетты по тегу
-        self._identify_violetta_answers(messages)
+        print(f"📝 Извлечено сообщений: {message_count}")
         
         # Собираем статистику
-        self._print_statistics(messages)
+        self._print_statistics(len(unique_tags), violetta_answers)
+    
+    def _scan_line(self, text: str) -> Dict[str, Any]:
+        """Классифицирует строку за один проход line_pattern
+        
+        Возвращает первое значение каждого найденного поля, признаки
+        разделителей и список всех тегов строки под ключом 'tags'.
+        """
+        tags = []
+        line = {'tags': tags}
+        if self.MESSAGE_SEPARATOR in text:
+            line['message_separator'] = True
+        if any(char in text for char in self.SEPARATOR_CHARS):
+            line['separator'] = True
         
-        return messages
+        for message_start, sender, date, message_id, reply_to, tag in self.line_pattern.findall(text):
+            if tag:
+                tags.append('#' + tag)
+            elif sender:
+                line.setdefault('sender', sender)
+            elif date:
+                line.setdefault('date', date)
+            elif message_id:
+                line.setdefault('message_id', message_id)
+            elif reply_to:
+                line.setdefault('reply_to', reply_to)
+            else:
+                line.setdefault('message_start', message_start)
+        return line
     
-    def _is_message_start(self, text: str) -> bool:
-        """Определяет, является ли текст началом нового сообщения"""
-        return (self.message_patterns['message_start'].search(text) is not None or 
-                '――――――' in text)
+    def _is_message_start(self, line: Dict[str, Any]) -> bool:
+        """Определяет, является ли строка началом нового сообщения"""
+        return 'message_start' in line or 'message_separator' in line
     
-    def _create_new_message(self, text: str) -> ChatMessage:
+    def _create_new_message(self, message_number: str) -> ChatMessage:
         """Создает новый объект сообщения"""
-        message_number = ""
-        match = self.message_patterns['message_start'].search(text)
-        if match:
-            message_number = match.group(1)
-        
         return ChatMessage(
             message_number=message_number,
             sender="",
@@ -102,147 +849,710 @@ class ChatParser:
             tags=[]
         )
     
-    def _process_message_content(self, message: ChatMessage, text: str):
+    def _process_message_content(self, draft: '_MessageDraft', text: str,
+                                 line: Optional[Dict[str, Any]] = None):
         """Обрабатывает содержимое сообщения"""
+        message = draft.message
+        if line is None:
+            line = self._scan_line(text)
+        
         # Пропускаем разделители
-        if any(separator in text for separator in ['――', '─', '―']):
+        if 'separator' in line:
             return
         
         # Извлекаем метаданные
-        if not message.sender and self.message_patterns['sender'].search(text):
-            message.sender = self.message_patterns['sender'].search(text).group(1).strip()
-        
-        if not message.date and self.message_patterns['date'].search(text):
-            message.date = self.message_patterns['date'].search(text).group(1).strip()
-        
-        if not message.message_id and self.message_patterns['message_id'].search(text):
-            message.message_id = self.message_patterns['message_id'].search(text).group(1)
-        
-        if not message.reply_to and self.message_patterns['reply_to'].search(text):
-            message.reply_to = self.message_patterns['reply_to'].search(text).group(1)
-        
-        # Основной текст сообщения
-        if not any(pattern.search(text) for pattern in [
-            self.message_patterns['sender'],
-            self.message_patterns['date'], 
-            self.message_patterns['message_id'],
-            self.message_patterns['reply_to']
-        ]):
-            if message.text:
-                message.text += '\n' + text
-            else:
-                message.text = text
+        is_header = False
+        if 'sender' in line:
+            is_header = True
+            if not message.sender:
+                message.sender = line['sender'].strip()
+        
+        if 'date' in line:
+            is_header = True
+            if not message.date:
+                message.date = line['date'].strip()
+        
+        if 'message_id' in line:
+            is_header = True
+            if not message.message_id:
+                message.message_id = line['message_id']
+        
+        if 'reply_to' in line:
+            is_header = True
+            if not message.reply_to:
+                message.reply_to = line['reply_to']
+        
+        # Основной текст сообщения: абзацы склеиваются в finish()
+        if not is_header:
+            draft.text_parts.append(text)
             
-            # Извлекаем теги
-            tags = self.message_patterns['tags'].findall(text)
-            if tags:
-                # Очищаем теги от дубликатов
-                unique_tags = list(set(tags))
-                message.tags.extend(unique_tags)
-    
-    def _identify_violetta_answers(self, messages: List[ChatMessage]):
-        """Определяет ответы Виолетты по тегу #ответвиолетты"""
-        for message in messages:
-            # Проверяем наличие тега #ответвиолетты
-            has_answer_tag = any('ответвиолетты' in tag.lower() for tag in message.tags)
-            message.is_violetta_answer = has_answer_tag
-    
-    def _print_statistics(self, messages: List[ChatMessage]):
+            # Теги без повторов в порядке первого появления в сообщении
+            draft.tags.update(dict.fromkeys(line['tags']))
+    
+    def _identify_violetta_answer(self, message: ChatMessage):
+        """Определяет ответ Виолетты по тегу #ответвиолетты"""
+        # Проверяем наличие тега #ответвиолетты
+        message.is_violetta_answer = any(self.VIOLETTA_TAG in tag.lower() for tag in message.tags)
+    
+    def _print_statistics(self, unique_tags_count: int, violetta_answers: int):
         """Выводит статистику по сообщениям"""
-        all_tags = []
-        violetta_answers = 0
+        print(f"🏷️  Найдено уникальных тегов: {unique_tags_count}")
+        print(f"💡 Ответов Виолетты: {violetta_answers}")
+
+class ParseCache:
+    """Дисковый кэш результатов ChatParser
+    
+    Ключ записи - SHA-256 содержимого документа и версия парсера, поэтому
+    неизмененный документ повторно не разбирается. Записи хранятся как
+    последовательность pickle-объектов в папке .parse_cache рядом с документом
+    (или в cache_dir). Когда папка превышает max_size_bytes, удаляются
+    давно не использованные записи.
+    
+    Сообщения пишутся кортежами полей, а не объектами ChatMessage: класс
+    в pickle записывается вместе с модулем, и запись, сделанная при запуске
+    скрипта (__main__.ChatMessage), не читалась бы из импортированного модуля.
+    Запись заканчивается меткой ENTRY_FOOTER, которая проверяется до выдачи
+    первого сообщения: оборванная запись иначе читалась бы как более короткий
+    разбор. Нечитаемая или оборванная запись считается промахом и перезаписывается.
+    
+    Там же хранятся пары вопрос-ответ после группировки (save_qa_pairs):
+    их ключ - хеши всех документов, версия парсера, QAGrouper.GROUPER_VERSION
+    и правило сборки цепочек.
+    По ним этапы после группировки можно выполнить без разбора документов.
+    """
+    
+    # Первый объект записи разбора; меняется вместе с форматом записей
+    ENTRY_HEADER = ('ParseCache', 3)
+    # Последний объект записи разбора: без него запись оборвана
+    ENTRY_FOOTER = ('ParseCache', 'end')
+    # Ошибки чтения устаревшей или поврежденной записи
+    READ_ERRORS = (pickle.UnpicklingError, EOFError, AttributeError, ImportError,
+                   IndexError, TypeError, ValueError)
+    
+    def __init__(self, cache_dir: Optional[str] = None, max_size_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        # Хеши документов по (путь, время изменения, размер)
+        self._digests = {}
+    
+    def contains(self, parser: 'ChatParser', docx_file: str) -> bool:
+        """Есть ли в кэше результат разбора документа"""
+        return os.path.exists(self._entry_path(parser, docx_file))
+    
+    def load_qa_pairs(self, parser: 'ChatParser', docx_files: List[str],
+                      thread_policy: str = DEFAULT_THREAD_POLICY) -> Optional[List[Dict[str, Any]]]:
+        """Пары вопрос-ответ, сгруппированные из этих документов, или None"""
+        cache_path = self._qa_pairs_path(parser, docx_files, thread_policy)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                qa_pairs = pickle.load(f)
+        except self.READ_ERRORS as e:
+            print(f"⚠️ Запись кэша {os.path.basename(cache_path)} не читается: {e}")
+            os.remove(cache_path)
+            return None
+        os.utime(cache_path)
+        print(f"⚡ Пары вопрос-ответ взяты из кэша: {len(qa_pairs)}")
+        return qa_pairs
+    
+    def save_qa_pairs(self, parser: 'ChatParser', docx_files: List[str],
+                      qa_pairs: List[Dict[str, Any]], thread_policy: str = DEFAULT_THREAD_POLICY):
+        """Сохраняет результат группировки документов"""
+        cache_path = self._qa_pairs_path(parser, docx_files, thread_policy)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(qa_pairs, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
         
-        for msg in messages:
-            all_tags.extend(msg.tags)
-            if msg.is_violetta_answer:
-                violetta_answers += 1
+        self._evict(cache_path)
+    
+    @profile_stage('parse_cache')
+    def iter_messages(self, parser: 'ChatParser', docx_file: str) -> Iterator[ChatMessage]:
+        """Отдает сообщения из кэша, а при промахе разбирает документ и сохраняет результат"""
+        cache_path = self._entry_path(parser, docx_file)
         
-        unique_tags = set(all_tags)
+        if os.path.exists(cache_path):
+            cached = self._iter_entry(cache_path)
+            try:
+                first = next(cached, None)
+            except self.READ_ERRORS as e:
+                print(f"⚠️ Запись кэша {os.path.basename(cache_path)} не читается ({e}), "
+                      f"документ будет разобран заново")
+                os.remove(cache_path)
+            else:
+                print(f"⚡ Результат разбора {os.path.basename(docx_file)} взят из кэша")
+                os.utime(cache_path)
+                count = 0
+                if first is not None:
+                    count += 1
+                    yield first
+                for msg in cached:
+                    count += 1
+                    yield msg
+                print(f"📝 Извлечено сообщений: {count}")
+                return
         
-        print(f"🏷️  Найдено уникальных тегов: {len(unique_tags)}")
-        print(f"💡 Ответов Виолетты: {violetta_answers}")
+        # Пишем во временный файл и переименовываем только после полного разбора
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(self.ENTRY_HEADER, f, protocol=pickle.HIGHEST_PROTOCOL)
+                for msg in parser.iter_messages(docx_file):
+                    pickle.dump((msg.message_number, msg.sender, msg.date, msg.message_id,
+                                 msg.reply_to, msg.text, msg.tags, msg.is_violetta_answer),
+                                f, protocol=pickle.HIGHEST_PROTOCOL)
+                    yield msg
+                pickle.dump(self.ENTRY_FOOTER, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        self._evict(cache_path)
+    
+    def _iter_entry(self, cache_path: str) -> Iterator[ChatMessage]:
+        """Читает сообщения из записи разбора, проверяя ее заголовок и метку конца
+        
+        Ошибки READ_ERRORS возникают до первого сообщения, поэтому
+        iter_messages успевает считать запись промахом.
+        """
+        footer = pickle.dumps(self.ENTRY_FOOTER, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(cache_path, 'rb') as f:
+            if pickle.load(f) != self.ENTRY_HEADER:
+                raise ValueError("устаревший формат записи")
+            start = f.tell()
+            if f.seek(0, os.SEEK_END) - start < len(footer):
+                raise EOFError("запись оборвана")
+            f.seek(-len(footer), os.SEEK_END)
+            if f.read() != footer:
+                raise EOFError("запись оборвана")
+            f.seek(start)
+            while True:
+                fields = pickle.load(f)
+                if fields == self.ENTRY_FOOTER:
+                    return
+                yield ChatMessage(*fields)
+    
+    def _entry_path(self, parser: 'ChatParser', docx_file: str) -> str:
+        """Путь к записи кэша для документа"""
+        return os.path.join(self._cache_dir(docx_file),
+                            f"{self._digest(docx_file)}-{parser.version}.pickle")
+    
+    def _qa_pairs_path(self, parser: 'ChatParser', docx_files: List[str],
+                       thread_policy: str) -> str:
+        """Путь к записи кэша с парами вопрос-ответ для набора документов
+        
+        Порядок документов входит в ключ: от него зависит объединение выгрузок.
+        """
+        key = '\n'.join([parser.version, str(QAGrouper.GROUPER_VERSION), thread_policy]
+                        + [self._digest(path) for path in docx_files])
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir(docx_files[0]), f"{digest}-qa.pickle")
+    
+    def _cache_dir(self, docx_file: str) -> str:
+        """Папка кэша: cache_dir или .parse_cache рядом с документом"""
+        return self.cache_dir or os.path.join(os.path.dirname(os.path.abspath(docx_file)),
+                                              '.parse_cache')
+    
+    def _digest(self, docx_file: str) -> str:
+        """SHA-256 документа; пока файл не менялся, повторно не считается"""
+        stat = os.stat(docx_file)
+        key = (os.path.abspath(docx_file), stat.st_mtime_ns, stat.st_size)
+        if key not in self._digests:
+            self._digests[key] = _file_digest(docx_file)
+        return self._digests[key]
+    
+    def _evict(self, keep_path: str):
+        """Удаляет самые старые записи, пока папка кэша не уложится в лимит
+        
+        Только что записанная запись keep_path не удаляется.
+        """
+        entries = []
+        for entry in os.scandir(os.path.dirname(keep_path)):
+            if entry.is_file() and entry.name.endswith('.pickle') and entry.path != keep_path:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total_size = os.path.getsize(keep_path) + sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            os.remove(path)
+            total_size -= size
+
+def _parse_document_worker(docx_file: str, cache: Optional[ParseCache] = None) -> List[ChatMessage]:
+    """Разбирает один документ в дочернем процессе"""
+    parser = ChatParser()
+    if cache is not None:
+        return list(cache.iter_messages(parser, docx_file))
+    return parser.parse_word_document(docx_file, streaming=True)
+
+def collect_docx_files(paths: Iterable[str]) -> List[str]:
+    """Раскрывает папки в отсортированные списки .docx файлов, файлы оставляет как есть"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(str(child) for child in Path(path).glob('*.docx')
+                                if not child.name.startswith('~$')))
+        else:
+            files.append(path)
+    return files
+
+def parse_documents(docx_files: List[str], max_workers: Optional[int] = None,
+                    cache: Optional[ParseCache] = None) -> List[ChatMessage]:
+    """Параллельно разбирает несколько выгрузок и объединяет сообщения
+    
+    Документы разбираются в пуле процессов. Выгрузки пересекаются, поэтому
+    сообщения с одинаковым message_id объединяются: место в порядке
+    сообщений определяет первое вхождение, содержимое - последний по списку
+    документ. Файлы следует передавать от старых выгрузок к новым.
+    """
+    print(f"📚 Параллельный разбор документов: {len(docx_files)}")
+    
+    merged = []
+    positions = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        worker = functools.partial(_parse_document_worker, cache=cache)
+        for messages in executor.map(worker, docx_files):
+            for msg in messages:
+                if not msg.message_id:
+                    merged.append(msg)
+                elif msg.message_id in positions:
+                    merged[positions[msg.message_id]] = msg
+                else:
+                    positions[msg.message_id] = len(merged)
+                    merged.append(msg)
+    
+    print(f"🧩 Сообщений после объединения выгрузок: {len(merged)}")
+    return merged
+
+@dataclass(frozen=True)
+class ThreadPolicy:
+    """Правило сборки пары вопрос-ответ из дерева ответов
+    
+    Основа пары всегда одна: вопрос - сообщения одного отправителя с общим
+    reply_to, ответы - ответы Виолетты на них и продолжения этих ответов
+    (ответ Виолетты на собственный ответ). follow_ups добавляет в пару
+    уточняющие вопросы к ее ответам и ответы на них на любую глубину:
+    при cross_sender - от любого участника, иначе только от автора вопроса.
+    """
+    name: str
+    follow_ups: bool = False
+    cross_sender: bool = False
+
+THREAD_POLICIES = {policy.name: policy for policy in (
+    # Уточнение к ответу - отдельная пара (поведение по умолчанию)
+    ThreadPolicy('reply'),
+    # Диалог автора вопроса с Виолеттой - одна пара
+    ThreadPolicy('dialogue', follow_ups=True),
+    # Все ветки под вопросом, включая вопросы других участников, - одна пара
+    ThreadPolicy('conversation', follow_ups=True, cross_sender=True),
+)}
+
+class ReplyGraph:
+    """Лес ответов над MessageStore, строится за один линейный проход
+    
+    parent[i] - позиция сообщения, на которое отвечает сообщение i, или -1,
+    если ответа нет или исходного сообщения нет в хранилище. Дети хранятся
+    списками смежности в формате CSR: дети узла i - это
+    children[child_offsets[i]:child_offsets[i + 1]], по порядку сообщений.
+    roots[i] - корень дерева, в которое входит i; preorder - позиции в порядке
+    обхода в глубину, родитель всегда раньше детей.
+    
+    В испорченной выгрузке ответы могут образовать цикл: он разрывается
+    на самом раннем сообщении цикла, которое становится корнем.
+    """
+    
+    def __init__(self, store: MessageStore):
+        size = len(store)
+        # Номера сообщений почти всегда идут по возрастанию, и сортировка
+        # (timsort) на уже упорядоченных сериях работает за линейное время
+        self.order = sorted(range(size), key=store.order)
+        rank = array('q', bytes(8 * size))
+        for position, index in enumerate(self.order):
+            rank[index] = position
+        
+        self.parent = array('q', [-1]) * size
+        positions = store.positions
+        for index in range(size):
+            code = store.reply_to[index]
+            if code != -1:
+                parent = positions.get(code, -1)
+                if parent != index:
+                    self.parent[index] = parent
+        
+        # Подсчет детей и префиксные суммы; дети раскладываются по порядку
+        # сообщений, поэтому списки смежности сразу отсортированы
+        self.child_offsets = array('q', bytes(8 * (size + 1)))
+        for index in range(size):
+            if self.parent[index] != -1:
+                self.child_offsets[self.parent[index] + 1] += 1
+        for index in range(size):
+            self.child_offsets[index + 1] += self.child_offsets[index]
+        self.children = array('q', bytes(8 * self.child_offsets[size]))
+        filled = self.child_offsets[:size]
+        for index in self.order:
+            parent = self.parent[index]
+            if parent != -1:
+                self.children[filled[parent]] = index
+                filled[parent] += 1
+        
+        self.roots = array('q', [-1]) * size
+        self.preorder = array('q')
+        for index in self.order:
+            if self.parent[index] == -1:
+                self._visit(index)
+        # Не обойденные сообщения ведут вверх к циклу ответов
+        for index in self.order:
+            if self.roots[index] == -1:
+                self._visit(self._break_cycle(index, rank))
+    
+    def __len__(self) -> int:
+        return len(self.parent)
+    
+    def children_of(self, index: int) -> array:
+        """Позиции прямых ответов на сообщение по порядку сообщений"""
+        return self.children[self.child_offsets[index]:self.child_offsets[index + 1]]
+    
+    def _visit(self, root: int):
+        """Обход в глубину от корня без рекурсии: заполняет roots и preorder"""
+        stack = [root]
+        while stack:
+            index = stack.pop()
+            if self.roots[index] != -1:
+                continue
+            self.roots[index] = root
+            self.preorder.append(index)
+            # В стек в обратном порядке, чтобы ранние ответы обходились первыми
+            stack.extend(reversed(self.children_of(index)))
+    
+    def _break_cycle(self, index: int, rank: array) -> int:
+        """Разрывает цикл, к которому ведет index, и возвращает новый корень"""
+        seen = set()
+        while index not in seen:
+            seen.add(index)
+            index = self.parent[index]
+        # index лежит на цикле: выбираем его самое раннее сообщение
+        cycle_start, earliest = index, index
+        index = self.parent[index]
+        while index != cycle_start:
+            if rank[index] < rank[earliest]:
+                earliest = index
+            index = self.parent[index]
+        self.parent[earliest] = -1
+        return earliest
 
 class QAGrouper:
-    """Группировщик вопросов и ответов"""
+    """Группировщик вопросов и ответов
     
-    def __init__(self, messages: List[ChatMessage]):
-        self.messages = messages
-        self.messages_by_id = {msg.message_id: msg for msg in messages if msg.message_id}
+    Сообщения хранятся в MessageStore (self.messages), индексы ссылаются
+    на их позиции в хранилище, а не на объекты сообщений. Если передать
+    готовое хранилище, группировщик работает прямо с ним.
     
+    Пары собираются по лесу ответов (ReplyGraph) за линейное время, правило
+    сборки задает thread_policy - имя из THREAD_POLICIES.
+    """
+    
+    # Увеличивается при изменении правил группировки; входит в ключ
+    # кэша пар вопрос-ответ (ParseCache.save_qa_pairs)
+    GROUPER_VERSION = 2
+    
+    def __init__(self, messages: Iterable[ChatMessage] = (),
+                 thread_policy: str = DEFAULT_THREAD_POLICY):
+        if thread_policy not in THREAD_POLICIES:
+            raise ValueError(f"неизвестное правило сборки цепочек: {thread_policy}; "
+                             f"доступны: {', '.join(THREAD_POLICIES)}")
+        self.policy = THREAD_POLICIES[thread_policy]
+        # Индексы ответов: код reply_to -> позиции ответов Виолетты и
+        # (код reply_to, номер отправителя) -> позиции прочих сообщений
+        self.answers_by_reply_to = defaultdict(list)
+        self.replies_by_reply_to_sender = defaultdict(list)
+        # Ответы Виолетты по (reply_to, sender) нужны только для поиска
+        # затронутых цепочек при инкрементальной синхронизации
+        self.answers_by_reply_to_sender = defaultdict(list)
+        # Лес ответов и собранные по нему пары; сбрасываются новыми сообщениями
+        self._graph = None
+        self._threads = None
+        if isinstance(messages, MessageStore):
+            self.messages = messages
+            for index in range(len(messages)):
+                self._index_position(index)
+        else:
+            self.messages = MessageStore()
+            for _ in self.index_messages(messages):
+                pass
+    
+    @profile_stage('index')
+    def index_messages(self, messages: Iterable[ChatMessage]) -> Iterator[ChatMessage]:
+        """Добавляет сообщения в хранилище и индекс группировщика и передает их дальше
+        
+        Позволяет индексировать поток сообщений параллельно с его записью
+        в базу данных, не собирая отдельный список в вызывающем коде.
+        """
+        for msg in messages:
+            self._index_position(self.messages.append(msg))
+            yield msg
+    
+    def _index_position(self, index: int):
+        """Добавляет сообщение хранилища в индексы ответов"""
+        store = self.messages
+        reply_to = store.reply_to[index]
+        key = (reply_to, store.sender_ids[index])
+        if store.violetta[index]:
+            self.answers_by_reply_to[reply_to].append(index)
+            self.answers_by_reply_to_sender[key].append(index)
+        else:
+            self.replies_by_reply_to_sender[key].append(index)
+        self._graph = None
+        self._threads = None
+    
+    @property
+    def graph(self) -> ReplyGraph:
+        """Лес ответов по текущим сообщениям; строится один раз до следующего добавления"""
+        if self._graph is None:
+            self._graph = ReplyGraph(self.messages)
+        return self._graph
+    
+    @profile_stage('group')
     def group_questions_answers(self) -> List[Dict[str, Any]]:
         """Группирует вопросы и ответы, учитывая сложные цепочки"""
         
         print("🔗 Группировка вопросов и ответов...")
         
-        violetta_answers = [msg for msg in self.messages if msg.is_violetta_answer]
+        qa_pairs = list(self.iter_questions_answers())
+        
+        self._print_qa_statistics(qa_pairs)
+        return qa_pairs
+    
+    def iter_questions_answers(self, answer_ids: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Лениво отдает пары вопрос-ответ по мере их построения
+        
+        Если задан answer_ids, пары строятся только для цепочек этих ответов.
+        Пары идут в порядке своего первого ответа в документе.
+        """
+        store = self.messages
+        
+        if answer_ids is None:
+            violetta_answers = [index for index in range(len(store)) if store.violetta[index]]
+        else:
+            selected = {store.lookup_number(message_id) for message_id in answer_ids}
+            violetta_answers = [index for index in range(len(store))
+                                if store.violetta[index] and store.ids[index] in selected]
         print(f"💡 Найдено ответов Виолетты: {len(violetta_answers)}")
         
-        qa_pairs = []
-        processed_questions = set()
+        pair_of, questions, answers = self._assemble_threads()
+        emitted = set()
         
         for answer in violetta_answers:
-            if not answer.reply_to:
+            if store.reply_to[answer] == -1:
                 continue
-                
-            question_thread = self._find_question_thread(answer.reply_to)
             
-            if not question_thread:
-                print(f"⚠️ Не найдена цепочка вопроса для ответа {answer.message_id}")
+            pair = pair_of[answer]
+            if pair == -1:
+                print(f"⚠️ Не найдена цепочка вопроса для ответа {store[answer].message_id}")
                 continue
             
-            question_key = tuple(sorted([msg.message_id for msg in question_thread if msg.message_id]))
-            
-            if question_key in processed_questions:
+            if pair in emitted:
                 continue
-                
-            processed_questions.add(question_key)
-            
-            answer_thread = self._find_answer_thread(question_thread)
+            emitted.add(pair)
             
             # Создаем пару вопрос-ответ
-            qa_pair = self._create_qa_pair(question_thread, answer_thread)
-            qa_pairs.append(qa_pair)
-        
-        self._print_qa_statistics(qa_pairs)
-        return qa_pairs
+            yield self._create_qa_pair([store[index] for index in questions[pair]],
+                                       [store[index] for index in answers[pair]])
     
-    def _find_question_thread(self, start_message_id: str) -> List[ChatMessage]:
-        """Находит цепочку вопросов по ID начального сообщения"""
-        start_message = self.messages_by_id.get(start_message_id)
-        if not start_message:
-            return []
+    def thread_root(self, message_id: str) -> Optional[str]:
+        """ID первого сообщения дерева ответов, в которое входит сообщение"""
+        index = self.messages.find(message_id)
+        if index is None:
+            return None
+        return self.messages[self.graph.roots[index]].message_id
+    
+    def thread_members(self, message_id: str) -> set:
+        """Возвращает ID всех сообщений с тем же reply_to и отправителем, включая ответы"""
+        msg = self.messages.get(message_id)
+        if msg is None or not msg.reply_to:
+            return {message_id}
+        return self._members_of(msg.reply_to, msg.sender) | {message_id}
+    
+    def _members_of(self, reply_to: str, sender: str) -> set:
+        """ID сообщений с заданными reply_to и отправителем"""
+        store = self.messages
+        key = (store.lookup_number(reply_to), store.sender_code(sender))
+        return {store.decode_number(store.ids[index])
+                for index_by_key in (self.replies_by_reply_to_sender, self.answers_by_reply_to_sender)
+                for index in index_by_key.get(key, []) if store.ids[index] != -1}
+    
+    def tree_members(self, message_id: str) -> set:
+        """Возвращает ID всех сообщений дерева ответов, в которое входит сообщение"""
+        store = self.messages
+        index = store.find(message_id)
+        if index is None:
+            return {message_id}
+        graph = self.graph
+        # Обход от корня; visited нужен, потому что разорванный цикл
+        # остается в списках детей бывшего родителя нового корня
+        visited = set()
+        stack = [graph.roots[index]]
+        while stack:
+            index = stack.pop()
+            if index not in visited:
+                visited.add(index)
+                stack.extend(graph.children_of(index))
+        return {store.decode_number(store.ids[index]) for index in visited
+                if store.ids[index] != -1} | {message_id}
+    
+    def find_affected_ids(self, changed_ids: Iterable[str],
+                          previous_links: Optional[Dict[str, tuple]] = None) -> set:
+        """Расширяет набор измененных сообщений до всех, чьи цепочки они затрагивают
         
-        parent_id = start_message.reply_to
-        sender = start_message.sender
+        Учитываются само сообщение, сообщение, на которое оно отвечает, и их
+        соседи по цепочке (тот же reply_to и отправитель). previous_links
+        хранит прежние (reply_to, sender) сообщений, чтобы задеть и цепочку,
+        из которой сообщение ушло. Пары, содержащие любой из полученных ID,
+        нужно пересобрать.
         
-        if not parent_id:
-            return [start_message]
+        Если политика собирает уточнения (follow_ups), состав пары зависит
+        от всего дерева над ней: перенос ветки переносит и уточнения к ее
+        ответам. Тогда затронутыми считаются целые деревья ответов, в которые
+        входят эти сообщения сейчас и в которые входило сообщение раньше.
         
-        # Ищем все сообщения от того же отправителя с тем же reply_to
-        question_thread = []
-        for msg in self.messages:
-            if (msg.reply_to == parent_id and 
-                msg.sender == sender and 
-                not msg.is_violetta_answer):
-                question_thread.append(msg)
+        ID, которых нет в группировщике, - удаленные из выгрузки сообщения:
+        затронуты и ответы на них, которые теперь остались без исходного.
+        """
+        previous_links = previous_links or {}
+        changed_ids = set(changed_ids)
+        store = self.messages
+        missing = {store.lookup_number(message_id) for message_id in changed_ids
+                   if store.find(message_id) is None} - {None, -1}
+        if missing:
+            changed_ids.update(store.decode_number(store.ids[index]) for index in range(len(store))
+                               if store.reply_to[index] in missing and store.ids[index] != -1)
         
-        # Сортируем по номеру сообщения
-        question_thread.sort(key=lambda x: int(x.message_number) if x.message_number.isdigit() else 0)
+        affected = set()
+        for message_id in changed_ids:
+            seeds = {message_id}
+            msg = self.messages.get(message_id)
+            if msg is not None and msg.reply_to:
+                seeds.add(msg.reply_to)
+            
+            old_reply_to, old_sender = previous_links.get(message_id, ('', ''))
+            if old_reply_to:
+                seeds.add(old_reply_to)
+                affected.update(self._members_of(old_reply_to, old_sender))
+            
+            for seed in seeds:
+                affected.update(self.thread_members(seed))
         
-        return question_thread
+        if self.policy.follow_ups:
+            trees = set()
+            for message_id in affected:
+                if message_id not in trees:
+                    trees.update(self.tree_members(message_id))
+            affected |= trees
+        return affected
     
-    def _find_answer_thread(self, question_thread: List[ChatMessage]) -> List[ChatMessage]:
-        """Находит все ответы на цепочку вопросов"""
-        question_ids = [msg.message_id for msg in question_thread if msg.message_id]
+    def answers_to(self, message_ids: Iterable[str]) -> set:
+        """Возвращает ID ответов Виолетты на указанные сообщения и сами ответы среди них"""
+        store = self.messages
+        answers = set()
+        for message_id in message_ids:
+            msg = store.get(message_id)
+            if msg is not None and msg.is_violetta_answer:
+                answers.add(message_id)
+            answers.update(store.decode_number(store.ids[index]) for index in
+                           self.answers_by_reply_to.get(store.lookup_number(message_id), []))
+        return answers
+    
+    def answers_to_rebuild(self, affected_ids: Iterable[str],
+                           stale_pairs: Iterable[Dict[str, Any]]) -> set:
+        """ID ответов Виолетты, по которым пересобираются пары после изменений
         
-        answers = []
-        for msg in self.messages:
-            if (msg.is_violetta_answer and 
-                msg.reply_to in question_ids):
-                answers.append(msg)
+        affected_ids - результат find_affected_ids, stale_pairs - удаляемые
+        пары, которые содержат эти сообщения (нужны question_ids и answer_ids).
+        Удаленные пары могли держаться на ответах к соседям по цепочке,
+        поэтому учитываются и ответы на всю цепочку их вопроса.
+        """
+        answer_ids = self.answers_to(affected_ids)
+        stale_question_ids = set()
+        for qa in stale_pairs:
+            stale_question_ids.update(qa['question_ids'])
+            answer_ids.update(qa['answer_ids'])
+        for question_id in stale_question_ids:
+            answer_ids.update(self.answers_to(self.thread_members(question_id)))
+        return answer_ids
+    
+    def _assemble_threads(self) -> tuple:
+        """Собирает пары по лесу ответов за один проход в порядке обхода
         
-        answers.sort(key=lambda x: int(x.message_number) if x.message_number.isdigit() else 0)
-        return answers
+        Возвращает (pair_of, questions, answers): pair_of[i] - пара ответа
+        Виолетты i или -1, questions и answers - позиции сообщений пары по
+        порядку. Пара обозначается позицией первого сообщения ее исходного
+        вопроса. Части вопроса (тот же отправитель и reply_to) и уточнения,
+        которые допускает политика, объединяются системой непересекающихся
+        множеств; обход идет от родителей к детям, поэтому к моменту, когда
+        встречается ответ или уточнение, пара сообщения выше уже известна.
+        """
+        if self._threads is not None:
+            return self._threads
+        
+        store = self.messages
+        graph = self.graph
+        policy = self.policy
+        size = len(store)
+        
+        # unit[i] - первая позиция вопроса, частью которого является сообщение i;
+        # link - лес непересекающихся множеств над этими позициями
+        unit = array('q', [-1]) * size
+        first_part = {}
+        for index in range(size):
+            if not store.violetta[index]:
+                reply_to = store.reply_to[index]
+                key = (reply_to, store.sender_ids[index]) if reply_to != -1 else (index,)
+                unit[index] = first_part.setdefault(key, index)
+        link = array('q', range(size))
+        
+        def find(index: int) -> int:
+            while link[index] != index:
+                link[index] = link[link[index]]
+                index = link[index]
+            return index
+        
+        # answer_of[i] - вопрос, к которому относится ответ Виолетты i
+        answer_of = array('q', [-1]) * size
+        for index in graph.preorder:
+            parent = graph.parent[index]
+            if parent == -1:
+                continue
+            if store.violetta[index]:
+                # Ответ на вопрос или продолжение собственного ответа
+                answer_of[index] = unit[parent] if not store.violetta[parent] else answer_of[parent]
+            elif policy.follow_ups and store.violetta[parent] and answer_of[parent] != -1:
+                pair = find(answer_of[parent])
+                if policy.cross_sender or store.sender_ids[index] == store.sender_ids[pair]:
+                    follow_up = find(unit[index])
+                    if follow_up != pair:
+                        link[follow_up] = pair
+        
+        pair_of = array('q', [-1]) * size
+        questions = defaultdict(list)
+        answers = defaultdict(list)
+        for index in graph.order:
+            if store.violetta[index]:
+                if answer_of[index] != -1:
+                    pair_of[index] = find(answer_of[index])
+                    answers[pair_of[index]].append(index)
+            else:
+                questions[find(unit[index])].append(index)
+        
+        self._threads = pair_of, questions, answers
+        return self._threads
     
     def _create_qa_pair(self, question_thread: List[ChatMessage], 
                        answer_thread: List[ChatMessage]) -> Dict[str, Any]:
@@ -284,181 +1594,1244 @@ class QAGrouper:
 class DatabaseManager:
     """Менеджер для работы с различными форматами базы данных"""
     
-    def __init__(self, db_path: str = "chat_database.db"):
+    # Настройки SQLite для полной пересборки базы: журнал в памяти и без fsync.
+    # База целиком перестраивается из документа, поэтому при сбое ее
+    # достаточно пересоздать
+    REBUILD_PRAGMAS = {
+        'journal_mode': 'MEMORY',
+        'synchronous': 'OFF',
+        'cache_size': -65536,
+    }
+    
+    # Настройки для синхронизации (sync_sqlite): постоянная база обновляется
+    # на месте и не пересоздается, поэтому журнал на диске и fsync при фиксации
+    SYNC_PRAGMAS = {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -65536,
+    }
+    
+    # Версия схемы хранится в PRAGMA user_version. Версия 2 - нормализованная
+    # схема с целыми ключами и таблицами связей
+    SCHEMA_VERSION = 2
+    
+    def __init__(self, db_path: str = "chat_database.db",
+                 pragmas: Optional[Dict[str, Any]] = None,
+                 sync_pragmas: Optional[Dict[str, Any]] = None):
         self.db_path = db_path
+        self.pragmas = dict(self.REBUILD_PRAGMAS if pragmas is None else pragmas)
+        self.sync_pragmas = dict(self.SYNC_PRAGMAS if sync_pragmas is None else sync_pragmas)
     
-    def save_to_sqlite(self, messages: List[ChatMessage], qa_pairs: List[Dict[str, Any]]):
+    @contextlib.contextmanager
+    def _connect(self, pragmas: Optional[Dict[str, Any]] = None) -> Iterator[sqlite3.Connection]:
+        """Соединение с базой на время блока with, с PRAGMA (по умолчанию для пересборки)
+        
+        Как и with sqlite3.connect(...), фиксирует транзакцию или откатывает
+        ее при ошибке, но после блока еще и закрывает соединение: открытый
+        дескриптор не дал бы подменить файл базы (staged_database) в Windows.
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for name, value in (self.pragmas if pragmas is None else pragmas).items():
+                conn.execute(f'PRAGMA {name} = {value}')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def save_to_sqlite(self, messages: Iterable[ChatMessage], qa_pairs: Iterable[Dict[str, Any]],
+                       thread_policy: str = DEFAULT_THREAD_POLICY):
         """Сохраняет данные в SQLite базу данных"""
+        self.init_sqlite(thread_policy)
+        self.save_messages(messages)
+        self.save_qa_pairs(qa_pairs)
+    
+    def init_sqlite(self, thread_policy: str = DEFAULT_THREAD_POLICY):
+        """Пересоздает таблицы SQLite базы данных
+        
+        thread_policy - правило, по которому будут собраны пары; оно
+        запоминается в базе, и синхронизация с другим правилом невозможна.
+        """
         print("💾 Сохранение в SQLite базу данных...")
         
-        # Инициализируем базу данных внутри одного соединения
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             # Удаляем существующие таблицы если они есть
+            conn.execute('DROP TABLE IF EXISTS library_meta')
+            conn.execute('DROP TABLE IF EXISTS qa_pair_tags')
+            conn.execute('DROP TABLE IF EXISTS qa_pair_messages')
             conn.execute('DROP TABLE IF EXISTS message_tags')
             conn.execute('DROP TABLE IF EXISTS tags')
+            conn.execute('DROP TABLE IF EXISTS qa_pairs_fts')
             conn.execute('DROP TABLE IF EXISTS qa_pairs')
             conn.execute('DROP TABLE IF EXISTS messages')
+            conn.execute('DROP TABLE IF EXISTS senders')
+            conn.execute('PRAGMA user_version = 0')
             
             # Создаем таблицы заново
-            conn.execute('''
-                CREATE TABLE messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    message_number INTEGER,
-                    sender TEXT,
-                    date TEXT,
-                    message_id TEXT UNIQUE,
-                    reply_to TEXT,
-                    text TEXT,
-                    is_violetta_answer BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            self._create_schema(conn)
+            conn.execute("INSERT INTO library_meta (key, value) VALUES ('thread_policy', ?)",
+                         (thread_policy,))
+    
+    def thread_policy(self) -> Optional[str]:
+        """Правило сборки цепочек, по которому собраны пары базы, или None, если базы нет
+        
+        В базах, созданных до появления правил, пары собраны по правилу
+        по умолчанию.
+        """
+        if not os.path.exists(self.db_path):
+            return None
+        with self._connect(self.sync_pragmas) as conn:
+            return self._stored_thread_policy(conn)
+    
+    def _stored_thread_policy(self, conn: sqlite3.Connection) -> Optional[str]:
+        """Правило сборки из library_meta; None для пустой базы"""
+        if self._table_exists(conn, 'library_meta'):
+            row = conn.execute("SELECT value FROM library_meta WHERE key = 'thread_policy'").fetchone()
+            if row:
+                return row[0]
+        if self._table_exists(conn, 'messages') and conn.execute(
+                'SELECT 1 FROM messages LIMIT 1').fetchone():
+            return DEFAULT_THREAD_POLICY
+        return None
+    
+    def _create_schema(self, conn: sqlite3.Connection):
+        """Создает недостающие таблицы и переводит старые базы на текущую схему
+        
+        Схема нормализована: сообщения, отправители и теги связаны целыми
+        ключами, состав и теги пар вопрос-ответ хранятся в таблицах связей
+        qa_pair_messages и qa_pair_tags. JSON-столбцы qa_pairs сохранены для
+        выгрузки пар без соединений.
+        
+        Схема и перенос данных старой версии выполняются в одной явной
+        транзакции и фиксируются до того, как вызывающий код начнет писать
+        сообщения: без нее ALTER TABLE и CREATE TABLE фиксировались бы сразу,
+        и сбой посреди переноса оставлял бы базу наполовину обновленной.
+        """
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN')
+        try:
+            self._apply_schema(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    
+    def _apply_schema(self, conn: sqlite3.Connection):
+        """Создает таблицы и переносит данные старой схемы внутри начатой транзакции"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        legacy = version < self.SCHEMA_VERSION and self._table_exists(conn, 'messages')
+        
+        if legacy:
+            # Столбцы, которых не было в прежних версиях схемы
+            self._add_missing_column(conn, 'messages', 'content_hash', 'TEXT')
+            self._add_missing_column(conn, 'messages', 'sender_id', 'INTEGER REFERENCES senders (id)')
+            self._add_missing_column(conn, 'messages', 'reply_to_id', 'INTEGER REFERENCES messages (id)')
+            self._add_missing_column(conn, 'qa_pairs', 'question_key', 'TEXT')
             
+            # Старая message_tags ссылалась на текстовые message_id и tag
+            conn.execute('DROP INDEX IF EXISTS idx_message_tags_tag')
+            conn.execute('DROP INDEX IF EXISTS idx_messages_sender')
+            conn.execute('DROP INDEX IF EXISTS idx_messages_reply_to')
+            # Таблица уже переименована, если базу обновляла версия без транзакции
+            if (self._table_exists(conn, 'message_tags')
+                    and not self._table_exists(conn, 'message_tags_legacy')):
+                conn.execute('ALTER TABLE message_tags RENAME TO message_tags_legacy')
+        
+        # Параметры, с которыми собрана база (правило сборки цепочек)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS library_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS senders (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            )
+        ''')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_number INTEGER,
+                sender TEXT,
+                date TEXT,
+                message_id TEXT UNIQUE,
+                reply_to TEXT,
+                text TEXT,
+                is_violetta_answer BOOLEAN DEFAULT FALSE,
+                content_hash TEXT,
+                sender_id INTEGER REFERENCES senders (id),
+                reply_to_id INTEGER REFERENCES messages (id),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tag TEXT UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS message_tags (
+                message_id INTEGER REFERENCES messages (id),
+                tag_id INTEGER REFERENCES tags (id),
+                PRIMARY KEY (message_id, tag_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS qa_pairs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question_ids TEXT,
+                question_text TEXT,
+                question_sender TEXT,
+                question_date TEXT,
+                answer_ids TEXT,
+                answer_text TEXT,
+                tags TEXT,
+                answer_date TEXT,
+                question_key TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_qa_pairs_question_key ON qa_pairs (question_key)')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS qa_pair_messages (
+                qa_pair_id INTEGER REFERENCES qa_pairs (id),
+                message_id INTEGER REFERENCES messages (id),
+                role TEXT CHECK (role IN ('question', 'answer')),
+                position INTEGER,
+                PRIMARY KEY (qa_pair_id, role, position)
+            ) WITHOUT ROWID
+        ''')
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS qa_pair_tags (
+                tag_id INTEGER REFERENCES tags (id),
+                qa_pair_id INTEGER REFERENCES qa_pairs (id),
+                PRIMARY KEY (tag_id, qa_pair_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS qa_pairs_links_delete AFTER DELETE ON qa_pairs BEGIN
+                DELETE FROM qa_pair_messages WHERE qa_pair_id = old.id;
+                DELETE FROM qa_pair_tags WHERE qa_pair_id = old.id;
+            END
+        ''')
+        
+        if legacy:
+            self._migrate_legacy_data(conn)
+        
+        conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        
+        self._create_search_index(conn)
+    
+    def _migrate_legacy_data(self, conn: sqlite3.Connection):
+        """Переносит данные старой схемы с текстовыми ключами и JSON-списками в таблицы связей"""
+        print("🔧 Обновление схемы SQLite базы данных...")
+        
+        conn.execute('''
+            INSERT OR IGNORE INTO senders (name)
+            SELECT DISTINCT sender FROM messages WHERE sender != ''
+        ''')
+        conn.execute('''
+            UPDATE messages SET sender_id = (SELECT id FROM senders WHERE name = messages.sender)
+        ''')
+        self._resolve_reply_links(conn)
+        
+        if self._table_exists(conn, 'message_tags_legacy'):
             conn.execute('''
-                CREATE TABLE tags (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tag TEXT UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
+                INSERT OR IGNORE INTO message_tags (message_id, tag_id)
+                SELECT messages.id, tags.id
+                FROM message_tags_legacy AS legacy
+                JOIN messages ON messages.message_id = legacy.message_id
+                JOIN tags ON tags.tag = legacy.tag
             ''')
-            
-            conn.execute('''
-                CREATE TABLE message_tags (
-                    message_id TEXT,
-                    tag TEXT,
-                    PRIMARY KEY (message_id, tag),
-                    FOREIGN KEY (message_id) REFERENCES messages (message_id),
-                    FOREIGN KEY (tag) REFERENCES tags (tag)
-                )
+            conn.execute('DROP TABLE message_tags_legacy')
+        
+        # Ключи пар, сохраненных до появления инкрементальной синхронизации
+        conn.executemany('UPDATE qa_pairs SET question_key = ? WHERE id = ?', [
+            (_qa_pair_key({'question_ids': json.loads(question_ids)}), pair_id)
+            for pair_id, question_ids in conn.execute(
+                'SELECT id, question_ids FROM qa_pairs WHERE question_key IS NULL').fetchall()
+        ])
+        
+        for role, column in (('question', 'question_ids'), ('answer', 'answer_ids')):
+            conn.execute(f'''
+                INSERT OR IGNORE INTO qa_pair_messages (qa_pair_id, message_id, role, position)
+                SELECT qa_pairs.id, messages.id, '{role}', ids.key
+                FROM qa_pairs, json_each(qa_pairs.{column}) AS ids
+                JOIN messages ON messages.message_id = ids.value
             ''')
-            
-            conn.execute('''
-                CREATE TABLE qa_pairs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    question_ids TEXT,
-                    question_text TEXT,
-                    question_sender TEXT,
-                    question_date TEXT,
-                    answer_ids TEXT,
-                    answer_text TEXT,
-                    tags TEXT,
-                    answer_date TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        conn.execute('''
+            INSERT OR IGNORE INTO qa_pair_tags (tag_id, qa_pair_id)
+            SELECT tags.id, qa_pairs.id
+            FROM qa_pairs, json_each(qa_pairs.tags) AS pair_tags
+            JOIN tags ON tags.tag = pair_tags.value
+        ''')
+        
+        self._create_indexes(conn)
+    
+    def _table_exists(self, conn: sqlite3.Connection, name: str) -> bool:
+        """Проверяет, есть ли в базе таблица name"""
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone() is not None
+    
+    def _create_search_index(self, conn: sqlite3.Connection):
+        """Создает полнотекстовый индекс FTS5 по вопросам и ответам
+        
+        Индекс хранит только токены, текст берется из qa_pairs. Триггеры
+        поддерживают индекс в актуальном состоянии при любых изменениях пар.
+        Токенизатор unicode61 не отождествляет ё и е, поэтому в индекс
+        попадает текст с ё, замененной на е.
+        """
+        if self._table_exists(conn, 'qa_pairs_fts'):
+            return
+        
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE qa_pairs_fts USING fts5 (
+                question_text,
+                answer_text,
+                content = 'qa_pairs',
+                content_rowid = 'id',
+                tokenize = '{FTS_TOKENIZER}',
+                prefix = '2 3 4'
+            )
+        ''')
+        
+        new_values = f"new.id, {_sql_fold_yo('new.question_text')}, {_sql_fold_yo('new.answer_text')}"
+        old_values = f"old.id, {_sql_fold_yo('old.question_text')}, {_sql_fold_yo('old.answer_text')}"
+        conn.execute(f'''
+            CREATE TRIGGER qa_pairs_fts_insert AFTER INSERT ON qa_pairs BEGIN
+                INSERT INTO qa_pairs_fts (rowid, question_text, answer_text)
+                VALUES ({new_values});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER qa_pairs_fts_delete AFTER DELETE ON qa_pairs BEGIN
+                INSERT INTO qa_pairs_fts (qa_pairs_fts, rowid, question_text, answer_text)
+                VALUES ('delete', {old_values});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER qa_pairs_fts_update AFTER UPDATE OF question_text, answer_text ON qa_pairs BEGIN
+                INSERT INTO qa_pairs_fts (qa_pairs_fts, rowid, question_text, answer_text)
+                VALUES ('delete', {old_values});
+                INSERT INTO qa_pairs_fts (rowid, question_text, answer_text)
+                VALUES ({new_values});
+            END
+        ''')
+        
+        # Индексируем пары, сохраненные до появления полнотекстового поиска
+        conn.execute(f'''
+            INSERT INTO qa_pairs_fts (rowid, question_text, answer_text)
+            SELECT id, {_sql_fold_yo('question_text')}, {_sql_fold_yo('answer_text')} FROM qa_pairs
+        ''')
+    
+    # Столбцы пары вопрос-ответ в выборках search и qa_pair_from_row
+    QA_PAIR_COLUMNS = ('qa_pairs.id, qa_pairs.question_ids, qa_pairs.question_text, '
+                       'qa_pairs.question_sender, qa_pairs.question_date, qa_pairs.answer_ids, '
+                       'qa_pairs.answer_text, qa_pairs.tags, qa_pairs.answer_date')
+    
+    def search(self, query: str, tags: Optional[Iterable[str]] = None,
+               limit: int = 20, offset: int = 0,
+               conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+        """Ищет пары вопрос-ответ по тексту с ранжированием bm25
+        
+        Каждое слово запроса ищется как префикс, все слова должны встретиться.
+        Если заданы tags, остаются пары хотя бы с одним из этих тегов.
+        В результатах есть поля пары, фрагмент текста snippet и rank.
+        conn - уже открытое соединение (например, только для чтения из пула
+        library_server), иначе соединение открывается на время запроса.
+        """
+        terms = re.findall(r'\w+', _fold_yo(query))
+        if not terms:
+            return []
+        match = ' '.join(f'"{term}"*' for term in terms)
+        
+        sql = f'''
+            SELECT {self.QA_PAIR_COLUMNS},
+                   snippet(qa_pairs_fts, -1, '<mark>', '</mark>', '…', 16), qa_pairs_fts.rank
+            FROM qa_pairs_fts
+            JOIN qa_pairs ON qa_pairs.id = qa_pairs_fts.rowid
+            WHERE qa_pairs_fts MATCH ?
+        '''
+        params = [match]
+        
+        tags = list(tags or [])
+        if tags:
+            sql += f'''
+              AND EXISTS (SELECT 1 FROM qa_pair_tags JOIN tags ON tags.id = qa_pair_tags.tag_id
+                          WHERE qa_pair_tags.qa_pair_id = qa_pairs.id
+                            AND tags.tag IN ({', '.join('?' * len(tags))}))
+            '''
+            params.extend(tags)
+        
+        sql += ' ORDER BY qa_pairs_fts.rank LIMIT ? OFFSET ?'
+        params.extend([limit, offset])
+        
+        if conn is None:
+            with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+                rows = conn.execute(sql, params).fetchall()
+        else:
+            rows = conn.execute(sql, params).fetchall()
+        
+        return [{**self.qa_pair_from_row(row), 'snippet': row[9], 'rank': row[10]} for row in rows]
+    
+    @staticmethod
+    def qa_pair_from_row(row: tuple) -> Dict[str, Any]:
+        """Пара вопрос-ответ из строки выборки, начинающейся со столбцов QA_PAIR_COLUMNS"""
+        return {
+            'id': row[0],
+            'question_ids': json.loads(row[1]),
+            'question_text': row[2],
+            'question_sender': row[3],
+            'question_date': row[4],
+            'answer_ids': json.loads(row[5]),
+            'answer_text': row[6],
+            'tags': json.loads(row[7]),
+            'answer_date': row[8],
+        }
+    
+    def _add_missing_column(self, conn: sqlite3.Connection, table: str, column: str, column_type: str):
+        """Добавляет столбец в таблицу, если его еще нет"""
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+    
+    @profile_stage('sqlite_messages')
+    def save_messages(self, messages: Iterable[ChatMessage], batch_size: int = 1000) -> int:
+        """Сохраняет поток сообщений одной транзакцией, возвращает их количество
+        
+        Сообщения записываются через executemany пачками по batch_size, поэтому
+        объем данных в памяти не зависит от размера документа. Теги
+        дедуплицируются в памяти, индексы строятся после загрузки.
+        messages - ChatMessage или MessageStore (например, grouper.messages).
+        """
+        count = 0
+        rows = 0
+        known_senders = set()
+        known_tags = set()
+        # Учитываем только время записи: поток сообщений может парситься на лету
+        elapsed = 0.0
+        
+        with self._connect() as conn:
+            for batch in _chunked(messages, batch_size):
+                started = time.perf_counter()
+                sender_rows = self._upsert_messages(
+                    conn, batch, [self._message_row(msg) for msg in batch], known_senders
                 )
-            ''')
-            
-            # Сохраняем сообщения
-            for msg in messages:
-                conn.execute('''
-                    INSERT OR REPLACE INTO messages 
-                    (message_number, sender, date, message_id, reply_to, text, is_violetta_answer)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (msg.message_number, msg.sender, msg.date, msg.message_id, 
-                      msg.reply_to, msg.text, msg.is_violetta_answer))
                 
                 # Сохраняем теги
-                for tag in msg.tags:
-                    conn.execute('INSERT OR IGNORE INTO tags (tag) VALUES (?)', (tag,))
-                    conn.execute('''
-                        INSERT OR REPLACE INTO message_tags (message_id, tag)
-                        VALUES (?, ?)
-                    ''', (msg.message_id, tag))
+                tag_rows = self._insert_message_tags(conn, batch, known_tags)
+                
+                count += len(batch)
+                rows += len(batch) + sender_rows + tag_rows
+                elapsed += time.perf_counter() - started
             
-            # Сохраняем пары вопрос-ответ
-            for qa in qa_pairs:
-                conn.execute('''
-                    INSERT INTO qa_pairs 
-                    (question_ids, question_text, question_sender, question_date,
-                     answer_ids, answer_text, tags, answer_date)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    json.dumps(qa['question_ids']), qa['question_text'], qa['question_sender'],
-                    qa['question_date'], json.dumps(qa['answer_ids']), qa['answer_text'],
-                    json.dumps(qa['tags']), qa['answer_date']
-                ))
+            started = time.perf_counter()
+            self._resolve_reply_links(conn)
+            self._create_indexes(conn)
+            conn.commit()
+            elapsed += time.perf_counter() - started
+        
+        self._print_write_rate("сообщения", rows, elapsed)
+        return count
+    
+    @profile_stage('sqlite_qa_pairs')
+    def save_qa_pairs(self, qa_pairs: Iterable[Dict[str, Any]], batch_size: int = 1000) -> int:
+        """Сохраняет пары вопрос-ответ одной транзакцией, возвращает их количество"""
+        count = 0
+        started = time.perf_counter()
+        
+        with self._connect() as conn:
+            for batch in _chunked(qa_pairs, batch_size):
+                self._insert_qa_pairs(conn, batch)
+                count += len(batch)
             
+            self._create_indexes(conn)
             conn.commit()
+        
+        self._print_write_rate("пары вопрос-ответ", count, time.perf_counter() - started)
+        return count
     
-    def create_json_database(self, qa_pairs: List[Dict[str, Any]], 
-                           output_file: str = "библиотека_вопросов_ответов.json"):
-        """Создает JSON-базу данных"""
+    @profile_stage('sqlite_sync', count=lambda self, messages, grouper, *args, **kwargs: len(grouper.messages))
+    def sync_sqlite(self, messages: Iterable[ChatMessage], grouper: 'QAGrouper',
+                    batch_size: int = 1000, remove_missing: bool = True) -> Dict[str, int]:
+        """Инкрементально синхронизирует SQLite базу с новой выгрузкой
         
-        print("💾 Создание JSON-базы данных...")
+        Сообщения сопоставляются по message_id и перезаписываются, только если
+        изменился хеш их содержимого. Пары вопрос-ответ пересобираются лишь для
+        цепочек, затронутых изменениями; остальные строки не трогаются.
+        Сообщения, которых нет в выгрузке, удаляются вместе с их парами, и база
+        совпадает с полной пересборкой; remove_missing=False оставляет их, когда
+        messages - только новые сообщения (хвост выгрузки в режиме наблюдения).
+        База обновляется на месте, поэтому здесь действуют sync_pragmas,
+        а не настройки пересборки.
         
-        all_tags = set()
-        for qa in qa_pairs:
-            all_tags.update(qa.get('tags', []))
+        messages должны проходить через grouper.index_messages, чтобы
+        группировщик видел всю выгрузку.
         
-        # Сортируем теги: сначала #ответвиолетты, затем остальные по алфавиту
-        sorted_tags = self._sort_tags_alphabetical(all_tags)
-        
-        database = {
-            "metadata": {
-                "created": datetime.now().isoformat(),
-                "total_entries": len(qa_pairs),
-                "total_unique_tags": len(all_tags),
-                "all_tags": sorted_tags,
-                "description": "База знаний вопросов и ответов из психологической мастер-группы"
-            },
-            "data": qa_pairs
+        Пары базы должны быть собраны по тому же правилу, что у grouper,
+        иначе синхронизация смешала бы пары двух правил: в этом случае
+        выбрасывается ValueError, и базу нужно пересобрать целиком.
+        """
+        print("🔄 Синхронизация SQLite базы данных...")
+        
+        changed_ids = set()
+        seen_ids = set()
+        known_senders = set()
+        known_tags = set()
+        
+        with self._connect(self.sync_pragmas) as conn:
+            self._create_schema(conn)
+            stored_policy = self._stored_thread_policy(conn)
+            if stored_policy is None:
+                conn.execute("INSERT OR REPLACE INTO library_meta (key, value) VALUES ('thread_policy', ?)",
+                             (grouper.policy.name,))
+            elif stored_policy != grouper.policy.name:
+                raise ValueError(f"пары базы собраны по правилу {stored_policy}, "
+                                 f"а не {grouper.policy.name}: нужна полная пересборка")
+            known = {message_id: (content_hash, reply_to or '', sender or '')
+                     for message_id, content_hash, reply_to, sender in conn.execute(
+                         'SELECT message_id, content_hash, reply_to, sender FROM messages')}
+            known_senders.update(name for name, in conn.execute('SELECT name FROM senders'))
+            known_tags.update(tag for tag, in conn.execute('SELECT tag FROM tags'))
+            previous_links = {}
+            
+            for batch in _chunked(messages, batch_size):
+                seen_ids.update(msg.message_id for msg in batch)
+                rows = [self._message_row(msg) for msg in batch]
+                changed = [(msg, row) for msg, row in zip(batch, rows)
+                           if known.get(msg.message_id, (None,))[0] != row[-1]]
+                if not changed:
+                    continue
+                
+                changed_messages = [msg for msg, _ in changed]
+                self._upsert_messages(conn, changed_messages, [row for _, row in changed],
+                                      known_senders)
+                conn.executemany('''
+                    DELETE FROM message_tags
+                    WHERE message_id = (SELECT id FROM messages WHERE message_id = ?)
+                ''', [(msg.message_id,) for msg in changed_messages])
+                self._insert_message_tags(conn, changed_messages, known_tags)
+                
+                for msg, row in changed:
+                    if msg.message_id in known and msg.message_id not in previous_links:
+                        previous_links[msg.message_id] = known[msg.message_id][1:]
+                    known[msg.message_id] = (row[-1], msg.reply_to, msg.sender)
+                    changed_ids.add(msg.message_id)
+            
+            self._resolve_reply_links(conn)
+            
+            removed_ids = [message_id for message_id in known if message_id not in seen_ids] \
+                if remove_missing else []
+            for message_id in removed_ids:
+                previous_links.setdefault(message_id, known[message_id][1:])
+            
+            # Удаляем пары, которые содержат затронутые сообщения
+            affected_ids = grouper.find_affected_ids(changed_ids.union(removed_ids), previous_links)
+            stale_pairs = []
+            stale_ids = []
+            conn.execute('CREATE TEMP TABLE affected_messages (message_id TEXT PRIMARY KEY)')
+            conn.executemany('INSERT INTO affected_messages VALUES (?)',
+                             [(message_id,) for message_id in affected_ids])
+            for pair_id, question_ids, pair_answer_ids in conn.execute('''
+                    SELECT DISTINCT qa_pairs.id, qa_pairs.question_ids, qa_pairs.answer_ids
+                    FROM affected_messages
+                    JOIN messages ON messages.message_id = affected_messages.message_id
+                    JOIN qa_pair_messages ON qa_pair_messages.message_id = messages.id
+                    JOIN qa_pairs ON qa_pairs.id = qa_pair_messages.qa_pair_id
+                ''').fetchall():
+                stale_pairs.append((pair_id,))
+                stale_ids.append({'question_ids': json.loads(question_ids),
+                                  'answer_ids': json.loads(pair_answer_ids)})
+            conn.executemany('DELETE FROM qa_pairs WHERE id = ?', stale_pairs)
+            conn.execute('DROP TABLE affected_messages')
+            if removed_ids:
+                self._delete_messages(conn, removed_ids)
+            
+            answer_ids = grouper.answers_to_rebuild(affected_ids, stale_ids)
+            
+            # Пересобираем пары только для затронутых цепочек
+            qa_pairs = list(grouper.iter_questions_answers(answer_ids)) if answer_ids else []
+            conn.executemany('DELETE FROM qa_pairs WHERE question_key = ?',
+                             [(_qa_pair_key(qa),) for qa in qa_pairs])
+            self._insert_qa_pairs(conn, qa_pairs)
+            
+            self._create_indexes(conn)
+            conn.commit()
+        
+        stats = {
+            'changed_messages': len(changed_ids),
+            'removed_messages': len(removed_ids),
+            'removed_qa_pairs': len(stale_pairs),
+            'rebuilt_qa_pairs': len(qa_pairs),
         }
+        print(f"✏️  Обновлено сообщений: {stats['changed_messages']}, "
+              f"удалено: {stats['removed_messages']}, "
+              f"пересобрано пар вопрос-ответ: {stats['rebuilt_qa_pairs']}")
+        return stats
+    
+    def _delete_messages(self, conn: sqlite3.Connection, message_ids: List[str]):
+        """Удаляет сообщения с их тегами и ссылками ответов на них, затем ненужные теги и отправителей
+        
+        Пары с этими сообщениями должны быть удалены заранее.
+        """
+        rows = [(message_id,) for message_id in message_ids]
+        conn.executemany('''
+            UPDATE messages SET reply_to_id = NULL
+            WHERE reply_to_id = (SELECT id FROM messages WHERE message_id = ?)
+        ''', rows)
+        conn.executemany('''
+            DELETE FROM message_tags
+            WHERE message_id = (SELECT id FROM messages WHERE message_id = ?)
+        ''', rows)
+        conn.executemany('DELETE FROM messages WHERE message_id = ?', rows)
+        conn.execute('DELETE FROM tags WHERE id NOT IN (SELECT tag_id FROM message_tags)')
+        conn.execute('''
+            DELETE FROM senders
+            WHERE id NOT IN (SELECT sender_id FROM messages WHERE sender_id IS NOT NULL)
+        ''')
+    
+    def _message_row(self, msg: ChatMessage) -> tuple:
+        """Строка таблицы messages для сообщения, последним идет хеш содержимого"""
+        return (msg.message_number, msg.sender, msg.date, msg.message_id,
+                msg.reply_to, msg.text, msg.is_violetta_answer, _message_hash(msg))
+    
+    def _upsert_messages(self, conn: sqlite3.Connection, batch: List[ChatMessage],
+                         rows: List[tuple], known_senders: set) -> int:
+        """Вставляет или обновляет сообщения по message_id, сохраняя их целые ключи
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(database, f, ensure_ascii=False, indent=2)
+        Возвращает число добавленных отправителей.
+        """
+        new_senders = [(sender,) for sender in dict.fromkeys(msg.sender for msg in batch)
+                       if sender and sender not in known_senders]
+        known_senders.update(sender for sender, in new_senders)
+        conn.executemany('INSERT OR IGNORE INTO senders (name) VALUES (?)', new_senders)
+        
+        conn.executemany('''
+            INSERT INTO messages 
+            (message_number, sender, date, message_id, reply_to, text,
+             is_violetta_answer, content_hash, sender_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, (SELECT id FROM senders WHERE name = ?))
+            ON CONFLICT (message_id) DO UPDATE SET
+                message_number = excluded.message_number,
+                sender = excluded.sender,
+                date = excluded.date,
+                reply_to = excluded.reply_to,
+                text = excluded.text,
+                is_violetta_answer = excluded.is_violetta_answer,
+                content_hash = excluded.content_hash,
+                sender_id = excluded.sender_id,
+                reply_to_id = NULL
+        ''', [row + (msg.sender,) for msg, row in zip(batch, rows)])
+        return len(new_senders)
+    
+    def _resolve_reply_links(self, conn: sqlite3.Connection):
+        """Заполняет reply_to_id для ответов, чье исходное сообщение уже есть в базе"""
+        conn.execute('''
+            UPDATE messages
+            SET reply_to_id = (SELECT parent.id FROM messages AS parent
+                               WHERE parent.message_id = messages.reply_to)
+            WHERE reply_to_id IS NULL AND reply_to != ''
+        ''')
+    
+    def _insert_message_tags(self, conn: sqlite3.Connection, batch: List[ChatMessage],
+                             known_tags: set) -> int:
+        """Сохраняет теги пачки сообщений, возвращает число записанных строк"""
+        message_tags = [(msg.message_id, tag) for msg in batch
+                        for tag in dict.fromkeys(msg.tags)]
+        new_tags = [(tag,) for tag in dict.fromkeys(tag for _, tag in message_tags)
+                    if tag not in known_tags]
+        known_tags.update(tag for tag, in new_tags)
+        
+        conn.executemany('INSERT OR IGNORE INTO tags (tag) VALUES (?)', new_tags)
+        conn.executemany('''
+            INSERT OR IGNORE INTO message_tags (message_id, tag_id)
+            SELECT messages.id, tags.id FROM messages, tags
+            WHERE messages.message_id = ? AND tags.tag = ?
+        ''', message_tags)
+        return len(new_tags) + len(message_tags)
+    
+    def _insert_qa_pairs(self, conn: sqlite3.Connection, qa_pairs: List[Dict[str, Any]]):
+        """Вставляет пачку пар вопрос-ответ вместе с их связями с сообщениями и тегами"""
+        conn.executemany('''
+            INSERT INTO qa_pairs 
+            (question_ids, question_text, question_sender, question_date,
+             answer_ids, answer_text, tags, answer_date, question_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            json.dumps(qa['question_ids']), qa['question_text'], qa['question_sender'],
+            qa['question_date'], json.dumps(qa['answer_ids']), qa['answer_text'],
+            json.dumps(qa['tags']), qa['answer_date'], _qa_pair_key(qa)
+        ) for qa in qa_pairs])
+        
+        # Пары связываются по question_key, уникальному для каждой пары
+        message_links = []
+        tag_links = []
+        for qa in qa_pairs:
+            key = _qa_pair_key(qa)
+            for role, column in (('question', 'question_ids'), ('answer', 'answer_ids')):
+                message_links.extend((role, position, key, message_id)
+                                     for position, message_id in enumerate(qa[column]))
+            tag_links.extend((key, tag) for tag in qa['tags'])
+        
+        conn.executemany('''
+            INSERT OR IGNORE INTO qa_pair_messages (qa_pair_id, message_id, role, position)
+            SELECT qa_pairs.id, messages.id, ?, ? FROM qa_pairs, messages
+            WHERE qa_pairs.question_key = ? AND messages.message_id = ?
+        ''', message_links)
+        conn.executemany('''
+            INSERT OR IGNORE INTO qa_pair_tags (tag_id, qa_pair_id)
+            SELECT tags.id, qa_pairs.id FROM qa_pairs, tags
+            WHERE qa_pairs.question_key = ? AND tags.tag = ?
+        ''', tag_links)
+    
+    def _create_indexes(self, conn: sqlite3.Connection):
+        """Создает индексы после загрузки данных, а не перед ней
+        
+        Индексы покрывают выборки цепочек (reply_to_id, sender_id), сообщений
+        по тегу и пар по сообщению или тегу без обращения к основной таблице.
+        """
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_thread
+            ON messages (reply_to_id, sender_id, message_number)
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages (sender_id)')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_message_tags_tag_id
+            ON message_tags (tag_id, message_id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_qa_pair_messages_message_id
+            ON qa_pair_messages (message_id, qa_pair_id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_qa_pair_tags_qa_pair_id
+            ON qa_pair_tags (qa_pair_id, tag_id)
+        ''')
+    
+    def _print_write_rate(self, label: str, rows: int, elapsed: float):
+        """Выводит скорость записи в строках в секунду"""
+        rate = rows / elapsed if elapsed > 0 else float(rows)
+        print(f"⏱️  SQLite, {label}: {rows} строк за {elapsed:.2f} с ({rate:,.0f} строк/с)")
+    
+    @profile_stage('json', count=lambda self, qa_pairs, *args, **kwargs: len(qa_pairs))
+    def create_json_database(self, qa_pairs: Iterable[Dict[str, Any]], 
+                           output_file: str = LIBRARY_JSON_FILE):
+        """Создает JSON-базу данных
+        
+        Пары пишутся потоком (QAJsonWriter), metadata с числом записей
+        и отсортированными тегами - после них.
+        """
+        
+        print("💾 Создание JSON-базы данных...")
+        
+        with QAJsonWriter([JsonOutput(output_file, all_tags=True)]) as writer:
+            for qa in qa_pairs:
+                writer.write(qa)
         
         return output_file
     
     def _sort_tags_alphabetical(self, tags: set) -> List[str]:
         """Сортирует теги: сначала #ответвиолетты, затем остальные по алфавиту"""
-        tags_list = list(tags)
+        return sort_tags_alphabetical(tags)
+
+def sort_tags_alphabetical(tags: Iterable[str]) -> List[str]:
+    """Сортирует теги: сначала #ответвиолетты, затем остальные по алфавиту"""
+    tags_list = list(tags)
+    
+    # Находим тег #ответвиолетты (в любом регистре)
+    answer_tag = None
+    for tag in tags_list:
+        if 'ответвиолетты' in tag.lower():
+            answer_tag = tag
+            break
+    
+    # Удаляем его из общего списка
+    if answer_tag:
+        tags_list.remove(answer_tag)
+    
+    # Сортируем остальные теги по алфавиту
+    tags_list.sort(key=lambda x: x.lower())
+    
+    # Возвращаем список с #ответвиолетты первым
+    if answer_tag:
+        return [answer_tag] + tags_list
+    else:
+        return tags_list
+
+@dataclass
+class JsonOutput:
+    """Файл, который пишет QAJsonWriter
+    
+    pretty - отступ в 2 пробела, иначе компактная запись без пробелов;
+    all_tags - добавить в metadata отсортированный список тегов,
+    created - дату сборки.
+    """
+    path: str
+    pretty: bool = True
+    all_tags: bool = False
+    created: bool = True
+
+class QAJsonWriter:
+    """Пишет пары вопрос-ответ в несколько JSON файлов за один проход
+    
+    Файлы имеют вид {"data": [...], "metadata": {...}}. Каждая пара
+    сериализуется один раз на формат, сколько бы файлов этого формата
+    ни было, и сразу пишется на диск, поэтому весь список в памяти
+    не нужен. Число записей и тегов считается по ходу записи, так что
+    metadata идет после data. Файлы пишутся во временные (.tmp)
+    и заменяют прежние при close(); при ошибке прежние файлы остаются.
+    """
+    
+    def __init__(self, outputs: Iterable[JsonOutput]):
+        self.outputs = list(outputs)
+        self.total_entries = 0
+        self.tags = set()
+        self._files = []
+    
+    def __enter__(self):
+        self.open()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+    
+    def open(self):
+        """Открывает временные файлы и пишет начало массива data"""
+        for output in self.outputs:
+            directory = os.path.dirname(output.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            f = open(output.path + '.tmp', 'w', encoding='utf-8', buffering=STATIC_CHUNK_SIZE)
+            f.write('{\n  "data": [' if output.pretty else '{"data":[')
+            self._files.append(f)
+    
+    def write(self, qa_pair: Dict[str, Any], compact: bool = False) -> Optional[str]:
+        """Дописывает пару во все файлы
         
-        # Находим тег #ответвиолетты (в любом регистре)
-        answer_tag = None
-        for tag in tags_list:
-            if 'ответвиолетты' in tag.lower():
-                answer_tag = tag
-                break
+        При compact=True возвращает компактную сериализацию пары (ту же,
+        что попала в компактные файлы), чтобы вызывающий мог использовать
+        ее повторно.
+        """
+        encoded = {}
+        if compact:
+            encoded[False] = json.dumps(qa_pair, ensure_ascii=False, separators=(',', ':'))
+        separator = ',' if self.total_entries else ''
+        for output, f in zip(self.outputs, self._files):
+            if output.pretty not in encoded:
+                encoded[output.pretty] = self._encode(qa_pair, output.pretty)
+            f.write(f"{separator}\n    {encoded[True]}" if output.pretty
+                    else separator + encoded[False])
+        
+        self.total_entries += 1
+        self.tags.update(qa_pair.get('tags', []))
+        return encoded.get(False)
+    
+    def metadata(self, all_tags: bool = False, created: bool = True) -> Dict[str, Any]:
+        """metadata по записанным парам"""
+        metadata = {}
+        if created:
+            metadata["created"] = datetime.now().isoformat()
+        metadata["total_entries"] = self.total_entries
+        metadata["total_unique_tags"] = len(self.tags)
+        if all_tags:
+            metadata["all_tags"] = sort_tags_alphabetical(self.tags)
+        metadata["description"] = LIBRARY_DESCRIPTION
+        return metadata
+    
+    def close(self):
+        """Пишет metadata, закрывает файлы и заменяет ими прежние"""
+        for output, f in zip(self.outputs, self._files):
+            metadata = self.metadata(output.all_tags, output.created)
+            if output.pretty:
+                closing = '\n  ' if self.total_entries else ''
+                metadata_json = json.dumps(metadata, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+                f.write(f'{closing}],\n  "metadata": {metadata_json}\n}}')
+            else:
+                f.write(f'],"metadata":{self._encode(metadata, False)}}}')
+            f.close()
+            os.replace(output.path + '.tmp', output.path)
+        self._files = []
+    
+    def abort(self):
+        """Закрывает и удаляет временные файлы"""
+        for output, f in zip(self.outputs, self._files):
+            f.close()
+            os.remove(output.path + '.tmp')
+        self._files = []
+    
+    def _encode(self, value: Any, pretty: bool) -> str:
+        """Сериализация пары с отступом элемента массива data"""
+        if pretty:
+            # В строках JSON нет переводов строк, поэтому отступ добавляется заменой
+            return json.dumps(value, ensure_ascii=False, indent=2).replace('\n', '\n    ')
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def _encode_postings(record_ids: List[int]) -> str:
+    """Кодирует возрастающий список номеров записей: разности в varint, затем base64"""
+    encoded = bytearray()
+    previous = 0
+    for record_id in record_ids:
+        delta = record_id - previous
+        previous = record_id
+        while delta >= 0x80:
+            encoded.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        encoded.append(delta)
+    return base64.b64encode(bytes(encoded)).decode('ascii')
+
+def _encode_bitmap(record_ids: List[int], size: int) -> str:
+    """Битовая карта записей (бит i - запись i, младший бит первым) в base64"""
+    bitmap = bytearray((size + 7) // 8)
+    for record_id in record_ids:
+        bitmap[record_id >> 3] |= 1 << (record_id & 7)
+    return base64.b64encode(bytes(bitmap)).decode('ascii')
+
+def normalize_search_text(text: str) -> str:
+    """Нормализует текст для поиска в веб-приложении
+    
+    Нижний регистр, ё -> е, знаки препинания и символ # заменяются
+    пробелом, пробелы схлопываются. Браузер так же нормализует запрос
+    (SearchEngine.normalize), поэтому поиск сводится к проверке подстроки.
+    """
+    return SEARCH_SEPARATOR_PATTERN.sub(' ', _fold_yo(text.lower())).strip()
+
+def normalize_tag(tag: str) -> str:
+    """Ключ тега: #Мотивация, #мотивация и мотивация считаются одним тегом"""
+    return normalize_search_text(tag)
+
+def build_tag_table(qa_pairs: List[Dict[str, Any]]) -> tuple:
+    """Нумерует теги библиотеки по нормализованному ключу
+    
+    Возвращает (labels, tag_ids): labels[id] - самое частое написание тега,
+    tag_ids - словарь ключ тега -> id. Теги нумеруются по ключу.
+    """
+    spellings = defaultdict(Counter)
+    for qa in qa_pairs:
+        for tag in qa.get('tags', []):
+            spellings[normalize_tag(tag)][tag] += 1
+    
+    keys = sorted(key for key in spellings if key)
+    labels = [min(spellings[key].items(), key=lambda item: (-item[1], item[0]))[0] for key in keys]
+    return labels, {key: tag_id for tag_id, key in enumerate(keys)}
+
+def search_fields(qa: Dict[str, Any], tag_ids: Dict[str, int]) -> Dict[str, Any]:
+    """Поля для поиска в веб-приложении для одной пары вопрос-ответ
+    
+    search_key - нормализованные вопрос и ответ через перевод строки
+    (запрос его не содержит, поэтому совпадение не переходит из вопроса
+    в ответ), tag_ids - номера тегов по build_tag_table, tag_mask - те же
+    теги битовой маской из 32-битных слов.
+    """
+    record_tag_ids = sorted({tag_ids[key] for key in map(normalize_tag, qa.get('tags', []))
+                             if key in tag_ids})
+    tag_mask = [0] * max(1, (len(tag_ids) + 31) // 32)
+    for tag_id in record_tag_ids:
+        tag_mask[tag_id >> 5] |= 1 << (tag_id & 31)
+    return {
+        'search_key': (f"{normalize_search_text(qa.get('question_text') or '')}\n"
+                       f"{normalize_search_text(qa.get('answer_text') or '')}"),
+        'tag_ids': record_tag_ids,
+        'tag_mask': tag_mask
+    }
+
+def add_search_fields(qa_pairs: List[Dict[str, Any]], tag_ids: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Копии пар вопрос-ответ с полями для поиска (search_fields)"""
+    return [{**qa, **search_fields(qa, tag_ids)} for qa in qa_pairs]
+
+def _extend_json_object(object_json: str, fields: Dict[str, Any]) -> str:
+    """Добавляет поля к уже сериализованному непустому JSON-объекту без повторной сериализации"""
+    return f"{object_json[:-1]},{json.dumps(fields, ensure_ascii=False, separators=(',', ':'))[1:]}"
+
+def search_index_grams(search_key: str) -> set:
+    """N-граммы слов нормализованного текста, по которым строится поисковый индекс"""
+    n = SEARCH_INDEX_NGRAM
+    return {word[i:i + n]
+            for word in search_key.split()
+            for i in range(len(word) - n + 1)}
+
+def build_search_index(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Строит инвертированный индекс для поиска в веб-приложении
+    
+    records - результат add_search_fields, номер записи - ее позиция
+    в списке. Для каждой n-граммы слов search_key хранится возрастающий
+    список записей, закодированный разностями (_encode_postings), для
+    каждого номера тега - битовая карта записей. Браузер пересекает списки
+    n-грамм запроса и проверяет подстроку только у найденных кандидатов,
+    поэтому результаты совпадают с полным перебором.
+    """
+    postings = defaultdict(list)
+    tag_records = defaultdict(list)
+    for record_id, record in enumerate(records):
+        for gram in search_index_grams(record['search_key']):
+            postings[gram].append(record_id)
+        for tag_id in record['tag_ids']:
+            tag_records[tag_id].append(record_id)
+    
+    return {
+        "version": 2,
+        "records": len(records),
+        "ngram": SEARCH_INDEX_NGRAM,
+        "grams": {gram: _encode_postings(ids) for gram, ids in sorted(postings.items())},
+        "tags": {str(tag_id): _encode_bitmap(ids, len(records)) for tag_id, ids in sorted(tag_records.items())}
+    }
+
+def minify_css(css: str) -> str:
+    """Убирает из CSS комментарии и лишние пробелы"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+def minify_html(html: str) -> str:
+    """Убирает отступы, пустые строки и однострочные комментарии скриптов
+    
+    Переводы строк сохраняются, поэтому автоматическая расстановка точек
+    с запятой в JavaScript работает так же, как в исходной странице.
+    """
+    lines = (line.strip() for line in html.split('\n'))
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+class StaticAssets:
+    """Файлы веб-приложения в папке src/
+    
+    Без publish файлы пишутся под обычными именами. С publish в имя
+    добавляется хеш содержимого (styles.css -> styles.1a2b3c4d5e.css),
+    такие файлы можно кешировать навсегда; рядом пишутся сжатые копии
+    .gz и, если установлен пакет brotli, .br, а asset-manifest.json
+    сопоставляет исходные имена итоговым. Хеша нет только у index.html:
+    это точка входа, на которую ссылаются по постоянному адресу.
+    """
+    
+    def __init__(self, output_dir: str, publish: bool = False):
+        self.output_dir = output_dir
+        self.publish = publish
+        self.files = {}
+    
+    def path(self, name: str) -> str:
+        """Путь к файлу по имени относительно папки приложения"""
+        return os.path.join(self.output_dir, *name.split('/'))
+    
+    def write(self, name: str, content, hashed: bool = True) -> str:
+        """Записывает файл и возвращает его итоговое имя относительно папки приложения"""
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return self._register(name, hashlib.sha256(data).hexdigest(), len(data), hashed)
+    
+    def add_file(self, name: str, hashed: bool = True) -> str:
+        """Учитывает файл, уже записанный по path(name), например потоком (QAJsonWriter)
         
-        # Удаляем его из общего списка
-        if answer_tag:
-            tags_list.remove(answer_tag)
+        Возвращает итоговое имя, как write.
+        """
+        sha256 = hashlib.sha256()
+        with open(self.path(name), 'rb') as f:
+            for chunk in iter(lambda: f.read(STATIC_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        return self._register(name, sha256.hexdigest(), os.path.getsize(self.path(name)), hashed)
+    
+    def _register(self, name: str, digest: str, size: int, hashed: bool) -> str:
+        """Переименовывает записанный файл по хешу (в режиме publish) и сжимает его"""
+        file_name = name
+        if self.publish and hashed:
+            stem, ext = posixpath.splitext(name)
+            file_name = f"{stem}.{digest[:STATIC_HASH_LENGTH]}{ext}"
+            os.replace(self.path(name), self.path(file_name))
+        
+        entry = {"file": file_name, "bytes": size, "sha256": digest}
+        if self.publish:
+            entry["encodings"] = self._write_compressed(file_name, size)
+        self.files[name] = entry
+        return file_name
+    
+    def _write_compressed(self, file_name: str, size: int) -> Dict[str, Any]:
+        """Пишет сжатые копии файла для отдачи с Content-Encoding
         
-        # Сортируем остальные теги по алфавиту
-        tags_list.sort(key=lambda x: x.lower())
+        Файл читается частями, поэтому большой data.json не загружается
+        в память целиком.
+        """
+        if size < STATIC_COMPRESS_MIN_SIZE:
+            return {}
+        
+        encodings = {}
+        with open(self.path(file_name), 'rb') as source:
+            # mtime=0: одинаковое содержимое дает одинаковый .gz
+            with open(self.path(file_name + ".gz"), 'wb') as f:
+                with gzip.GzipFile(filename='', mode='wb', fileobj=f, compresslevel=9, mtime=0) as gz:
+                    for chunk in iter(lambda: source.read(STATIC_CHUNK_SIZE), b''):
+                        gz.write(chunk)
+            encodings["gzip"] = {"file": file_name + ".gz",
+                                 "bytes": os.path.getsize(self.path(file_name + ".gz"))}
+            
+            if brotli is not None:
+                source.seek(0)
+                compressor = brotli.Compressor(quality=11)
+                with open(self.path(file_name + ".br"), 'wb') as f:
+                    for chunk in iter(lambda: source.read(STATIC_CHUNK_SIZE), b''):
+                        f.write(compressor.process(chunk))
+                    f.write(compressor.finish())
+                encodings["br"] = {"file": file_name + ".br",
+                                   "bytes": os.path.getsize(self.path(file_name + ".br"))}
+        return encodings
+    
+    def write_manifest(self) -> str:
+        """Записывает asset-manifest.json: исходное имя -> файл, размер, хеш и сжатые копии"""
+        manifest = {
+            "created": datetime.now().isoformat(),
+            "immutable": [entry["file"] for name, entry in sorted(self.files.items())
+                          if entry["file"] != name],
+            "files": dict(sorted(self.files.items()))
+        }
+        return self.write("asset-manifest.json",
+                          json.dumps(manifest, ensure_ascii=False, indent=2), hashed=False)
+    
+    def remove_stale(self, directory: str = ""):
+        """Удаляет из папки файлы прошлых сборок, которых нет в этой"""
+        current = set()
+        for entry in self.files.values():
+            current.add(entry["file"])
+            current.update(encoded["file"] for encoded in entry.get("encodings", {}).values())
         
-        # Возвращаем список с #ответвиолетты первым
-        if answer_tag:
-            return [answer_tag] + tags_list
-        else:
-            return tags_list
+        folder = self.path(directory) if directory else self.output_dir
+        for entry in os.scandir(folder):
+            name = posixpath.join(directory, entry.name) if directory else entry.name
+            if (entry.is_file() and name not in current
+                    and STATIC_GENERATED_PATTERN.fullmatch(name)):
+                os.remove(entry.path)
+
+def write_data_shards(records: List[Dict[str, Any]], output_dir: str,
+                      shard_size: int = 500, tag_labels: Optional[List[str]] = None,
+                      assets: Optional[StaticAssets] = None,
+                      encoded_records: Optional[List[str]] = None) -> str:
+    """Записывает записи веб-приложения частями по shard_size и манифест к ним
+    
+    records - результат add_search_fields, tag_labels - названия тегов по
+    номерам (build_tag_table). Части лежат в output_dir/data/qa-NNNNN.json,
+    поисковый индекс (build_search_index) - в output_dir/data/search-index.json,
+    манифест - в output_dir/data/manifest.json: общее число записей,
+    названия тегов, путь к индексу и список частей. Части от прошлой сборки, которых больше нет, удаляются.
+    Файлы пишутся через assets (StaticAssets): в режиме publish их имена
+    содержат хеш, а в манифесте нет даты сборки, чтобы его хеш менялся
+    только вместе с данными. encoded_records - уже сериализованные
+    компактно записи; тогда records достаточно полей search_fields.
+    Возвращает путь к манифесту.
+    """
+    assets = assets or StaticAssets(output_dir)
+    if encoded_records is None:
+        encoded_records = [json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+                           for record in records]
+    
+    shards = []
+    for index, start in enumerate(range(0, len(records), shard_size)):
+        shard = encoded_records[start:start + shard_size]
+        shard_file = assets.write(f"data/qa-{index:05d}.json", f"[{','.join(shard)}]")
+        shards.append({"file": shard_file, "start": start, "count": len(shard)})
+    
+    search_index_file = assets.write("data/search-index.json",
+                                     json.dumps(build_search_index(records), ensure_ascii=False,
+                                                separators=(',', ':')))
+    
+    manifest = {
+        "created": datetime.now().isoformat(),
+        "total_entries": len(records),
+        "shard_size": shard_size,
+        "tags": tag_labels if tag_labels is not None else build_tag_table(records)[0],
+        "search_index": search_index_file,
+        "shards": shards
+    }
+    if assets.publish:
+        del manifest["created"]
+        manifest_json = json.dumps(manifest, ensure_ascii=False, separators=(',', ':'))
+    else:
+        manifest_json = json.dumps(manifest, ensure_ascii=False, indent=2)
+    manifest_file = assets.path(assets.write("data/manifest.json", manifest_json))
+    assets.remove_stale("data")
+    
+    print(f"🧩 Данные разбиты на {len(shards)} частей по {shard_size} записей: {manifest_file}")
+    return manifest_file
 
+@profile_stage('html', count=lambda qa_pairs, *args, **kwargs: len(qa_pairs))
 def create_interactive_html(qa_pairs: List[Dict[str, Any]], 
-                          output_dir: str = "src"):
-    """Создает HTML приложение с встроенными данными"""
+                          output_dir: str = "src", shard_size: Optional[int] = None,
+                          publish: bool = False, json_outputs: Iterable[JsonOutput] = ()):
+    """Создает HTML приложение с встроенными данными
+    
+    Если задан shard_size, данные не встраиваются в index.html, а пишутся
+    частями (write_data_shards): страница сразу загружает первую часть,
+    а остальные подгружает при прокрутке или при поиске. Размер index.html
+    и время первой отрисовки тогда не зависят от размера библиотеки, но
+    страницу нужно открывать через HTTP-сервер, а не как файл.
+    
+    publish готовит папку к выкладке на статический хостинг (StaticAssets):
+    файлы минифицируются, получают хеш в имени и сжатые копии .gz/.br,
+    а asset-manifest.json перечисляет их. Возвращает пути к index.html
+    и data.json (в режиме publish - к data.<хеш>.json).
+    
+    json_outputs - дополнительные JSON файлы с парами (например, JSON-база
+    библиотеки), которые пишутся в том же проходе, что и data.json.
+    """
     
     print("🎨 Создание веб-приложения...")
     
     # Создаем директории если их нет
     os.makedirs(output_dir, exist_ok=True)
+    assets = StaticAssets(output_dir, publish=publish)
+    
+    # 1. Один проход по парам: резервная копия data.json, дополнительные
+    # JSON файлы json_outputs и записи для браузера. Каждая пара
+    # сериализуется компактно один раз, поля поиска дописываются к готовой строке
+    tag_labels, tag_ids = build_tag_table(qa_pairs)
+    # Без даты сборки хеш в имени data.json меняется только вместе с данными
+    outputs = [JsonOutput(assets.path("data.json"), pretty=not publish, created=not publish),
+               *json_outputs]
+    records = []
+    encoded_records = []
+    with QAJsonWriter(outputs) as writer:
+        for qa in qa_pairs:
+            pair_json = writer.write(qa, compact=True)
+            fields = search_fields(qa, tag_ids)
+            records.append(fields)
+            encoded_records.append(_extend_json_object(pair_json, fields))
+    json_file = assets.path(assets.add_file("data.json"))
+    # Теги считаются по нормализованному ключу, как в updateStats
+    unique_tags_count = len(tag_labels)
     
-    # 1. Сохраняем JSON данные как резервную копию
-    json_file = os.path.join(output_dir, "data.json")
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            "metadata": {
-                "created": datetime.now().isoformat(),
-                "total_entries": len(qa_pairs),
-                "total_unique_tags": len(set(tag for qa in qa_pairs for tag in qa.get('tags', []))),
-                "description": "База знаний вопросов и ответов из психологической мастер-группы"
-            },
-            "data": qa_pairs
-        }, f, ensure_ascii=False, indent=2)
-    
-    # 2. Создаем HTML файл со ВСТРОЕННЫМИ данными
-    html_file = os.path.join(output_dir, "index.html")
-    
-    # Подготавливаем данные для вставки в JavaScript
-    qa_data_json = json.dumps(qa_pairs, ensure_ascii=False)
+    # 2. Создаем HTML файл со ВСТРОЕННЫМИ данными или с загрузкой по частям
+    if shard_size:
+        write_data_shards(records, output_dir, shard_size, tag_labels, assets, encoded_records)
+        qa_data_json = "[]"
+        tag_labels_json = "null"
+        search_index_json = "null"
+        manifest_url = json.dumps(assets.files["data/manifest.json"]["file"])
+        app_info = "✅ Данные загружаются частями по мере прокрутки."
+    else:
+        # Подготавливаем данные для вставки в JavaScript
+        qa_data_json = f"[{','.join(encoded_records)}]"
+        tag_labels_json = json.dumps(tag_labels, ensure_ascii=False)
+        search_index_json = json.dumps(build_search_index(records), ensure_ascii=False,
+                                       separators=(',', ':'))
+        manifest_url = "null"
+        app_info = "✅ Приложение работает офлайн. Все данные загружены в память."
+    del encoded_records
     
     html_content = f'''<!DOCTYPE html>
 <html lang="ru">
@@ -479,13 +2852,13 @@ def create_interactive_html(qa_pairs: List[Dict[str, Any]],
         </header>
         
         <div class="app-info">
-            ✅ Приложение работает офлайн. Все данные загружены в память.
+            {app_info}
         </div>
         
         <div class="stats">
             Всего записей: <strong><span id="totalCount">{len(qa_pairs)}</span></strong> | 
             Показано: <strong><span id="shownCount">{len(qa_pairs)}</span></strong> |
-            Уникальных тегов: <strong><span id="tagsCount">{len(set(tag for qa in qa_pairs for tag in qa.get('tags', [])))}</span></strong>
+            Уникальных тегов: <strong><span id="tagsCount">{unique_tags_count}</span></strong>
         </div>
         
         <div class="search-filters">
@@ -499,34 +2872,431 @@ def create_interactive_html(qa_pairs: List[Dict[str, Any]],
         <div class="qa-grid" id="qaGrid">
             <div class="loading">Загрузка данных...</div>
         </div>
+        <div id="loadMore"></div>
     </div>
 
+    <script id="searchEngineSource">
+        // Поисковый движок: выполняется в Web Worker, а если он недоступен -
+        // в основном потоке. Хранит нормализованные при сборке ключи поиска,
+        // битовые маски тегов и индекс
+        class SearchEngine {{
+            constructor() {{
+                this.records = [];
+                this.index = null;
+                this.postingsCache = new Map();
+            }}
+
+            addRecords(items) {{
+                for (const item of items) {{
+                    this.records.push({{
+                        key: item.search_key || '',
+                        mask: item.tag_mask || []
+                    }});
+                }}
+            }}
+
+            static normalize(text) {{
+                // То же, что normalize_search_text при сборке
+                return text.toLowerCase().replace(/ё/g, 'е')
+                    .replace(/[^\\p{{L}}\\p{{N}}_]+/gu, ' ').trim();
+            }}
+
+            setIndex(index) {{
+                this.index = index;
+                this.postingsCache = new Map();
+            }}
+
+            decodeBase64(encoded) {{
+                const binary = atob(encoded);
+                const bytes = new Uint8Array(binary.length);
+                for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+                return bytes;
+            }}
+
+            postings(gram) {{
+                // Список записей n-граммы: разности в varint, раскодируются один раз
+                if (this.postingsCache.has(gram)) return this.postingsCache.get(gram);
+                const encoded = this.index.grams[gram];
+                const ids = [];
+                if (encoded) {{
+                    const bytes = this.decodeBase64(encoded);
+                    let value = 0, shift = 0, previous = 0;
+                    for (const byte of bytes) {{
+                        value += (byte & 0x7f) * 2 ** shift;
+                        if (byte & 0x80) {{
+                            shift += 7;
+                            continue;
+                        }}
+                        previous += value;
+                        ids.push(previous);
+                        value = 0;
+                        shift = 0;
+                    }}
+                }}
+                this.postingsCache.set(gram, ids);
+                return ids;
+            }}
+
+            queryGrams(searchTerm) {{
+                const n = this.index.ngram;
+                const grams = new Set();
+                for (const word of searchTerm.split(' ')) {{
+                    for (let i = 0; i + n <= word.length; i++) grams.add(word.slice(i, i + n));
+                }}
+                return Array.from(grams);
+            }}
+
+            intersect(a, b) {{
+                const result = [];
+                let i = 0, j = 0;
+                while (i < a.length && j < b.length) {{
+                    if (a[i] < b[j]) i++;
+                    else if (a[i] > b[j]) j++;
+                    else {{
+                        result.push(a[i]);
+                        i++;
+                        j++;
+                    }}
+                }}
+                return result;
+            }}
+
+            candidateIds(searchTerm, tagMask) {{
+                // Кандидаты по индексу: пересечение списков n-грамм запроса и
+                // объединение битовых карт выбранных тегов. null - все записи
+                let ids = null;
+                const grams = searchTerm ? this.queryGrams(searchTerm) : [];
+                if (grams.length > 0) {{
+                    const lists = grams.map(gram => this.postings(gram)).sort((a, b) => a.length - b.length);
+                    ids = lists[0];
+                    for (let k = 1; k < lists.length && ids.length > 0; k++) {{
+                        ids = this.intersect(ids, lists[k]);
+                    }}
+                }}
+
+                if (tagMask) {{
+                    const bitmaps = [];
+                    tagMask.forEach((word, w) => {{
+                        for (let bit = 0; bit < 32; bit++) {{
+                            const encoded = (word >>> bit) & 1 ? this.index.tags[w * 32 + bit] : null;
+                            if (encoded) bitmaps.push(this.decodeBase64(encoded));
+                        }}
+                    }});
+                    const hasTag = id => bitmaps.some(bitmap => (bitmap[id >> 3] >> (id & 7)) & 1);
+                    if (ids === null) {{
+                        ids = [];
+                        for (let id = 0; id < this.index.records; id++) {{
+                            if (hasTag(id)) ids.push(id);
+                        }}
+                    }} else {{
+                        ids = ids.filter(hasTag);
+                    }}
+                }}
+                return ids;
+            }}
+
+            query(searchTerm, tagMask) {{
+                // Номера подходящих записей по возрастанию. tagMask - маска
+                // выбранных тегов или null, если теги не выбраны. Индекс сужает
+                // перебор до кандидатов, а проверка подстроки и маски на них
+                // оставляет результат таким же, как при полном переборе
+                searchTerm = SearchEngine.normalize(searchTerm);
+                const matches = record => {{
+                    if (searchTerm && !record.key.includes(searchTerm)) return false;
+                    if (!tagMask) return true;
+                    for (let w = 0; w < tagMask.length; w++) {{
+                        if ((record.mask[w] & tagMask[w]) !== 0) return true;
+                    }}
+                    return false;
+                }};
+
+                const candidates = this.index && this.index.records === this.records.length
+                    ? this.candidateIds(searchTerm, tagMask)
+                    : null;
+                const ids = [];
+                if (candidates === null) {{
+                    for (let id = 0; id < this.records.length; id++) {{
+                        if (matches(this.records[id])) ids.push(id);
+                    }}
+                }} else {{
+                    for (const id of candidates) {{
+                        if (matches(this.records[id])) ids.push(id);
+                    }}
+                }}
+                return Uint32Array.from(ids);
+            }}
+        }}
+    </script>
     <script>
-        // ВАЖНО: Все данные встроены прямо в HTML чтобы избежать CORS проблем
+        // Обвязка Web Worker: из нескольких запросов в очереди выполняется
+        // только последний, более ранние отменяются
+        const searchWorkerSource = `
+            const engine = new SearchEngine();
+            let pendingQuery = null;
+            const runPendingQuery = () => {{
+                if (!pendingQuery) return;
+                const {{ id, searchTerm, tagMask }} = pendingQuery;
+                pendingQuery = null;
+                const ids = engine.query(searchTerm, tagMask);
+                self.postMessage({{ id, ids }}, [ids.buffer]);
+            }};
+            self.onmessage = event => {{
+                const message = event.data;
+                if (message.type === 'query') {{
+                    pendingQuery = message;
+                    setTimeout(runPendingQuery, 0);
+                }} else if (message.type === 'addRecords') {{
+                    engine.addRecords(message.items);
+                }} else if (message.type === 'setIndex') {{
+                    engine.setIndex(message.index);
+                }}
+            }};
+        `;
+
+        // ВАЖНО: Все данные встроены прямо в HTML чтобы избежать CORS проблем.
+        // При сборке по частям qaData пуст, а данные описывает манифест
         const qaData = {qa_data_json};
+        const manifestUrl = {manifest_url};
+        // Названия тегов по номерам; при сборке по частям они в манифесте
+        const tagLabels = {tag_labels_json};
+        // Инвертированный индекс для поиска; при сборке по частям загружается отдельно
+        const searchIndex = {search_index_json};
         
         class LibraryApp {{
             constructor() {{
                 this.qaData = qaData;
-                this.sortedTags = this.sortTags(this.getAllTags());
+                this.manifest = null;
+                this.nextShard = 0;
+                this.shardLoading = null;
+                this.searchIndex = searchIndex;
+                this.searchIndexLoading = null;
+                // Поиск: Web Worker (или движок в основном потоке), номер
+                // последнего запроса и ожидающие ответа запросы
+                this.searchWorker = null;
+                this.searchEngine = null;
+                this.querySequence = 0;
+                this.pendingQueries = new Map();
+                this.searchDebounce = null;
+                // Виртуальная сетка: текущие результаты, их раскладка по рядам
+                // и измеренные высоты карточек
+                this.results = null;
+                this.virtual = null;
+                this.layout = null;
+                this.renderPending = false;
+                this.cardHeights = new WeakMap();
+                this.measuredTotal = 0;
+                this.measuredCount = 0;
+                this.setTagLabels(tagLabels || []);
+                this.initSearch();
                 this.init();
             }}
 
-            init() {{
+            async init() {{
+                if (manifestUrl) {{
+                    try {{
+                        await this.loadManifest();
+                        await this.loadNextShard();
+                    }} catch (error) {{
+                        console.error('Ошибка загрузки данных', error);
+                        document.getElementById('qaGrid').innerHTML =
+                            '<div class="no-results">😔 Не удалось загрузить данные. Откройте приложение через HTTP-сервер, например python -m http.server в папке src/.</div>';
+                        return;
+                    }}
+                }}
                 this.renderQACards(this.qaData);
                 this.initTagFilters();
                 this.setupEventListeners();
+                this.setupLazyLoading();
                 this.updateStats();
             }}
 
-            getAllTags() {{
-                const allTags = new Set();
-                this.qaData.forEach(item => {{
-                    if (item.tags && Array.isArray(item.tags)) {{
-                        item.tags.forEach(tag => allTags.add(tag));
+            async loadManifest() {{
+                const response = await fetch(manifestUrl);
+                if (!response.ok) throw new Error(`HTTP ${{response.status}}: ${{manifestUrl}}`);
+                this.manifest = await response.json();
+                this.setTagLabels(this.manifest.tags);
+            }}
+
+            hasMoreShards() {{
+                return this.manifest !== null && this.nextShard < this.manifest.shards.length;
+            }}
+
+            loadNextShard() {{
+                // Одновременно загружается не больше одной части
+                if (this.shardLoading) return this.shardLoading;
+                if (!this.hasMoreShards()) return Promise.resolve([]);
+
+                const shard = this.manifest.shards[this.nextShard];
+                this.shardLoading = fetch(shard.file)
+                    .then(response => {{
+                        if (!response.ok) throw new Error(`HTTP ${{response.status}}: ${{shard.file}}`);
+                        return response.json();
+                    }})
+                    .then(items => {{
+                        for (const item of items) this.qaData.push(item);
+                        this.sendToSearch({{ type: 'addRecords', items: this.searchFields(items) }});
+                        this.nextShard++;
+                        return items;
+                    }})
+                    .finally(() => {{
+                        this.shardLoading = null;
+                    }});
+                return this.shardLoading;
+            }}
+
+            async loadAllShards() {{
+                while (this.hasMoreShards()) {{
+                    await this.loadNextShard();
+                }}
+            }}
+
+            initSearch() {{
+                try {{
+                    const source = document.getElementById('searchEngineSource').textContent + searchWorkerSource;
+                    const url = URL.createObjectURL(new Blob([source], {{ type: 'text/javascript' }}));
+                    this.searchWorker = new Worker(url);
+                    this.searchWorker.onmessage = event => this.resolveQuery(event.data.id, event.data.ids);
+                    // Ошибка уже запущенного Worker: blob: запрещен политикой
+                    // страницы, исключение в движке, нехватка памяти на индекс
+                    this.searchWorker.onerror = event => {{
+                        event.preventDefault();
+                        this.useMainThreadSearch(event.message || event);
+                    }};
+                    this.searchWorker.onmessageerror = event => this.useMainThreadSearch(event);
+                }} catch (error) {{
+                    // Например, Web Worker запрещен политикой страницы
+                    this.useMainThreadSearch(error);
+                    return;
+                }}
+                this.sendToSearch({{ type: 'addRecords', items: this.searchFields(this.qaData) }});
+                if (this.searchIndex) {{
+                    this.sendToSearch({{ type: 'setIndex', index: this.searchIndex }});
+                }}
+            }}
+
+            useMainThreadSearch(error) {{
+                // Поиск переходит в основной поток: движок получает все уже
+                // загруженные записи, а ожидающие запросы выполняются заново
+                console.warn('Поиск выполняется в основном потоке', error);
+                if (this.searchWorker) {{
+                    this.searchWorker.terminate();
+                    this.searchWorker = null;
+                }}
+                this.searchEngine = new SearchEngine();
+                this.searchEngine.addRecords(this.searchFields(this.qaData));
+                // При сборке по частям от загруженного индекса остается только
+                // число записей, и поиск работает полным перебором
+                if (this.searchIndex && this.searchIndex.grams) {{
+                    this.searchEngine.setIndex(this.searchIndex);
+                }}
+
+                const pending = Array.from(this.pendingQueries.values());
+                this.pendingQueries.clear();
+                for (const query of pending) {{
+                    try {{
+                        query.resolve(this.searchEngine.query(query.searchTerm, query.tagMask));
+                    }} catch (queryError) {{
+                        query.reject(queryError);
                     }}
+                }}
+            }}
+
+            searchFields(items) {{
+                // В поиск уходят только поля, по которым он работает
+                return items.map(item => ({{
+                    search_key: item.search_key,
+                    tag_mask: item.tag_mask
+                }}));
+            }}
+
+            sendToSearch(message) {{
+                if (this.searchWorker) {{
+                    this.searchWorker.postMessage(message);
+                }} else if (message.type === 'addRecords') {{
+                    this.searchEngine.addRecords(message.items);
+                }} else if (message.type === 'setIndex') {{
+                    this.searchEngine.setIndex(message.index);
+                }}
+            }}
+
+            runQuery(searchTerm, tagMask) {{
+                // Новый запрос отменяет все еще не выполненные: их промисы
+                // получают null, а ответы на них игнорируются
+                const id = ++this.querySequence;
+                this.cancelQueries();
+
+                if (!this.searchWorker) {{
+                    return Promise.resolve(this.searchEngine.query(searchTerm, tagMask));
+                }}
+                // Запрос хранится вместе с условиями, чтобы при сбое Worker
+                // выполнить его в основном потоке
+                return new Promise((resolve, reject) => {{
+                    this.pendingQueries.set(id, {{ resolve, reject, searchTerm, tagMask }});
+                    this.searchWorker.postMessage({{ type: 'query', id, searchTerm, tagMask }});
                 }});
-                return allTags;
+            }}
+
+            cancelQueries() {{
+                for (const query of this.pendingQueries.values()) query.resolve(null);
+                this.pendingQueries.clear();
+            }}
+
+            resolveQuery(id, ids) {{
+                const query = this.pendingQueries.get(id);
+                if (!query) return;
+                this.pendingQueries.delete(id);
+                query.resolve(ids);
+            }}
+
+            loadSearchIndex() {{
+                if (this.searchIndex || !this.manifest || !this.manifest.search_index) {{
+                    return Promise.resolve(this.searchIndex);
+                }}
+                if (!this.searchIndexLoading) {{
+                    this.searchIndexLoading = fetch(this.manifest.search_index)
+                        .then(response => response.ok ? response.json() : null)
+                        .catch(() => null)
+                        .then(index => {{
+                            if (index) this.sendToSearch({{ type: 'setIndex', index }});
+                            // Сам индекс нужен только поиску
+                            this.searchIndex = index ? {{ records: index.records }} : null;
+                            return this.searchIndex;
+                        }});
+                }}
+                return this.searchIndexLoading;
+            }}
+
+            setupLazyLoading() {{
+                const sentinel = document.getElementById('loadMore');
+                if (!sentinel || !this.hasMoreShards()) return;
+
+                // Следующая часть загружается, когда низ списка подходит к экрану
+                const observer = new IntersectionObserver(async entries => {{
+                    if (!entries.some(entry => entry.isIntersecting) || this.isFiltering()) return;
+                    const items = await this.loadNextShard();
+                    if (!this.isFiltering()) this.appendQACards(items);
+                    if (!this.hasMoreShards()) observer.disconnect();
+                }}, {{ rootMargin: '1000px' }});
+                observer.observe(sentinel);
+            }}
+
+            setTagLabels(labels) {{
+                // Номера тегов присвоены при сборке (build_tag_table)
+                this.tagIds = new Map(labels.map((label, id) => [label, id]));
+                this.sortedTags = this.sortTags(labels);
+            }}
+
+            activeTagMask() {{
+                // Маска выбранных тегов; null, если фильтр по тегам не задан
+                const activeTags = Array.from(document.querySelectorAll('.tag-filter.active'))
+                    .map(btn => btn.dataset.tag);
+                if (activeTags.length === 0 || activeTags.includes('all')) return null;
+                const mask = new Array(Math.max(1, Math.ceil(this.tagIds.size / 32))).fill(0);
+                for (const tag of activeTags) {{
+                    const id = this.tagIds.get(tag);
+                    if (id !== undefined) mask[id >> 5] |= 1 << (id & 31);
+                }}
+                return mask;
             }}
 
             sortTags(tags) {{
@@ -546,13 +3316,6 @@ def create_interactive_html(qa_pairs: List[Dict[str, Any]],
                 return answerTag ? [answerTag, ...otherTags] : otherTags;
             }}
 
-            escapeHtml(text) {{
-                if (!text) return '';
-                const div = document.createElement('div');
-                div.textContent = text;
-                return div.innerHTML;
-            }}
-
             renderQACards(data) {{
                 const grid = document.getElementById('qaGrid');
                 
@@ -561,43 +3324,196 @@ def create_interactive_html(qa_pairs: List[Dict[str, Any]],
                     return;
                 }}
 
-                grid.innerHTML = '';
+                this.results = data;
+                this.layout = null;
+                this.updateShownCount(data.length);
 
                 if (data.length === 0) {{
+                    this.virtual = null;
                     grid.innerHTML = '<div class="no-results">😔 Ничего не найдено. Попробуйте изменить поисковый запрос или фильтры.</div>';
                     return;
                 }}
 
-                data.forEach((item) => {{
-                    const card = document.createElement('div');
-                    card.className = 'qa-card';
-                    
-                    card.innerHTML = `
-                        <div class="question">
-                            <div class="section-title">Вопрос</div>
-                            <div class="question-text">${{this.escapeHtml(item.question_text)}}</div>
-                            <div class="meta">
-                                От: ${{this.escapeHtml(item.question_sender)}} • 
-                                Дата: ${{this.escapeHtml(item.question_date)}}
-                            </div>
-                        </div>
-                        <div class="answer">
-                            <div class="section-title">Ответ</div>
-                            <div class="answer-text">${{this.escapeHtml(item.answer_text)}}</div>
-                            <div class="meta">
-                                Дата ответа: ${{this.escapeHtml(item.answer_date)}}
-                            </div>
-                        </div>
-                        <div class="tags">
-                            ${{(item.tags || []).map(tag => 
-                                `<span class="tag" data-tag="${{tag}}">${{this.escapeHtml(tag)}}</span>`
-                            ).join('')}}
-                        </div>
-                    `;
-                    grid.appendChild(card);
+                this.ensureVirtualGrid(grid);
+                this.renderWindow();
+            }}
+
+            appendQACards(data) {{
+                // Без фильтров results - это сам qaData, и новые записи уже в нем
+                if (this.results !== this.qaData) {{
+                    for (const item of data) this.results.push(item);
+                }}
+                this.layout = null;
+                this.updateShownCount(this.results.length);
+                this.renderWindow();
+            }}
+
+            ensureVirtualGrid(grid) {{
+                // В сетке живут только карточки около экрана; место остальных
+                // занимают распорки сверху и снизу на всю ширину сетки
+                if (this.virtual && this.virtual.top.parentNode === grid) return;
+
+                grid.innerHTML = '';
+                const top = document.createElement('div');
+                const bottom = document.createElement('div');
+                top.className = 'virtual-spacer';
+                bottom.className = 'virtual-spacer';
+                grid.appendChild(top);
+                grid.appendChild(bottom);
+                this.virtual = {{ grid, top, bottom, cards: [], pool: [], start: 0, end: 0 }};
+            }}
+
+            scheduleRender() {{
+                if (this.renderPending) return;
+                this.renderPending = true;
+                requestAnimationFrame(() => {{
+                    this.renderPending = false;
+                    this.renderWindow();
                 }});
+            }}
 
-                this.updateShownCount(data.length);
+            computeLayout() {{
+                // Смещения рядов по известным (измеренным) или средним высотам карточек
+                const style = window.getComputedStyle(this.virtual.grid);
+                const template = style.gridTemplateColumns || 'none';
+                const columns = template === 'none' ? 1 : Math.max(1, template.split(' ').filter(Boolean).length);
+                const gap = parseFloat(style.rowGap) || 0;
+                const estimate = this.measuredCount ? this.measuredTotal / this.measuredCount : 600;
+                const rows = Math.ceil(this.results.length / columns);
+                const offsets = new Float64Array(rows + 1);
+                for (let row = 0; row < rows; row++) {{
+                    let height = 0;
+                    for (let i = row * columns; i < Math.min((row + 1) * columns, this.results.length); i++) {{
+                        height = Math.max(height, this.cardHeights.get(this.results[i]) || estimate);
+                    }}
+                    offsets[row + 1] = offsets[row] + height + gap;
+                }}
+                this.layout = {{ columns, gap, rows, offsets }};
+            }}
+
+            firstRowEndingAfter(position) {{
+                const offsets = this.layout.offsets;
+                let low = 0, high = this.layout.rows;
+                while (low < high) {{
+                    const middle = (low + high) >> 1;
+                    if (offsets[middle + 1] > position) high = middle;
+                    else low = middle + 1;
+                }}
+                return low;
+            }}
+
+            renderWindow() {{
+                const virtual = this.virtual;
+                if (!virtual || !this.results || virtual.top.parentNode !== virtual.grid) return;
+                if (!this.layout) this.computeLayout();
+
+                const {{ columns, rows, offsets }} = this.layout;
+                const viewportTop = -virtual.grid.getBoundingClientRect().top;
+                const overscan = window.innerHeight;
+                const firstRow = Math.min(this.firstRowEndingAfter(viewportTop - overscan), Math.max(rows - 1, 0));
+                const lastRow = Math.max(firstRow, this.firstRowEndingAfter(viewportTop + window.innerHeight + overscan));
+                const start = firstRow * columns;
+                const end = Math.min((lastRow + 1) * columns, this.results.length);
+
+                virtual.top.style.height = `${{offsets[firstRow]}}px`;
+                virtual.bottom.style.height = `${{offsets[rows] - offsets[Math.min(lastRow + 1, rows)]}}px`;
+
+                if (start === virtual.start && end === virtual.end && virtual.results === this.results &&
+                    virtual.cards.length === end - start) {{
+                    return;
+                }}
+                virtual.start = start;
+                virtual.end = end;
+                virtual.results = this.results;
+
+                // Карточки записей, оставшихся на экране, не трогаем, остальные
+                // уходят в пул и заполняются новыми записями
+                const visible = this.results.slice(start, end);
+                const visibleSet = new Set(visible);
+                const kept = new Map();
+                for (const card of virtual.cards) {{
+                    if (visibleSet.has(card.item) && !kept.has(card.item)) {{
+                        kept.set(card.item, card);
+                    }} else {{
+                        card.remove();
+                        virtual.pool.push(card);
+                    }}
+                }}
+                virtual.cards = visible.map(item => kept.get(item) || this.fillCard(virtual.pool.pop() || this.createCard(), item));
+                for (const card of virtual.cards) {{
+                    virtual.grid.insertBefore(card, virtual.bottom);
+                }}
+
+                this.measureCards(start);
+            }}
+
+            measureCards(start) {{
+                // Запоминаем настоящие высоты; если оценка ряда была неверной,
+                // пересчитываем раскладку в следующем кадре
+                const {{ columns, offsets, gap }} = this.layout;
+                const cards = this.virtual.cards;
+                let changed = false;
+                for (let i = 0; i < cards.length; i++) {{
+                    const height = cards[i].offsetHeight;
+                    if (!height) continue;
+                    if (!this.cardHeights.has(cards[i].item)) {{
+                        this.measuredTotal += height;
+                        this.measuredCount++;
+                    }}
+                    this.cardHeights.set(cards[i].item, height);
+                }}
+                for (let i = 0; i < cards.length; i += columns) {{
+                    const row = (start + i) / columns;
+                    let height = 0;
+                    for (let k = i; k < Math.min(i + columns, cards.length); k++) {{
+                        height = Math.max(height, this.cardHeights.get(cards[k].item) || 0);
+                    }}
+                    if (Math.abs(offsets[row + 1] - offsets[row] - gap - height) > 1) changed = true;
+                }}
+                if (changed) {{
+                    this.layout = null;
+                    this.scheduleRender();
+                }}
+            }}
+
+            createCard() {{
+                const element = (tag, className, parent, text) => {{
+                    const node = document.createElement(tag);
+                    node.className = className;
+                    if (text) node.textContent = text;
+                    parent.appendChild(node);
+                    return node;
+                }};
+                const card = document.createElement('div');
+                card.className = 'qa-card';
+                const question = element('div', 'question', card);
+                element('div', 'section-title', question, 'Вопрос');
+                const questionText = element('div', 'question-text', question);
+                const questionMeta = element('div', 'meta', question);
+                const answer = element('div', 'answer', card);
+                element('div', 'section-title', answer, 'Ответ');
+                const answerText = element('div', 'answer-text', answer);
+                const answerMeta = element('div', 'meta', answer);
+                const tags = element('div', 'tags', card);
+                card.fields = {{ questionText, questionMeta, answerText, answerMeta, tags }};
+                return card;
+            }}
+
+            fillCard(card, item) {{
+                const fields = card.fields;
+                card.item = item;
+                fields.questionText.textContent = item.question_text || '';
+                fields.questionMeta.textContent = `От: ${{item.question_sender || ''}} • Дата: ${{item.question_date || ''}}`;
+                fields.answerText.textContent = item.answer_text || '';
+                fields.answerMeta.textContent = `Дата ответа: ${{item.answer_date || ''}}`;
+                fields.tags.replaceChildren(...(item.tags || []).map(tag => {{
+                    const span = document.createElement('span');
+                    span.className = 'tag';
+                    span.dataset.tag = tag;
+                    span.textContent = tag;
+                    return span;
+                }}));
+                return card;
             }}
 
             initTagFilters() {{
@@ -630,38 +3546,58 @@ def create_interactive_html(qa_pairs: List[Dict[str, Any]],
                 this.filterAndSearch();
             }}
 
-            filterAndSearch() {{
-                const searchTerm = document.getElementById('searchInput').value.toLowerCase();
-                const activeTags = Array.from(document.querySelectorAll('.tag-filter.active'))
-                    .map(btn => btn.dataset.tag);
+            isFiltering() {{
+                const searchInput = document.getElementById('searchInput');
+                return Boolean(searchInput && searchInput.value) || this.activeTagMask() !== null;
+            }}
 
-                const filtered = this.qaData.filter(item => {{
-                    const matchesSearch = !searchTerm || 
-                        (item.question_text && item.question_text.toLowerCase().includes(searchTerm)) ||
-                        (item.answer_text && item.answer_text.toLowerCase().includes(searchTerm));
+            async filterAndSearch() {{
+                const sequence = ++this.querySequence;
+                this.cancelQueries();
 
-                    const matchesTags = activeTags.length === 0 || 
-                        activeTags.includes('all') ||
-                        (item.tags && activeTags.some(tag => item.tags.includes(tag)));
+                // Поиск и фильтры работают по всей библиотеке, поэтому
+                // сначала догружаем оставшиеся части и индекс
+                if (this.isFiltering()) {{
+                    await this.loadAllShards();
+                    await this.loadSearchIndex();
+                }}
+                if (sequence !== this.querySequence) return;
 
-                    return matchesSearch && matchesTags;
-                }});
+                if (!this.isFiltering()) {{
+                    this.renderQACards(this.qaData);
+                    return;
+                }}
+
+                const searchTerm = document.getElementById('searchInput').value;
+                const ids = await this.runQuery(searchTerm, this.activeTagMask());
+                // null - запрос отменен более новым
+                if (ids === null) return;
 
-                this.renderQACards(filtered);
+                this.renderQACards(Array.from(ids, id => this.qaData[id]));
             }}
 
             setupEventListeners() {{
                 const searchInput = document.getElementById('searchInput');
                 if (searchInput) {{
-                    searchInput.addEventListener('input', () => this.filterAndSearch());
+                    // Запрос уходит, когда ввод замирает на 150 мс
+                    searchInput.addEventListener('input', () => {{
+                        clearTimeout(this.searchDebounce);
+                        this.searchDebounce = setTimeout(() => this.filterAndSearch(), 150);
+                    }});
                 }}
+
+                window.addEventListener('scroll', () => this.scheduleRender(), {{ passive: true }});
+                window.addEventListener('resize', () => {{
+                    this.layout = null;
+                    this.scheduleRender();
+                }});
             }}
 
             updateStats() {{
                 const totalCount = document.getElementById('totalCount');
                 const tagsCount = document.getElementById('tagsCount');
                 
-                if (totalCount) totalCount.textContent = this.qaData.length;
+                if (totalCount) totalCount.textContent = this.manifest ? this.manifest.total_entries : this.qaData.length;
                 if (tagsCount) tagsCount.textContent = this.sortedTags.length;
             }}
 
@@ -679,11 +3615,7 @@ def create_interactive_html(qa_pairs: List[Dict[str, Any]],
 </body>
 </html>'''
     
-    with open(html_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    
     # 3. Создаем CSS файл
-    css_file = os.path.join(output_dir, "styles.css")
     css_content = ''':root {
     --primary-color: #2c3e50;
     --secondary-color: #34495e;
@@ -880,6 +3812,10 @@ header {
     font-style: italic;
 }
 
+.virtual-spacer {
+    grid-column: 1 / -1;
+}
+
 .no-results {
     text-align: center;
     padding: 4rem;
@@ -936,95 +3872,629 @@ header {
     }
 }'''
     
-    with open(css_file, 'w', encoding='utf-8') as f:
-        f.write(css_content)
+    # CSS пишется первым: в режиме publish страница ссылается на имя с хешем
+    css_name = assets.write("styles.css", minify_css(css_content) if publish else css_content)
+    html_content = html_content.replace('href="styles.css"', f'href="{css_name}"')
+    html_file = assets.path(assets.write("index.html",
+                                         minify_html(html_content) if publish else html_content,
+                                         hashed=False))
+    
+    if publish:
+        assets.write_manifest()
+        total = sum(entry["bytes"] for entry in assets.files.values())
+        compressed = sum(entry["encodings"].get("gzip", entry)["bytes"] for entry in assets.files.values())
+        print(f"📦 Файлы для выкладки: {len(assets.files)}, {total / 1024:.0f} КБ, "
+              f"в gzip {compressed / 1024:.0f} КБ{'' if brotli else ' (brotli не установлен, без .br)'}")
+    assets.remove_stale()
     
     return html_file, json_file
 
-def main():
-    """Основная функция"""
+@contextlib.contextmanager
+def staged_directory(path: str) -> Iterator[str]:
+    """Дает копию папки path для записи и после успешного блока with подменяет ею path
+    
+    Новая версия собирается целиком в соседней папке, а затем меняется
+    со старой двумя переименованиями, поэтому читатели видят либо прежние,
+    либо новые файлы, но не смесь. Между переименованиями path на мгновение
+    отсутствует: если второе не удалось, прежняя папка возвращается на место,
+    а если процесс прервался между ними, она остается в path.previous-<pid>
+    и восстанавливается при следующем вызове. При ошибке в блоке with path
+    остается прежним.
+    """
+    staging = f"{path}.staging-{os.getpid()}"
+    previous = f"{path}.previous-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    if not os.path.exists(path):
+        leftovers = sorted(glob.glob(f"{glob.escape(path)}.previous-*"), key=os.path.getmtime)
+        if leftovers:
+            print(f"♻️  Восстановлена прежняя версия {path} из {leftovers[-1]}")
+            os.replace(leftovers[-1], path)
+    if os.path.isdir(path):
+        shutil.copytree(path, staging)
+    else:
+        os.makedirs(staging)
+    
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    
+    if os.path.exists(path):
+        os.replace(path, previous)
+    try:
+        os.replace(staging, path)
+    except BaseException:
+        if os.path.exists(previous) and not os.path.exists(path):
+            os.replace(previous, path)
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    shutil.rmtree(previous, ignore_errors=True)
+
+@contextlib.contextmanager
+def staged_database(db_path: str, copy: bool = True) -> Iterator[str]:
+    """Дает путь к копии SQLite базы и после успешного блока with заменяет ею db_path
+    
+    Копия делается через backup API (copy=False - начать с пустой базы)
+    и подменяет базу одним os.replace: соединения, открытые раньше, дочитывают
+    прежнюю версию, новые видят только полностью записанную.
+    """
+    staging = f"{db_path}.staging-{os.getpid()}"
+    if os.path.exists(staging):
+        os.remove(staging)
+    if copy and os.path.exists(db_path):
+        source = sqlite3.connect(db_path)
+        target = sqlite3.connect(staging)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    
+    try:
+        yield staging
+    except BaseException:
+        if os.path.exists(staging):
+            os.remove(staging)
+        raise
+    
+    os.replace(staging, db_path)
+
+class _TrackedParagraphs:
+    """Абзацы документа с номером текущего абзаца и хешем всех предыдущих
+    
+    Пока парсер обрабатывает абзац index, digest покрывает абзацы
+    [0, index) - ровно префикс документа до этого места.
+    """
+    
+    def __init__(self, paragraphs: Iterable[str], start: int = 0, digest=None):
+        self.paragraphs = paragraphs
+        self.index = start
+        self.digest = digest or hashlib.sha256()
+    
+    def __iter__(self) -> Iterator[str]:
+        for text in self.paragraphs:
+            yield text
+            self.digest.update(text.encode('utf-8') + b'\0')
+            self.index += 1
+
+class LibraryWatcher:
+    """Режим наблюдения: пересобирает библиотеку, когда меняется выгрузка
+    
+    Файл опрашивается раз в interval секунд: сначала сравниваются время
+    изменения и размер, затем хеш содержимого. Выгрузки растут с конца,
+    поэтому при изменении заново разбирается только хвост документа,
+    начиная с последнего известного сообщения: префикс до него сверяется
+    по хешу абзацев, а само сообщение - по message_id и хешу содержимого.
+    Если документ изменился не только в конце, библиотека собирается заново.
+    
+    Новые сообщения добавляются в группировщик, пары пересобираются только
+    для затронутых цепочек (QAGrouper.find_affected_ids). SQLite база
+    синхронизируется в копии (staged_database), а src/ собирается в соседней
+    папке (staged_directory), и обе подменяются только целиком.
+    """
+    
+    def __init__(self, docx_file: str, db_path: str = "chat_database.db",
+                 output_dir: str = "src", interval: float = 5.0,
+                 shard_size: Optional[int] = None, publish: bool = False,
+                 json_file: Optional[str] = LIBRARY_JSON_FILE,
+                 thread_policy: str = DEFAULT_THREAD_POLICY):
+        self.docx_file = docx_file
+        self.db_path = db_path
+        self.output_dir = output_dir
+        self.interval = interval
+        self.shard_size = shard_size
+        self.publish = publish
+        self.json_file = json_file
+        self.thread_policy = thread_policy
+        self.parser = ChatParser()
+        self.grouper = None
+        # Пары по question_key и ключи пар, в которые входит сообщение
+        self.qa_pairs = {}
+        self.pair_keys_by_message = defaultdict(set)
+        self._signature = None
+        self._file_digest = None
+        # Где начинается последнее сообщение: номер абзаца, хеш абзацев до него,
+        # message_id и хеш содержимого самого сообщения
+        self._resume_at = 0
+        self._prefix_digest = None
+        self._last_message = None
+    
+    def run(self, max_checks: Optional[int] = None):
+        """Опрашивает файл, пока не прервут (Ctrl+C) или не пройдет max_checks проверок"""
+        print(f"👀 Наблюдение за {self.docx_file} (проверка раз в {self.interval:g} с, Ctrl+C - выход)")
+        checks = 0
+        try:
+            while max_checks is None or checks < max_checks:
+                self.check()
+                checks += 1
+                if max_checks is None or checks < max_checks:
+                    time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print("👋 Наблюдение остановлено")
+    
+    def check(self) -> bool:
+        """Обновляет библиотеку, если файл изменился; возвращает, было ли обновление"""
+        try:
+            stat = os.stat(self.docx_file)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+        
+        digest = _file_digest(self.docx_file)
+        if digest == self._file_digest:
+            self._signature = signature
+            return False
+        
+        try:
+            if self.grouper is None or not self._update_tail():
+                self._rebuild()
+        except (zipfile.BadZipFile, ET.ParseError, KeyError) as e:
+            # Файл, вероятно, еще копируется: повторим на следующей проверке
+            print(f"⚠️ Не удалось прочитать {self.docx_file}: {e}")
+            return False
+        except (sqlite3.Error, OSError) as e:
+            # База или src/ заняты либо диск переполнен: прежние версии
+            # не тронуты, повторим на следующей проверке
+            print(f"⚠️ Не удалось обновить библиотеку: {e}")
+            return False
+        
+        self._signature = signature
+        self._file_digest = digest
+        return True
+    
+    def _rebuild(self):
+        """Полная сборка: разбор всего документа и группировка всех пар"""
+        print(f"🔨 Полная сборка библиотеки из {self.docx_file}")
+        # Группировщик становится доступен хвостовому разбору только после успешной сборки
+        self.grouper = None
+        grouper = QAGrouper(thread_policy=self.thread_policy)
+        self._resume_at, self._prefix_digest, self._last_message = 0, hashlib.sha256(), None
+        paragraphs = _TrackedParagraphs(iter_docx_paragraphs(self.docx_file))
+        messages = self._track_messages(paragraphs, self.parser.iter_paragraph_messages(paragraphs))
+        
+        # База, собранная по другому правилу, пересобирается целиком
+        incremental = DatabaseManager(self.db_path).thread_policy() == self.thread_policy
+        with staged_database(self.db_path, copy=incremental) as staged_db:
+            db_manager = DatabaseManager(staged_db)
+            if incremental:
+                db_manager.sync_sqlite(grouper.index_messages(messages), grouper)
+            else:
+                db_manager.init_sqlite(self.thread_policy)
+                db_manager.save_messages(grouper.index_messages(messages))
+            
+            qa_pairs = grouper.group_questions_answers()
+            if not incremental:
+                db_manager.save_qa_pairs(qa_pairs)
+        
+        self.grouper = grouper
+        self.qa_pairs = {}
+        self.pair_keys_by_message = defaultdict(set)
+        self._add_pairs(qa_pairs)
+        self._write_web_app()
+    
+    def _update_tail(self) -> bool:
+        """Разбирает только хвост документа; False - нужна полная сборка"""
+        if self._prefix_digest is None or self._last_message is None:
+            return False
+        
+        paragraphs = iter(iter_docx_paragraphs(self.docx_file))
+        digest = hashlib.sha256()
+        for text in itertools.islice(paragraphs, self._resume_at):
+            digest.update(text.encode('utf-8') + b'\0')
+        if digest.digest() != self._prefix_digest.digest():
+            print("🔁 Документ изменился не только в конце")
+            return False
+        
+        tracked = _TrackedParagraphs(paragraphs, self._resume_at, digest)
+        last_id, last_hash = self._last_message
+        messages = list(self._track_messages(tracked, self.parser.iter_paragraph_messages(tracked)))
+        if not messages or messages[0].message_id != last_id or _message_hash(messages[0]) != last_hash:
+            print("🔁 Последнее известное сообщение изменилось")
+            return False
+        
+        new_messages = messages[1:]
+        print(f"➕ Новых сообщений в конце выгрузки: {len(new_messages)}")
+        if not new_messages:
+            return True
+        
+        try:
+            self._apply_tail(new_messages)
+        except BaseException:
+            # Группировщик и пары в памяти уже содержат сообщения, которые не
+            # попали в базу и src/: следующая проверка соберет все заново
+            self.grouper = None
+            raise
+        return True
+    
+    def _apply_tail(self, new_messages: List[ChatMessage]):
+        """Добавляет новые сообщения в базу, пары и веб-приложение"""
+        with staged_database(self.db_path) as staged_db:
+            DatabaseManager(staged_db).sync_sqlite(self.grouper.index_messages(new_messages),
+                                                   self.grouper, remove_missing=False)
+        
+        # Пересобираем в памяти только пары затронутых цепочек
+        affected_ids = self.grouper.find_affected_ids(msg.message_id for msg in new_messages
+                                                      if msg.message_id)
+        stale_keys = set().union(*(self.pair_keys_by_message.get(message_id, ())
+                                   for message_id in affected_ids))
+        stale_pairs = [self._remove_pair(key) for key in stale_keys]
+        answer_ids = self.grouper.answers_to_rebuild(affected_ids, stale_pairs)
+        rebuilt = list(self.grouper.iter_questions_answers(answer_ids)) if answer_ids else []
+        for qa in rebuilt:
+            if _qa_pair_key(qa) in self.qa_pairs:
+                self._remove_pair(_qa_pair_key(qa))
+        self._add_pairs(rebuilt)
+        print(f"✏️  Пересобрано пар вопрос-ответ: {len(rebuilt)}, всего пар: {len(self.qa_pairs)}")
+        
+        self._write_web_app()
+    
+    def _track_messages(self, paragraphs: _TrackedParagraphs,
+                        messages: Iterable[ChatMessage]) -> Iterator[ChatMessage]:
+        """Запоминает, где начинается последнее сообщение, чтобы следующий разбор начать с него
+        
+        Сообщение отдается, когда парсер встречает начало следующего; в этот
+        момент paragraphs.index - номер абзаца, с которого начинается
+        следующее сообщение, а digest покрывает все абзацы до него.
+        """
+        resume = (0, hashlib.sha256())
+        previous = None
+        for msg in messages:
+            if previous is not None:
+                self._resume_at, self._prefix_digest = resume
+            resume = (paragraphs.index, paragraphs.digest.copy())
+            previous = msg
+            self._last_message = (msg.message_id, _message_hash(msg))
+            yield msg
+    
+    def _add_pairs(self, qa_pairs: Iterable[Dict[str, Any]]):
+        for qa in qa_pairs:
+            key = _qa_pair_key(qa)
+            self.qa_pairs[key] = qa
+            for message_id in qa['question_ids'] + qa['answer_ids']:
+                self.pair_keys_by_message[message_id].add(key)
+    
+    def _remove_pair(self, key: str) -> Dict[str, Any]:
+        qa = self.qa_pairs.pop(key)
+        for message_id in qa['question_ids'] + qa['answer_ids']:
+            keys = self.pair_keys_by_message.get(message_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.pair_keys_by_message[message_id]
+        return qa
+    
+    def _ordered_pairs(self) -> List[Dict[str, Any]]:
+        """Пары в порядке полной сборки: по первому ответу Виолетты в документе"""
+        store = self.grouper.messages
+        
+        def order(qa):
+            positions = [store.find(answer_id) for answer_id in qa['answer_ids']]
+            return min((position for position in positions if position is not None), default=-1)
+        
+        return sorted(self.qa_pairs.values(), key=order)
+    
+    def _write_web_app(self):
+        """Собирает src/ в соседней папке и подменяет ею прежнюю"""
+        json_outputs = [JsonOutput(self.json_file, all_tags=True)] if self.json_file else []
+        with staged_directory(self.output_dir) as staging:
+            create_interactive_html(self._ordered_pairs(), staging, shard_size=self.shard_size,
+                                    publish=self.publish, json_outputs=json_outputs)
+        print(f"✅ Библиотека обновлена: {len(self.qa_pairs)} пар, {datetime.now():%H:%M:%S}")
+
+def _file_digest(path: str) -> str:
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def parse_stages(value: str) -> List[str]:
+    """Разбирает список этапов через запятую ('json,html') в порядке PIPELINE_STAGES"""
+    stages = {stage.strip() for stage in value.split(',') if stage.strip()}
+    unknown = stages.difference(PIPELINE_STAGES)
+    if unknown or not stages:
+        raise ValueError(f"неизвестные этапы: {', '.join(sorted(unknown)) or repr(value)}; "
+                         f"доступны: {', '.join(PIPELINE_STAGES)}")
+    return [stage for stage in PIPELINE_STAGES if stage in stages]
+
+def main(incremental: bool = True, input_paths: Optional[List[str]] = None,
+         profile_report: Optional[str] = None, cprofile_output: Optional[str] = None,
+         shard_size: Optional[int] = None, publish: bool = False,
+         watch_interval: Optional[float] = None, stages: Optional[Iterable[str]] = None,
+         output_dir: str = "src", db_path: str = "chat_database.db",
+         json_file: str = LIBRARY_JSON_FILE, cache_dir: Optional[str] = None,
+         thread_policy: str = DEFAULT_THREAD_POLICY):
+    """Основная функция
+    
+    При incremental=True существующая SQLite база синхронизируется
+    с документом вместо полной пересборки. input_paths - список Word файлов
+    или папок с ними; несколько выгрузок разбираются параллельно
+    и объединяются по ID сообщений.
+    
+    stages - выполняемые этапы из PIPELINE_STAGES, по умолчанию все:
+    parse - разбор документов, group - группировка пар вопрос-ответ,
+    sqlite - база db_path, json - JSON-база json_file, html - веб-приложение
+    в output_dir. Результаты разбора и группировки сохраняются в ParseCache
+    (cache_dir), и если нужный этапу результат не входит в stages, он берется
+    оттуда: например, stages=['html'] обновляет только веб-приложение, не
+    разбирая документ и не трогая SQLite. Если в кэше его нет, сборка
+    останавливается с подсказкой, какой этап добавить.
+    
+    thread_policy - правило сборки пар из цепочек ответов (THREAD_POLICIES).
+    Правило запоминается в SQLite базе; если база собрана по другому правилу,
+    она пересобирается целиком, даже при incremental=True.
+    
+    profile_report - путь к JSON-отчету о времени, CPU и памяти по этапам,
+    cprofile_output - путь для дампа cProfile. Сводка профиля печатается
+    в конце работы. shard_size включает загрузку данных веб-приложения
+    частями вместо встраивания в index.html, publish - сборку output_dir
+    для статического хостинга (минификация, хеши в именах, .gz/.br).
+    
+    watch_interval включает режим наблюдения (LibraryWatcher): выгрузка
+    проверяется раз в столько секунд, и библиотека обновляется при ее
+    изменении, пока работу не прервут. Он всегда выполняет все этапы.
+    """
     
     # Конфигурация - укажите путь к вашему Word файлу
     input_docx = "ВСЕ_СООБЩЕНИЯ_СТАРЫЕ_Чат. Мастер Группа Макеевой Виолетты_20251029_1403.docx"
+    stages = set(stages or PIPELINE_STAGES)
     
-    if not os.path.exists(input_docx):
-        print(f"❌ Файл {input_docx} не найден!")
+    input_files = collect_docx_files(input_paths or [input_docx])
+    missing_files = [path for path in input_files if not os.path.exists(path)]
+    if missing_files or not input_files:
+        for path in missing_files or input_paths or [input_docx]:
+            print(f"❌ Файл {path} не найден!")
         print("Пожалуйста, положите Word файл в ту же папку что и этот скрипт")
         return
     
+    if watch_interval is not None:
+        if len(input_files) != 1:
+            print("❌ В режиме наблюдения можно указать только один Word файл")
+            return
+        if stages != set(PIPELINE_STAGES):
+            print("❌ Режим наблюдения выполняет все этапы, выбрать их нельзя")
+            return
+        LibraryWatcher(input_files[0], db_path=db_path, output_dir=output_dir,
+                       interval=watch_interval, shard_size=shard_size, publish=publish,
+                       json_file=json_file, thread_policy=thread_policy).run()
+        return
+    
+    if profile_report or cprofile_output:
+        profiler.start(trace_memory=bool(profile_report), cprofile=bool(cprofile_output))
+    
     try:
-        # Инициализация компонентов
         parser = ChatParser()
-        db_manager = DatabaseManager()
+        parse_cache = ParseCache(cache_dir)
+        db_manager = DatabaseManager(db_path)
+        incremental = incremental and os.path.exists(db_path)
+        if incremental and 'sqlite' in stages:
+            stored_policy = db_manager.thread_policy()
+            if stored_policy not in (None, thread_policy):
+                print(f"🔁 Пары в {db_path} собраны по правилу {stored_policy}, "
+                      f"база будет пересобрана по правилу {thread_policy}")
+                incremental = False
+        message_count = None
+        qa_pairs = None
         
-        # Парсинг документа
-        messages = parser.parse_word_document(input_docx)
+        # Готовые пары нужны, если этапы после группировки выполняются без нее;
+        # синхронизация SQLite пересобирает затронутые пары сама
+        needs_pairs = bool(stages & {'json', 'html'}) or ('sqlite' in stages and not incremental)
+        if needs_pairs and 'group' not in stages:
+            qa_pairs = parse_cache.load_qa_pairs(parser, input_files, thread_policy)
+            if qa_pairs is None:
+                print("❌ Нет сохраненных пар вопрос-ответ для этих документов: добавьте этап group")
+                return
         
-        if not messages:
-            print("❌ Не найдено сообщений для обработки")
-            return
+        if stages & {'parse', 'group', 'sqlite'}:
+            if 'parse' not in stages:
+                for path in input_files:
+                    if not parse_cache.contains(parser, path):
+                        print(f"❌ Нет сохраненного разбора {path}: добавьте этап parse")
+                        return
+            
+            # Парсинг документа: сообщения потоком индексируются группировщиком
+            # и пачками записываются в SQLite, не собираясь в отдельный список
+            if len(input_files) == 1:
+                messages = parse_cache.iter_messages(parser, input_files[0])
+            else:
+                messages = parse_documents(input_files, cache=parse_cache)
+            grouper = QAGrouper(thread_policy=thread_policy)
+            if stages & {'group', 'sqlite'}:
+                messages = grouper.index_messages(messages)
+            
+            if 'sqlite' not in stages:
+                message_count = sum(1 for _ in messages)
+            elif incremental:
+                db_manager.sync_sqlite(messages, grouper)
+                message_count = len(grouper.messages)
+            else:
+                db_manager.init_sqlite(thread_policy)
+                message_count = db_manager.save_messages(messages)
+            
+            if not message_count:
+                print("❌ Не найдено сообщений для обработки")
+                return
         
         # Группировка вопросов и ответов
-        grouper = QAGrouper(messages)
-        qa_pairs = grouper.group_questions_answers()
+        if 'group' in stages:
+            qa_pairs = grouper.group_questions_answers()
+            parse_cache.save_qa_pairs(parser, input_files, qa_pairs, thread_policy)
         
-        if not qa_pairs:
+        if qa_pairs is not None and not qa_pairs:
             print("❌ Не найдено пар вопрос-ответ для обработки")
             return
         
         # Сохранение в различные форматы
-        db_manager.save_to_sqlite(messages, qa_pairs)
-        json_file = db_manager.create_json_database(qa_pairs)
+        if 'sqlite' in stages and not incremental:
+            db_manager.save_qa_pairs(qa_pairs)
         
-        # Создаем веб-приложение
-        html_file, data_json_file = create_interactive_html(qa_pairs, "src")
+        json_outputs = [JsonOutput(json_file, all_tags=True)] if 'json' in stages else []
+        if 'html' in stages:
+            # Веб-приложение; JSON-база пишется в том же проходе, что и data.json
+            html_file, data_json_file = create_interactive_html(
+                qa_pairs, output_dir, shard_size=shard_size, publish=publish,
+                json_outputs=json_outputs)
+        elif json_outputs:
+            db_manager.create_json_database(qa_pairs, json_file)
+        
+        if 'html' not in stages:
+            print(f"\n✅ Выполнены этапы: {', '.join(s for s in PIPELINE_STAGES if s in stages)}")
+            if message_count is not None:
+                print(f"   - Обработано сообщений: {message_count}")
+            if qa_pairs is not None:
+                print(f"   - Найдено пар вопрос-ответ: {len(qa_pairs)}")
+            return
         
         # Вывод статистики
         all_tags = set()
         for qa in qa_pairs:
             all_tags.update(qa.get('tags', []))
         
+        # Состав папки зависит от режима: данные встроены в index.html или
+        # лежат частями в data/, в режиме publish имена содержат хеш
+        hashed = '.<хеш>' if publish else ''
+        created_files = [
+            f"{os.path.basename(html_file)} - приложение"
+            + (", данные загружаются частями из data/" if shard_size else " со встроенными данными"),
+            f"styles{hashed}.css - стили",
+            f"{os.path.basename(data_json_file)} - "
+            + ("все пары одним файлом" if shard_size else "резервная копия данных"),
+        ]
+        if shard_size:
+            created_files.append(f"data/ - части qa-NNNNN{hashed}.json, поисковый индекс "
+                                 f"search-index{hashed}.json и манифест manifest{hashed}.json")
+        if publish:
+            created_files.append("asset-manifest.json - исходные и итоговые имена файлов")
+            encodings = "*.gz, *.br" if brotli is not None else "*.gz"
+            created_files.append(f"{encodings} - сжатые копии для отдачи с Content-Encoding")
+        files_list = '\n'.join(f"   • {line}" for line in created_files)
+        json_line = f"\n📄 JSON-база: {json_file}\n" if 'json' in stages else ''
+        
+        if shard_size:
+            local_run = f"""   - Запустите локальный сервер в папке {output_dir}/:
+     python -m http.server
+   - Открыть index.html как файл нельзя: части данных загружаются по HTTP"""
+            notes = """🌐 Преимущества:
+   • index.html открывается быстро при любом размере библиотеки
+   • Данные подгружаются при прокрутке и поиске
+   • Можно разместить на GitHub Pages"""
+        else:
+            local_run = f"""   - Просто откройте {output_dir}/index.html в браузере
+   - Или запустите локальный сервер в папке {output_dir}/"""
+            notes = f"""🌐 Преимущества:
+   • Не требует отдельных JSON файлов
+   • Работает офлайн
+   • Нет проблем с CORS
+   • Можно разместить на GitHub Pages
+
+📝 Примечание: файл {os.path.basename(data_json_file)} создается как резервная копия, 
+   но приложение использует данные встроенные в HTML"""
+        
         print(f"""
 ✅ Приложение успешно создано!
 
 📊 Статистика:
-   - Обработано сообщений: {len(messages)}
+   - Обработано сообщений: {'—' if message_count is None else message_count}
    - Найдено пар вопрос-ответ: {len(qa_pairs)}
    - Собрано уникальных тегов: {len(all_tags)}
 
-📁 Созданные файлы в папке src/:
-   • index.html - приложение со встроенными данными
-   • styles.css - стили
-   • data.json - резервная копия данных
-
+📁 Созданные файлы в папке {output_dir}/:
+{files_list}
+{json_line}
 🚀 КАК ИСПОЛЬЗОВАТЬ:
 
 1. 📂 ДЛЯ GITHUB (залить всё):
-   - Папку src/ целиком (index.html, styles.css, data.json)
+   - Папку {output_dir}/ целиком
 
 2. 💻 ЛОКАЛЬНЫЙ ЗАПУСК:
-   - Просто откройте src/index.html в браузере
-   - Или запустите локальный сервер в папке src/
+{local_run}
 
 3. 🔄 ОБНОВЛЕНИЕ ДАННЫХ:
    - Положите новый Word файл
    - Запустите этот скрипт заново
-   - Новые данные автоматически встроятся в HTML
-
-🌐 Преимущества:
-   • Не требует отдельных JSON файлов
-   • Работает офлайн
-   • Нет проблем с CORS
-   • Можно разместить на GitHub Pages
+   - Новые данные автоматически попадут в приложение
 
-📝 Примечание: файл data.json создается как резервная копия, 
-   но приложение использует данные встроенные в HTML
+{notes}
         """)
         
     except Exception as e:
         print(f"❌ Произошла ошибка: {e}")
         import traceback
         traceback.print_exc()
+    
+    finally:
+        if profiler.enabled:
+            profiler.stop()
+            profiler.print_summary()
+            if profile_report:
+                print(f"📊 Отчет профилировщика: {profiler.write_report(profile_report)}")
+            if cprofile_output:
+                print(f"📊 Дамп cProfile: {profiler.dump_cprofile(cprofile_output)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    
+    arg_parser = argparse.ArgumentParser(description="Библиотека вопросов и ответов из выгрузки чата")
+    arg_parser.add_argument('inputs', nargs='*', help="Word файлы или папки с ними")
+    arg_parser.add_argument('--full', action='store_true',
+                            help="пересобрать SQLite базу целиком вместо синхронизации")
+    arg_parser.add_argument('--profile', nargs='?', const='profile_report.json', metavar='REPORT',
+                            help="сохранить JSON-отчет о времени и памяти по этапам")
+    arg_parser.add_argument('--cprofile', metavar='OUTPUT', help="сохранить дамп cProfile")
+    arg_parser.add_argument('--shard-size', type=int, metavar='N',
+                            help="не встраивать данные в index.html, а загружать частями по N записей")
+    arg_parser.add_argument('--publish', action='store_true',
+                            help="минифицировать папку веб-приложения, добавить хеш в имена файлов и сжатые копии .gz/.br")
+    arg_parser.add_argument('--watch', nargs='?', type=float, const=5.0, metavar='SECONDS',
+                            help="следить за выгрузкой и обновлять библиотеку при ее изменении")
+    arg_parser.add_argument('--stages', default=','.join(PIPELINE_STAGES), metavar='STAGES',
+                            help="выполняемые этапы через запятую; результаты пропущенных этапов "
+                                 "берутся из кэша (по умолчанию %(default)s)")
+    arg_parser.add_argument('-o', '--output-dir', default='src',
+                            help="папка веб-приложения (по умолчанию %(default)s)")
+    arg_parser.add_argument('--db', default='chat_database.db',
+                            help="путь к SQLite базе (по умолчанию %(default)s)")
+    arg_parser.add_argument('--json-file', default=LIBRARY_JSON_FILE,
+                            help="путь к JSON-базе (по умолчанию %(default)s)")
+    arg_parser.add_argument('--cache-dir',
+                            help="папка кэша разбора и группировки (по умолчанию .parse_cache рядом с документом)")
+    arg_parser.add_argument('--threads', choices=list(THREAD_POLICIES), default=DEFAULT_THREAD_POLICY,
+                            help="сборка пар: reply - уточнение к ответу отдельной парой, dialogue - "
+                                 "с уточнениями автора вопроса, conversation - со всеми ветками под "
+                                 "вопросом; база, собранная по другому правилу, пересобирается "
+                                 "целиком (по умолчанию %(default)s)")
+    args = arg_parser.parse_args()
+    try:
+        stages = parse_stages(args.stages)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    
+    main(incremental=not args.full, input_paths=args.inputs or None,
+         profile_report=args.profile, cprofile_output=args.cprofile,
+         shard_size=args.shard_size, publish=args.publish, watch_interval=args.watch,
+         stages=stages, output_dir=args.output_dir, db_path=args.db,
+         json_file=args.json_file, cache_dir=args.cache_dir, thread_policy=args.threads)
\ No newline at end of file
@@ -0,0 +1,277 @@
+"""Генератор синтетических выгрузок чата в формате Word
+
+Пишет .docx в том же формате, что и настоящая выгрузка:
+
+    Сообщение #N
+    От: Имя (@ник) • Дата: 01.01.2025 10:00 • ID: 1000
+    Ответ на сообщение: 999
+    Текст сообщения
+    #ответвиолетты #тег
+    ――――――――――
+
+Нужен для бенчмарков и проверки обработки на больших объемах, когда
+настоящего документа под рукой нет. Пример:
+
+    python generate_chat_export.py 100k chat_100k.docx --reply-depth 4
+"""
+
+import argparse
+import random
+import zipfile
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List, Optional
+from xml.sax.saxutils import escape
+
+VIOLETTA = "Виолетта Макеева (@violetta_makeeva)"
+
+USERS = [
+    "Анна Смирнова (@anna_sm)", "Борис Петров (@bpetrov)", "Елена Кузнецова (@lena_k)",
+    "Дмитрий Орлов (@orlov_d)", "Мария Волкова (@mvolkova)", "Сергей Соколов (@sokolov)",
+    "Ольга Лебедева (@olga_leb)", "Артём Козлов (@artem_k)", "Наталья Морозова (@nmoroz)",
+    "Игорь Новиков (@inovikov)", "Ксения Фёдорова (@ksu_fed)", "Павел Егоров (@egorov_p)",
+]
+
+TAGS = [
+    "#мотивация", "#энергия", "#продажи", "#клиенты", "#маркетинг", "#цены",
+    "#команда", "#выгорание", "#делегирование", "#стратегия", "#контент", "#запуск",
+    "#переговоры", "#финансы", "#привычки", "#время", "#отзывы", "#упаковка",
+    "#воронка", "#сторис", "#страхи", "#личный_бренд", "#найм", "#обучение",
+]
+
+WORDS = (
+    "как лучше выстроить работу с клиентами если запуск через неделю а команда "
+    "ещё не готова подскажите что делать с ценой когда конкуренты дешевле всё "
+    "время уходит на переписку и нет сил на контент хочу понять где теряются "
+    "заявки в воронке стоит ли поднимать чек новым клиентам расскажите про "
+    "делегирование и найм первого помощника появился страх публичности ёлка "
+    "отзывы пришли хорошие но продаж пока мало"
+).split()
+
+# Абзацы WordprocessingML: пространство имен и обертка одного абзаца
+W_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+PARAGRAPH = '<w:p><w:r><w:t xml:space="preserve">{}</w:t></w:r></w:p>'
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/'
+    '2006/relationships/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+
+@dataclass
+class ExportSettings:
+    """Параметры синтетической выгрузки"""
+    messages: int = 10_000
+    seed: int = 42
+    # Максимальное число уточнений: вопрос -> ответ -> вопрос к ответу -> ...
+    reply_depth: int = 3
+    # Максимальное число сообщений в вопросе из нескольких частей
+    question_parts: int = 3
+    # Доля вопросов из нескольких частей
+    multipart_ratio: float = 0.3
+    # Среднее число тематических тегов в ответе Виолетты
+    tag_density: float = 2.0
+    # Доля обычных сообщений чата без ответа Виолетты
+    chatter_ratio: float = 0.2
+    # Вероятность, что очередной ответ Виолетты продолжает ее предыдущий
+    # ответ (ответ на собственное сообщение), а не отвечает на вопрос
+    continuation_ratio: float = 0.3
+    # Сколько разговоров идут в чате одновременно и перемешиваются
+    interleave: int = 4
+
+
+def parse_scale(value: str) -> int:
+    """Разбирает размер выгрузки: 10000, 10k, 1.5M"""
+    value = value.strip().lower().replace('_', '')
+    multiplier = 1
+    if value.endswith('k'):
+        multiplier, value = 1_000, value[:-1]
+    elif value.endswith('m'):
+        multiplier, value = 1_000_000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def _sentence(rng: random.Random) -> str:
+    """Случайная строка текста сообщения"""
+    words = rng.choices(WORDS, k=rng.randint(4, 14))
+    return ' '.join(words).capitalize() + rng.choice(['.', '?', '!', '...'])
+
+
+def _topic_tags(rng: random.Random, density: float) -> List[str]:
+    """Тематические теги ответа со средним числом density"""
+    count = int(density) + (rng.random() < density - int(density))
+    return rng.sample(TAGS, min(count, len(TAGS)))
+
+
+def _conversation(rng: random.Random, settings: ExportSettings,
+                  parent_id: str) -> Iterator[Dict[str, Any]]:
+    """Один разговор: вопрос, ответы Виолетты и уточнения к ним
+
+    Генератор отдает заготовки сообщений и через send() получает
+    присвоенный им ID, чтобы следующие сообщения могли на них ответить.
+    """
+    asker = rng.choice(USERS)
+
+    for _ in range(rng.randint(1, settings.reply_depth)):
+        # Вопрос из нескольких частей возможен только в ответ на сообщение:
+        # части объединяются по общему reply_to и отправителю
+        parts = 1
+        if parent_id and rng.random() < settings.multipart_ratio:
+            parts = rng.randint(2, max(2, settings.question_parts))
+
+        question_ids = []
+        for _ in range(parts):
+            lines = [_sentence(rng) for _ in range(rng.randint(1, 3))]
+            message_id = yield {'sender': asker, 'reply_to': parent_id, 'lines': lines, 'tags': []}
+            question_ids.append(message_id)
+
+        answer_id = ''
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            lines = [_sentence(rng) for _ in range(rng.randint(1, 4))]
+            tags = ['#ответвиолетты'] + _topic_tags(rng, settings.tag_density)
+            reply_to = rng.choice(question_ids)
+            if answer_id and rng.random() < settings.continuation_ratio:
+                reply_to = answer_id
+            answer_id = yield {'sender': VIOLETTA, 'reply_to': reply_to,
+                               'lines': lines, 'tags': tags}
+
+        # Уточняющий вопрос задается в ответ на последний ответ Виолетты
+        parent_id = answer_id
+
+
+def _chatter(rng: random.Random, parent_id: str) -> Iterator[Dict[str, Any]]:
+    """Обычное сообщение чата, на которое Виолетта не отвечает"""
+    yield {'sender': rng.choice(USERS), 'reply_to': parent_id,
+           'lines': [_sentence(rng)], 'tags': []}
+
+
+def iter_export_paragraphs(settings: ExportSettings) -> Iterator[str]:
+    """Перебирает абзацы синтетической выгрузки по порядку"""
+    rng = random.Random(settings.seed)
+    date = datetime(2024, 1, 1, 9, 0)
+    first_id = 10_000
+    recent_ids: List[str] = []
+    active: List[list] = []
+    number = 0
+
+    while number < settings.messages:
+        while len(active) < settings.interleave:
+            # Разговор начинается с нового сообщения или с ответа на одно из недавних
+            parent_id = rng.choice(recent_ids) if recent_ids and rng.random() < 0.5 else ''
+            if rng.random() < settings.chatter_ratio:
+                conversation = _chatter(rng, parent_id)
+            else:
+                conversation = _conversation(rng, settings, parent_id)
+            active.append([conversation, None])
+
+        # Разговоры идут вперемешку, как в настоящем чате
+        slot = rng.randrange(len(active))
+        conversation, last_id = active[slot]
+        try:
+            message = conversation.send(last_id)
+        except StopIteration:
+            active.pop(slot)
+            continue
+
+        number += 1
+        message_id = str(first_id + number)
+        active[slot][1] = message_id
+        recent_ids.append(message_id)
+        if len(recent_ids) > 50:
+            recent_ids.pop(0)
+        date += timedelta(minutes=rng.randint(0, 30))
+
+        yield f"Сообщение #{number}"
+        yield f"От: {message['sender']} • Дата: {date:%d.%m.%Y %H:%M} • ID: {message_id}"
+        if message['reply_to']:
+            yield f"Ответ на сообщение: {message['reply_to']}"
+        yield from message['lines']
+        if message['tags']:
+            yield ' '.join(message['tags'])
+        yield "――――――――――"
+
+
+def write_chat_export(output_file: str, settings: Optional[ExportSettings] = None) -> str:
+    """Записывает синтетическую выгрузку в .docx
+
+    document.xml пишется в архив потоком, поэтому выгрузка на миллион
+    сообщений не собирается в памяти целиком.
+    """
+    settings = settings or ExportSettings()
+
+    with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        archive.writestr('_rels/.rels', ROOT_RELS_XML)
+        with archive.open('word/document.xml', 'w', force_zip64=True) as document_xml:
+            document_xml.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<w:document xmlns:w="{W_NAMESPACE}"><w:body>'
+            ).encode('utf-8'))
+
+            chunk = []
+            for text in iter_export_paragraphs(settings):
+                chunk.append(PARAGRAPH.format(escape(text)))
+                if len(chunk) >= 10_000:
+                    document_xml.write(''.join(chunk).encode('utf-8'))
+                    chunk.clear()
+            chunk.append('<w:sectPr/></w:body></w:document>')
+            document_xml.write(''.join(chunk).encode('utf-8'))
+
+    return output_file
+
+
+def main(argv: Optional[List[str]] = None):
+    """Командная строка генератора"""
+    defaults = ExportSettings()
+    parser = argparse.ArgumentParser(description="Генератор синтетических выгрузок чата (.docx)")
+    parser.add_argument('scale', type=parse_scale, help="число сообщений: 10000, 10k, 100k, 1M")
+    parser.add_argument('output', help="путь к создаваемому .docx")
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--reply-depth', type=int, default=defaults.reply_depth,
+                        help="максимальная глубина уточнений в разговоре")
+    parser.add_argument('--question-parts', type=int, default=defaults.question_parts,
+                        help="максимальное число частей в вопросе")
+    parser.add_argument('--multipart-ratio', type=float, default=defaults.multipart_ratio,
+                        help="доля вопросов из нескольких частей")
+    parser.add_argument('--tag-density', type=float, default=defaults.tag_density,
+                        help="среднее число тематических тегов в ответе")
+    parser.add_argument('--chatter-ratio', type=float, default=defaults.chatter_ratio,
+                        help="доля сообщений без ответа Виолетты")
+    parser.add_argument('--continuation-ratio', type=float, default=defaults.continuation_ratio,
+                        help="вероятность, что ответ Виолетты продолжает ее предыдущий ответ")
+    parser.add_argument('--interleave', type=int, default=defaults.interleave,
+                        help="сколько разговоров идут одновременно")
+    args = parser.parse_args(argv)
+
+    settings = ExportSettings(
+        messages=args.scale,
+        seed=args.seed,
+        reply_depth=args.reply_depth,
+        question_parts=args.question_parts,
+        multipart_ratio=args.multipart_ratio,
+        tag_density=args.tag_density,
+        chatter_ratio=args.chatter_ratio,
+        continuation_ratio=args.continuation_ratio,
+        interleave=args.interleave,
+    )
+    print(f"📝 Генерация выгрузки на {settings.messages} сообщений...")
+    write_chat_export(args.output, settings)
+    print(f"✅ Выгрузка сохранена: {args.output}")
+    print(f"⚙️  Параметры: {asdict(settings)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""Локальный HTTP-сервис запросов к SQLite базе библиотеки
+
+Отдает пары вопрос-ответ из chat_database.db по частям, чтобы веб-приложение
+могло работать с базой любого размера, не загружая ее целиком. Запросы
+обрабатывает пул потоков, каждый берет соединение только для чтения из пула
+соединений; простаивающие keep-alive соединения закрываются по таймауту.
+Ответы в JSON, с ETag по версии файла базы: повторный запрос с If-None-Match
+до изменения базы получает 304 без тела. Пока файл базы подменяют,
+запросы получают 503. Пример:
+
+    python library_server.py --db chat_database.db --port 8765
+
+Эндпоинты:
+
+    GET /api/qa?page=1&per_page=50&tag=мотивация   список пар, фильтр по тегам
+    GET /api/search?q=запуск&tag=цены&page=1       полнотекстовый поиск (FTS5)
+    GET /api/tags                                  теги с числом пар
+    GET /api/thread/<message_id>                   цепочка сообщения и его пары
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterator
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from create_library import DatabaseManager
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+# Ограничение глубины рекурсивных выборок цепочки на случай циклов в reply_to
+MAX_THREAD_DEPTH = 1000
+# Потоки обслуживают keep-alive соединения целиком, а браузер держит до 6
+# соединений на адрес, поэтому потоков заметно больше, чем соединений с базой;
+# простаивающее соединение закрывается через KEEP_ALIVE_TIMEOUT секунд
+DEFAULT_WORKERS = 16
+DEFAULT_CONNECTIONS = 4
+KEEP_ALIVE_TIMEOUT = 10
+
+MESSAGE_COLUMNS = '''
+    messages.message_number, messages.sender, messages.date, messages.message_id,
+    messages.reply_to, messages.text, messages.is_violetta_answer,
+    (SELECT json_group_array(tags.tag) FROM message_tags
+     JOIN tags ON tags.id = message_tags.tag_id
+     WHERE message_tags.message_id = messages.id)
+'''
+
+class ApiError(Exception):
+    """Ошибка запроса, которая возвращается клиенту с кодом status"""
+    
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+class ReadOnlyConnectionPool:
+    """Пул соединений с базой только для чтения
+    
+    Соединения создаются заранее и раздаются потокам по одному. Если файл
+    базы заменили целиком (os.replace при пересборке), соединение
+    открывается заново, иначе оно продолжало бы читать удаленный файл.
+    Если в этот момент файла нет, запрос получает 503, а соединение
+    откроется при следующем запросе.
+    """
+    
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        self._uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(self._open())
+    
+    def _identity(self) -> Optional[tuple]:
+        """Устройство и inode файла базы: меняются, когда файл заменяют; None - файла нет"""
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+    
+    def _open(self) -> tuple:
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only = ON')
+        return conn, self._identity()
+    
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдает свободное соединение на время блока with"""
+        conn, identity = self._idle.get()
+        try:
+            current = self._identity()
+            if current is None:
+                raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, 'база данных обновляется, повторите запрос')
+            if identity != current:
+                # Если открыть базу не удастся, в пул вернется (None, None),
+                # и следующий запрос попробует снова
+                if conn is not None:
+                    conn.close()
+                conn, identity = None, None
+                conn, identity = self._open()
+            yield conn
+        finally:
+            self._idle.put((conn, identity))
+    
+    def version(self) -> str:
+        """Версия базы по размеру и времени изменения файла базы и журнала WAL"""
+        parts = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            parts.append(f'{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}')
+        return ';'.join(parts)
+    
+    def close(self):
+        while not self._idle.empty():
+            conn, _ = self._idle.get_nowait()
+            if conn is not None:
+                conn.close()
+
+class LibraryService:
+    """Запросы веб-приложения к базе библиотеки"""
+    
+    def __init__(self, db_path: str, pool_size: int = 4):
+        self.pool = ReadOnlyConnectionPool(db_path, pool_size)
+        self.db_manager = DatabaseManager(db_path)
+    
+    def list_qa_pairs(self, page: int, per_page: int, tags: List[str]) -> Dict[str, Any]:
+        """Страница пар в порядке добавления; с tags - пары хотя бы с одним из тегов"""
+        where = ''
+        if tags:
+            where = f'''
+                WHERE qa_pairs.id IN (SELECT qa_pair_tags.qa_pair_id FROM qa_pair_tags
+                                      JOIN tags ON tags.id = qa_pair_tags.tag_id
+                                      WHERE tags.tag IN ({', '.join('?' * len(tags))}))
+            '''
+        with self.pool.connection() as conn:
+            total = conn.execute(f'SELECT COUNT(*) FROM qa_pairs {where}', tags).fetchone()[0]
+            rows = conn.execute(f'''
+                SELECT {DatabaseManager.QA_PAIR_COLUMNS} FROM qa_pairs {where}
+                ORDER BY qa_pairs.id LIMIT ? OFFSET ?
+            ''', [*tags, per_page, (page - 1) * per_page]).fetchall()
+        return {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'items': [DatabaseManager.qa_pair_from_row(row) for row in rows],
+        }
+    
+    def search(self, query: str, page: int, per_page: int, tags: List[str]) -> Dict[str, Any]:
+        """Страница результатов DatabaseManager.search; has_more - есть ли следующая"""
+        with self.pool.connection() as conn:
+            items = self.db_manager.search(query, tags, limit=per_page + 1,
+                                           offset=(page - 1) * per_page, conn=conn)
+        return {
+            'query': query,
+            'page': page,
+            'per_page': per_page,
+            'has_more': len(items) > per_page,
+            'items': items[:per_page],
+        }
+    
+    def tags(self) -> Dict[str, Any]:
+        """Теги библиотеки с числом пар, от самых частых"""
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT tags.tag, COUNT(*) AS pairs FROM qa_pair_tags
+                JOIN tags ON tags.id = qa_pair_tags.tag_id
+                GROUP BY tags.id ORDER BY pairs DESC, tags.tag
+            ''').fetchall()
+        return {'items': [{'tag': tag, 'qa_pairs': count} for tag, count in rows]}
+    
+    def thread(self, message_id: str) -> Dict[str, Any]:
+        """Цепочка сообщения по reply_to_id
+        
+        ancestors - сообщения, на которые оно отвечает, от корня цепочки,
+        replies - все ответы на него на любой глубине в порядке номеров
+        (depth - уровень вложенности), qa_pairs - пары, в которые оно входит.
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT messages.id, {MESSAGE_COLUMNS} FROM messages '
+                               'WHERE messages.message_id = ?', (message_id,)).fetchone()
+            if row is None:
+                raise ApiError(HTTPStatus.NOT_FOUND, f'сообщение {message_id} не найдено')
+            row_id = row[0]
+            
+            ancestors = conn.execute(f'''
+                WITH RECURSIVE chain (id, depth) AS (
+                    SELECT reply_to_id, 1 FROM messages WHERE id = ?
+                    UNION ALL
+                    SELECT messages.reply_to_id, chain.depth + 1 FROM messages
+                    JOIN chain ON messages.id = chain.id
+                    WHERE chain.depth < ?
+                )
+                SELECT {MESSAGE_COLUMNS} FROM chain
+                JOIN messages ON messages.id = chain.id
+                ORDER BY chain.depth DESC
+            ''', (row_id, MAX_THREAD_DEPTH)).fetchall()
+            
+            replies = conn.execute(f'''
+                WITH RECURSIVE subtree (id, depth) AS (
+                    SELECT id, 0 FROM messages WHERE id = ?
+                    UNION ALL
+                    SELECT messages.id, subtree.depth + 1 FROM messages
+                    JOIN subtree ON messages.reply_to_id = subtree.id
+                    WHERE subtree.depth < ?
+                )
+                SELECT {MESSAGE_COLUMNS}, subtree.depth FROM subtree
+                JOIN messages ON messages.id = subtree.id
+                WHERE subtree.depth > 0
+                ORDER BY messages.message_number
+            ''', (row_id, MAX_THREAD_DEPTH)).fetchall()
+            
+            qa_rows = conn.execute(f'''
+                SELECT {DatabaseManager.QA_PAIR_COLUMNS} FROM qa_pairs
+                WHERE qa_pairs.id IN (SELECT qa_pair_id FROM qa_pair_messages WHERE message_id = ?)
+                ORDER BY qa_pairs.id
+            ''', (row_id,)).fetchall()
+        
+        return {
+            'message': _message_from_row(row[1:]),
+            'ancestors': [_message_from_row(item) for item in ancestors],
+            'replies': [{**_message_from_row(item), 'depth': item[8]} for item in replies],
+            'qa_pairs': [DatabaseManager.qa_pair_from_row(item) for item in qa_rows],
+        }
+    
+    def close(self):
+        self.pool.close()
+
+def _message_from_row(row: tuple) -> Dict[str, Any]:
+    """Сообщение из строки выборки со столбцами MESSAGE_COLUMNS"""
+    return {
+        'message_number': row[0],
+        'sender': row[1],
+        'date': row[2],
+        'message_id': row[3],
+        'reply_to': row[4],
+        'text': row[5],
+        'is_violetta_answer': bool(row[6]),
+        'tags': json.loads(row[7]),
+    }
+
+def _int_param(params: Dict[str, List[str]], name: str, default: int,
+               maximum: Optional[int] = None) -> int:
+    """Положительное целое из строки запроса"""
+    try:
+        value = int(params.get(name, [default])[-1])
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f'{name} должен быть целым числом')
+    if value < 1:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f'{name} должен быть больше нуля')
+    return min(value, maximum) if maximum else value
+
+def _tag_params(params: Dict[str, List[str]]) -> List[str]:
+    """Теги из параметров tag; # можно не указывать, чтобы не экранировать его в адресе"""
+    return [tag if tag.startswith('#') else f'#{tag}'
+            for tag in dict.fromkeys(params.get('tag', [])) if tag]
+
+class LibraryRequestHandler(BaseHTTPRequestHandler):
+    """Маршрутизация запросов к LibraryService и условные ответы по ETag"""
+    
+    server_version = 'LibraryServer/1.0'
+    protocol_version = 'HTTP/1.1'
+    # Без таймаута простаивающее keep-alive соединение занимало бы поток пула
+    timeout = KEEP_ALIVE_TIMEOUT
+    
+    def do_GET(self):
+        self._respond(send_body=True)
+    
+    def do_HEAD(self):
+        self._respond(send_body=False)
+    
+    def _respond(self, send_body: bool):
+        url = urlsplit(self.path)
+        # Ответ зависит только от адреса и содержимого базы
+        version = self.server.service.pool.version()
+        etag = '"' + hashlib.sha256(f'{version}|{url.path}?{url.query}'.encode()).hexdigest()[:32] + '"'
+        
+        if etag in (value.strip() for value in self.headers.get('If-None-Match', '').split(',')):
+            self._send(HTTPStatus.NOT_MODIFIED, b'', etag, send_body=False)
+            return
+        
+        try:
+            result = self._route(url.path, parse_qs(url.query))
+            status = HTTPStatus.OK
+        except ApiError as e:
+            result, status, etag = {'error': str(e)}, e.status, None
+        except OSError as e:
+            # Файл базы недоступен, например, его как раз подменяют
+            self.log_error('База данных: %s', e)
+            result, status, etag = {'error': 'база данных недоступна'}, HTTPStatus.SERVICE_UNAVAILABLE, None
+        except sqlite3.Error as e:
+            self.log_error('SQLite: %s', e)
+            result, status, etag = {'error': 'ошибка базы данных'}, HTTPStatus.INTERNAL_SERVER_ERROR, None
+        
+        body = json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._send(status, body, etag, send_body)
+    
+    def _route(self, path: str, params: Dict[str, List[str]]) -> Dict[str, Any]:
+        service = self.server.service
+        page = _int_param(params, 'page', 1)
+        per_page = _int_param(params, 'per_page', DEFAULT_PER_PAGE, MAX_PER_PAGE)
+        
+        if path == '/api/qa':
+            return service.list_qa_pairs(page, per_page, _tag_params(params))
+        if path == '/api/search':
+            query = params.get('q', [''])[-1].strip()
+            if not query:
+                raise ApiError(HTTPStatus.BAD_REQUEST, 'не задан параметр q')
+            return service.search(query, page, per_page, _tag_params(params))
+        if path == '/api/tags':
+            return service.tags()
+        if path.startswith('/api/thread/'):
+            message_id = unquote(path[len('/api/thread/'):])
+            if not message_id:
+                raise ApiError(HTTPStatus.BAD_REQUEST, 'не задан ID сообщения')
+            return service.thread(message_id)
+        raise ApiError(HTTPStatus.NOT_FOUND, f'неизвестный адрес {path}')
+    
+    def _send(self, status: HTTPStatus, body: bytes, etag: Optional[str], send_body: bool):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        # Страница может быть открыта с другого адреса или как файл
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            # Кешировать можно, но перед использованием нужно сверить ETag
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+    
+    def log_message(self, format: str, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP-сервер, который обрабатывает соединения в пуле из workers потоков
+    
+    Открытые соединения запоминаются, чтобы server_close мог их разорвать
+    и не ждать, пока клиенты закроют keep-alive соединения сами.
+    """
+    
+    def __init__(self, address: tuple, service: LibraryService, workers: int = DEFAULT_WORKERS,
+                 quiet: bool = False):
+        super().__init__(address, LibraryRequestHandler)
+        self.service = service
+        self.quiet = quiet
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library')
+        self._requests = set()
+        self._requests_lock = threading.Lock()
+    
+    def process_request(self, request, client_address):
+        with self._requests_lock:
+            self._requests.add(request)
+        self.executor.submit(self._process_request, request, client_address)
+    
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._requests_lock:
+                self._requests.discard(request)
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        with self._requests_lock:
+            requests = list(self._requests)
+        for request in requests:
+            with contextlib.suppress(OSError):
+                request.shutdown(socket.SHUT_RDWR)
+        self.executor.shutdown(wait=True)
+        self.service.close()
+
+def create_server(db_path: str, host: str = '127.0.0.1', port: int = 8765,
+                  workers: int = DEFAULT_WORKERS, quiet: bool = False,
+                  connections: int = DEFAULT_CONNECTIONS) -> PooledHTTPServer:
+    """Сервер над базой db_path: workers потоков и connections соединений с базой"""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    return PooledHTTPServer((host, port), LibraryService(db_path, connections), workers, quiet)
+
+def main(argv: Optional[List[str]] = None):
+    """Командная строка сервиса"""
+    parser = argparse.ArgumentParser(description="HTTP-сервис запросов к базе библиотеки")
+    parser.add_argument('--db', default='chat_database.db', help="путь к SQLite базе")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="число потоков, обслуживающих HTTP-соединения")
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS,
+                        help="число соединений с базой")
+    parser.add_argument('--quiet', action='store_true', help="не печатать журнал запросов")
+    args = parser.parse_args(argv)
+    
+    try:
+        server = create_server(args.db, args.host, args.port, args.workers, args.quiet,
+                               args.connections)
+    except FileNotFoundError:
+        print(f"❌ База {args.db} не найдена! Сначала запустите create_library.py")
+        return
+    
+    host, port = server.server_address[:2]
+    print(f"🌐 Библиотека доступна на http://{host}:{port}/api/qa (Ctrl+C - остановить)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
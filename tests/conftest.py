@@ -0,0 +1,41 @@
+"""Общие фикстуры тестов: синтетические выгрузки generate_chat_export"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from create_library import ChatMessage, ChatParser  # noqa: E402
+from generate_chat_export import ExportSettings, iter_export_paragraphs, write_chat_export  # noqa: E402
+
+# Небольшая выгрузка: сотни сообщений достаточно, чтобы встретились вопросы
+# из нескольких частей, продолжения ответов и уточнения разной глубины
+EXPORT_SETTINGS = ExportSettings(messages=600, seed=7, reply_depth=4)
+
+
+def parse_export(settings: ExportSettings = EXPORT_SETTINGS) -> list:
+    """Сообщения синтетической выгрузки без записи .docx"""
+    return list(ChatParser().iter_paragraph_messages(iter_export_paragraphs(settings)))
+
+
+def message(number: int, sender: str, reply_to: str = '', violetta: bool = False) -> ChatMessage:
+    """Сообщение для небольших цепочек, собранных вручную"""
+    tags = ['ответвиолетты'] if violetta else []
+    return ChatMessage(str(number), sender, f'01.01.2025 10:{number:02d}', str(number),
+                       reply_to, f'текст {number}', tags, violetta)
+
+
+@pytest.fixture(scope='session')
+def export_docx(tmp_path_factory) -> str:
+    """Синтетическая выгрузка в .docx, общая для всех тестов"""
+    path = tmp_path_factory.mktemp('export') / 'chat.docx'
+    return write_chat_export(str(path), EXPORT_SETTINGS)
+
+
+@pytest.fixture(scope='session')
+def export_messages() -> list:
+    return parse_export()
@@ -0,0 +1,369 @@
+"""SQLite база: инкрементальная синхронизация и перевод старой схемы"""
+
+import json
+import os
+import sqlite3
+from dataclasses import replace
+
+import pytest
+
+from conftest import message
+from create_library import THREAD_POLICIES, DatabaseManager, QAGrouper, main
+
+# Схема версии 1 (user_version 0): текстовые ключи в message_tags,
+# состав и теги пар только в JSON-столбцах qa_pairs
+V1_SCHEMA = '''
+    CREATE TABLE messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_number INTEGER,
+        sender TEXT,
+        date TEXT,
+        message_id TEXT UNIQUE,
+        reply_to TEXT,
+        text TEXT,
+        is_violetta_answer BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag TEXT UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE message_tags (
+        message_id TEXT,
+        tag TEXT,
+        PRIMARY KEY (message_id, tag),
+        FOREIGN KEY (message_id) REFERENCES messages (message_id),
+        FOREIGN KEY (tag) REFERENCES tags (tag)
+    );
+    CREATE TABLE qa_pairs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question_ids TEXT,
+        question_text TEXT,
+        question_sender TEXT,
+        question_date TEXT,
+        answer_ids TEXT,
+        answer_text TEXT,
+        tags TEXT,
+        answer_date TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+
+def build_database(db_path: str, messages, thread_policy: str = 'reply') -> DatabaseManager:
+    """Полная пересборка базы из сообщений"""
+    db_manager = DatabaseManager(db_path)
+    db_manager.save_to_sqlite(messages, QAGrouper(messages, thread_policy).group_questions_answers(),
+                              thread_policy)
+    return db_manager
+
+
+def build_v1_database(db_path: str, messages) -> None:
+    """База в схеме версии 1 с теми же сообщениями и парами"""
+    qa_pairs = QAGrouper(messages).group_questions_answers()
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(V1_SCHEMA)
+        conn.executemany('''
+            INSERT INTO messages (message_number, sender, date, message_id, reply_to, text,
+                                  is_violetta_answer)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(msg.message_number, msg.sender, msg.date, msg.message_id, msg.reply_to,
+               msg.text, msg.is_violetta_answer) for msg in messages])
+        conn.executemany('INSERT OR IGNORE INTO tags (tag) VALUES (?)',
+                         [(tag,) for msg in messages for tag in msg.tags])
+        conn.executemany('INSERT OR IGNORE INTO message_tags VALUES (?, ?)',
+                         [(msg.message_id, tag) for msg in messages for tag in msg.tags])
+        conn.executemany('''
+            INSERT INTO qa_pairs (question_ids, question_text, question_sender, question_date,
+                                  answer_ids, answer_text, tags, answer_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(json.dumps(qa['question_ids']), qa['question_text'], qa['question_sender'],
+               qa['question_date'], json.dumps(qa['answer_ids']), qa['answer_text'],
+               json.dumps(sorted(qa['tags'])), qa['answer_date']) for qa in qa_pairs])
+    conn.close()
+
+
+def sync_database(db_manager: DatabaseManager, messages, thread_policy: str = 'reply') -> dict:
+    grouper = QAGrouper(thread_policy=thread_policy)
+    return db_manager.sync_sqlite(grouper.index_messages(messages), grouper)
+
+
+def snapshot(db_path: str) -> dict:
+    """Содержимое базы без суррогатных ключей и порядка строк"""
+    with sqlite3.connect(db_path) as conn:
+        pairs = sorted(
+            (question_ids, answer_ids, question_text, question_sender, question_date,
+             answer_text, answer_date, tuple(sorted(json.loads(tags))), question_key)
+            for question_ids, answer_ids, question_text, question_sender, question_date,
+                answer_text, answer_date, tags, question_key in conn.execute('''
+                SELECT question_ids, answer_ids, question_text, question_sender, question_date,
+                       answer_text, answer_date, tags, question_key
+                FROM qa_pairs
+            '''))
+        pair_messages = sorted(conn.execute('''
+            SELECT qa_pairs.question_key, qa_pair_messages.role, qa_pair_messages.position,
+                   messages.message_id
+            FROM qa_pair_messages
+            JOIN qa_pairs ON qa_pairs.id = qa_pair_messages.qa_pair_id
+            JOIN messages ON messages.id = qa_pair_messages.message_id
+        '''))
+        pair_tags = sorted(conn.execute('''
+            SELECT qa_pairs.question_key, tags.tag
+            FROM qa_pair_tags
+            JOIN qa_pairs ON qa_pairs.id = qa_pair_tags.qa_pair_id
+            JOIN tags ON tags.id = qa_pair_tags.tag_id
+        '''))
+        messages = sorted(conn.execute('''
+            SELECT messages.message_id, messages.sender, senders.name, messages.reply_to,
+                   parents.message_id, messages.text, messages.is_violetta_answer
+            FROM messages
+            LEFT JOIN senders ON senders.id = messages.sender_id
+            LEFT JOIN messages AS parents ON parents.id = messages.reply_to_id
+        '''))
+        message_tags = sorted(conn.execute('''
+            SELECT messages.message_id, tags.tag
+            FROM message_tags
+            JOIN messages ON messages.id = message_tags.message_id
+            JOIN tags ON tags.id = message_tags.tag_id
+        '''))
+        tags = sorted(tag for tag, in conn.execute('SELECT tag FROM tags'))
+        senders = sorted(name for name, in conn.execute('SELECT name FROM senders'))
+        search = sorted(row[0] for row in conn.execute(
+            "SELECT rowid FROM qa_pairs_fts WHERE qa_pairs_fts MATCH 'вопрос OR ответ'"))
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.close()
+    return {'pairs': pairs, 'pair_messages': pair_messages, 'pair_tags': pair_tags,
+            'messages': messages, 'message_tags': message_tags, 'tags': tags,
+            'senders': senders, 'search': len(search),
+            'user_version': version}
+
+
+def edited_export(messages) -> list:
+    """Новая выгрузка: правки текста и тегов в старых сообщениях"""
+    edited = list(messages)
+    for index in range(5, len(edited), 37):
+        msg = edited[index]
+        if msg.is_violetta_answer:
+            edited[index] = replace(msg, tags=msg.tags + ['новыйтег'])
+        else:
+            edited[index] = replace(msg, text=msg.text + ' (исправлено)')
+    return edited
+
+
+def relinked_export(messages) -> list:
+    """Новая выгрузка, где часть сообщений отвечает на другие сообщения
+    
+    Сообщение переносится под один из более ранних ответов Виолетты (вопрос
+    становится уточнением, ответ - продолжением) или перестает быть ответом.
+    """
+    edited = list(messages)
+    answer_ids = []
+    for index, msg in enumerate(messages):
+        if index % 23 == 11:
+            new_reply_to = answer_ids[len(answer_ids) // 3] if answer_ids and index % 3 else ''
+            edited[index] = replace(msg, reply_to=new_reply_to)
+        if msg.is_violetta_answer:
+            answer_ids.append(msg.message_id)
+    return edited
+
+
+@pytest.mark.parametrize('policy', THREAD_POLICIES)
+@pytest.mark.parametrize('edit', [edited_export, relinked_export])
+def test_sync_matches_full_rebuild(export_messages, tmp_path, policy, edit):
+    old_messages = export_messages[:450]
+    new_messages = edit(export_messages)
+    
+    synced = build_database(str(tmp_path / 'synced.db'), old_messages, policy)
+    stats = sync_database(synced, new_messages, policy)
+    build_database(str(tmp_path / 'rebuilt.db'), new_messages, policy)
+    
+    assert stats['changed_messages'] > len(export_messages) - len(old_messages)
+    assert snapshot(synced.db_path) == snapshot(str(tmp_path / 'rebuilt.db'))
+
+
+@pytest.mark.parametrize('policy', THREAD_POLICIES)
+def test_sync_of_moved_branch_matches_full_rebuild(tmp_path, policy):
+    messages = [
+        message(1, 'Аня'),
+        message(2, 'Виолетта', '1', violetta=True),
+        message(3, 'Оля'),
+        message(4, 'Виолетта', '3', violetta=True),
+        # Уточнение Оли к ответу на вопрос Ани: в dialogue это отдельная пара
+        message(5, 'Оля', '2'),
+        message(6, 'Виолетта', '5', violetta=True),
+    ]
+    # Ответ 2 переносится к вопросу Оли, и ее уточнение входит в пару вопроса 3,
+    # хотя пара уточнения не содержит ни одного измененного сообщения
+    new_messages = list(messages)
+    new_messages[1] = replace(messages[1], reply_to='3')
+    
+    synced = build_database(str(tmp_path / 'synced.db'), messages, policy)
+    sync_database(synced, new_messages, policy)
+    build_database(str(tmp_path / 'rebuilt.db'), new_messages, policy)
+    
+    assert snapshot(synced.db_path) == snapshot(str(tmp_path / 'rebuilt.db'))
+
+
+@pytest.mark.parametrize('policy', THREAD_POLICIES)
+def test_sync_of_answer_continuation_keeps_one_pair(tmp_path, policy):
+    messages = [
+        message(0, 'Лена'),
+        message(1, 'Аня', '0'),
+        message(2, 'Аня', '0'),
+        message(3, 'Виолетта', '2', violetta=True),
+        # Продолжение собственного ответа приходит в следующей выгрузке
+        message(4, 'Виолетта', '3', violetta=True),
+    ]
+    synced = build_database(str(tmp_path / 'synced.db'), messages[:4], policy)
+    sync_database(synced, messages, policy)
+    build_database(str(tmp_path / 'rebuilt.db'), messages, policy)
+    
+    state = snapshot(synced.db_path)
+    assert state == snapshot(str(tmp_path / 'rebuilt.db'))
+    assert [(json.loads(pair[0]), json.loads(pair[1])) for pair in state['pairs']] == [
+        (['1', '2'], ['3', '4'])]
+
+
+@pytest.mark.parametrize('policy', THREAD_POLICIES)
+def test_sync_removes_messages_missing_from_export(export_messages, tmp_path, policy):
+    # Пропадают вопросы, ответы и сообщения в середине цепочек
+    new_messages = [msg for index, msg in enumerate(export_messages) if index % 17 != 3]
+    
+    synced = build_database(str(tmp_path / 'synced.db'), export_messages, policy)
+    stats = sync_database(synced, new_messages, policy)
+    build_database(str(tmp_path / 'rebuilt.db'), new_messages, policy)
+    
+    assert stats['removed_messages'] == len(export_messages) - len(new_messages)
+    assert snapshot(synced.db_path) == snapshot(str(tmp_path / 'rebuilt.db'))
+
+
+def test_sync_of_new_messages_only_keeps_the_rest(export_messages, tmp_path):
+    db_manager = build_database(str(tmp_path / 'library.db'), export_messages[:450])
+    grouper = QAGrouper(export_messages[:450])
+    stats = db_manager.sync_sqlite(grouper.index_messages(export_messages[450:]), grouper,
+                                   remove_missing=False)
+    
+    assert stats['removed_messages'] == 0
+    build_database(str(tmp_path / 'rebuilt.db'), export_messages)
+    assert snapshot(db_manager.db_path) == snapshot(str(tmp_path / 'rebuilt.db'))
+
+
+def test_sync_without_changes_keeps_pairs(export_messages, tmp_path):
+    db_manager = build_database(str(tmp_path / 'library.db'), export_messages)
+    before = snapshot(db_manager.db_path)
+    stats = sync_database(db_manager, export_messages)
+    assert stats == {'changed_messages': 0, 'removed_messages': 0,
+                     'removed_qa_pairs': 0, 'rebuilt_qa_pairs': 0}
+    assert snapshot(db_manager.db_path) == before
+
+
+def test_v1_database_is_migrated(export_messages, tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    build_v1_database(db_path, export_messages)
+    db_manager = DatabaseManager(db_path)
+    stats = sync_database(db_manager, export_messages)
+    
+    assert stats['changed_messages'] == len(export_messages)
+    build_database(str(tmp_path / 'rebuilt.db'), export_messages)
+    migrated = snapshot(db_path)
+    assert migrated['user_version'] == DatabaseManager.SCHEMA_VERSION
+    assert migrated == snapshot(str(tmp_path / 'rebuilt.db'))
+    assert db_manager.search('ответ', limit=1)
+
+
+def test_failed_migration_leaves_v1_database(export_messages, tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'library.db')
+    build_v1_database(db_path, export_messages)
+    with sqlite3.connect(db_path) as conn:
+        v1_dump = list(conn.iterdump())
+    conn.close()
+    
+    def interrupted(self, conn):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(DatabaseManager, '_migrate_legacy_data', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        sync_database(DatabaseManager(db_path), export_messages)
+    monkeypatch.undo()
+    
+    with sqlite3.connect(db_path) as conn:
+        assert list(conn.iterdump()) == v1_dump
+    conn.close()
+    
+    sync_database(DatabaseManager(db_path), export_messages)
+    build_database(str(tmp_path / 'rebuilt.db'), export_messages)
+    assert snapshot(db_path) == snapshot(str(tmp_path / 'rebuilt.db'))
+
+
+def test_sync_interrupted_after_migration_can_resume(export_messages, tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    build_v1_database(db_path, export_messages)
+    
+    def interrupted_export():
+        yield from export_messages[:100]
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        sync_database(DatabaseManager(db_path), interrupted_export())
+    
+    # Схема переведена и зафиксирована до чтения выгрузки
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == DatabaseManager.SCHEMA_VERSION
+        tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert 'message_tags_legacy' not in tables
+    
+    sync_database(DatabaseManager(db_path), export_messages)
+    build_database(str(tmp_path / 'rebuilt.db'), export_messages)
+    assert snapshot(db_path) == snapshot(str(tmp_path / 'rebuilt.db'))
+
+
+def test_sync_refuses_other_thread_policy(export_messages, tmp_path):
+    db_manager = build_database(str(tmp_path / 'library.db'), export_messages, 'reply')
+    assert db_manager.thread_policy() == 'reply'
+    before = snapshot(db_manager.db_path)
+    
+    with pytest.raises(ValueError):
+        sync_database(db_manager, export_messages, 'conversation')
+    assert snapshot(db_manager.db_path) == before
+
+
+def test_database_without_policy_is_reply(export_messages, tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    assert DatabaseManager(db_path).thread_policy() is None
+    build_v1_database(db_path, export_messages)
+    assert DatabaseManager(db_path).thread_policy() == 'reply'
+
+
+def test_main_rebuilds_database_when_policy_changes(export_docx, tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    options = dict(input_paths=[export_docx], stages=['parse', 'group', 'sqlite'],
+                   db_path=db_path, cache_dir=str(tmp_path / 'cache'))
+    main(thread_policy='reply', **options)
+    main(thread_policy='conversation', **options)
+    
+    assert DatabaseManager(db_path).thread_policy() == 'conversation'
+    fresh_path = str(tmp_path / 'fresh.db')
+    main(thread_policy='conversation', **dict(options, db_path=fresh_path))
+    assert snapshot(db_path) == snapshot(fresh_path)
+
+
+def open_handles(db_path: str) -> int:
+    """Число открытых процессом дескрипторов файла базы"""
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('нужен /proc')
+    handles = 0
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            handles += os.readlink(f'/proc/self/fd/{fd}') == db_path
+        except OSError:
+            pass
+    return handles
+
+
+def test_database_manager_closes_connections(export_messages, tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    db_manager = build_database(db_path, export_messages[:450])
+    sync_database(db_manager, export_messages)
+    db_manager.search('ответ')
+    db_manager.thread_policy()
+    assert open_handles(db_path) == 0
@@ -0,0 +1,144 @@
+"""Группировка пар вопрос-ответ по лесу ответов"""
+
+import pytest
+
+from conftest import message, parse_export
+from create_library import THREAD_POLICIES, MessageStore, QAGrouper
+from generate_chat_export import ExportSettings
+
+
+def reference_pairs(messages, policy) -> list:
+    """Пары по определению правила сборки, без индексов и леса ответов
+    
+    Вопрос - сообщения одного отправителя с общим reply_to, ответы - ответы
+    Виолетты на них и их продолжения. Уточнение к ответу пары входит в нее,
+    если политика это допускает. Возвращает (question_ids, answer_ids)
+    в порядке первого ответа пары.
+    """
+    by_id = {msg.message_id: msg for msg in messages}
+    first_part = {}
+    
+    def unit(msg):
+        return (msg.reply_to, msg.sender) if msg.reply_to else (msg.message_id,)
+    
+    for msg in messages:
+        if not msg.is_violetta_answer:
+            first_part.setdefault(unit(msg), msg)
+    
+    def question_of(answer):
+        seen = set()
+        parent = by_id.get(answer.reply_to)
+        while parent is not None and parent.is_violetta_answer and parent.message_id not in seen:
+            seen.add(parent.message_id)
+            parent = by_id.get(parent.reply_to)
+        if parent is None or parent.is_violetta_answer:
+            return None
+        return unit(parent)
+    
+    pairs = {}
+    
+    def pair_of(key):
+        if key not in pairs:
+            pairs[key] = key
+            msg = first_part[key]
+            parent = by_id.get(msg.reply_to)
+            if policy.follow_ups and parent is not None and parent.is_violetta_answer:
+                question = question_of(parent)
+                if question is not None:
+                    pair = pair_of(question)
+                    if policy.cross_sender or first_part[pair].sender == msg.sender:
+                        pairs[key] = pair
+        return pairs[key]
+    
+    questions = {}
+    for msg in messages:
+        if not msg.is_violetta_answer:
+            questions.setdefault(pair_of(unit(msg)), []).append(msg.message_id)
+    answers = {}
+    for msg in messages:
+        if msg.is_violetta_answer and msg.reply_to:
+            question = question_of(msg)
+            if question is not None:
+                answers.setdefault(pair_of(question), []).append(msg.message_id)
+    return [(questions[pair], answer_ids) for pair, answer_ids in answers.items()]
+
+
+def grouped_ids(qa_pairs) -> list:
+    return [(qa['question_ids'], qa['answer_ids']) for qa in qa_pairs]
+
+
+@pytest.mark.parametrize('policy', THREAD_POLICIES)
+def test_grouping_matches_reference(export_messages, policy):
+    qa_pairs = QAGrouper(export_messages, thread_policy=policy).group_questions_answers()
+    assert grouped_ids(qa_pairs) == reference_pairs(export_messages, THREAD_POLICIES[policy])
+    
+    answer_ids = [answer_id for qa in qa_pairs for answer_id in qa['answer_ids']]
+    assert len(answer_ids) == len(set(answer_ids))
+
+
+@pytest.mark.parametrize('policy', THREAD_POLICIES)
+def test_grouping_from_store_matches_list(export_messages, policy):
+    from_list = QAGrouper(export_messages, thread_policy=policy).group_questions_answers()
+    from_store = QAGrouper(MessageStore(export_messages), thread_policy=policy).group_questions_answers()
+    assert from_store == from_list
+
+
+@pytest.mark.parametrize('policy', THREAD_POLICIES)
+def test_export_continuations_stay_in_one_pair(export_messages, policy):
+    answers = {msg.message_id for msg in export_messages if msg.is_violetta_answer}
+    continuations = [msg for msg in export_messages
+                     if msg.is_violetta_answer and msg.reply_to in answers]
+    assert continuations
+    
+    qa_pairs = QAGrouper(export_messages, thread_policy=policy).group_questions_answers()
+    pair_of = {answer_id: index for index, qa in enumerate(qa_pairs) for answer_id in qa['answer_ids']}
+    for msg in continuations:
+        assert pair_of[msg.message_id] == pair_of[msg.reply_to]
+
+
+def test_policies_differ_on_follow_ups():
+    messages = parse_export(ExportSettings(messages=400, seed=3, reply_depth=4))
+    counts = {policy: len(QAGrouper(messages, thread_policy=policy).group_questions_answers())
+              for policy in THREAD_POLICIES}
+    assert counts['reply'] > counts['dialogue'] >= counts['conversation']
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('reply', [(['1', '2'], ['3', '4']), (['5'], ['6']), (['7'], ['8'])]),
+    ('dialogue', [(['1', '2', '5'], ['3', '4', '6']), (['7'], ['8'])]),
+    ('conversation', [(['1', '2', '5', '7'], ['3', '4', '6', '8'])]),
+])
+def test_follow_ups_and_answer_continuations(policy, expected):
+    messages = [
+        message(0, 'Лена'),
+        message(1, 'Аня', '0'),
+        message(2, 'Аня', '0'),
+        message(3, 'Виолетта', '2', violetta=True),
+        # Продолжение собственного ответа
+        message(4, 'Виолетта', '3', violetta=True),
+        # Уточнение автора вопроса и вопрос другого участника к тому же ответу
+        message(5, 'Аня', '4'),
+        message(6, 'Виолетта', '5', violetta=True),
+        message(7, 'Оля', '4'),
+        message(8, 'Виолетта', '7', violetta=True),
+    ]
+    qa_pairs = QAGrouper(messages, thread_policy=policy).group_questions_answers()
+    assert grouped_ids(qa_pairs) == expected
+    assert grouped_ids(qa_pairs) == reference_pairs(messages, THREAD_POLICIES[policy])
+
+
+def test_reply_cycle_is_broken_at_earliest_message():
+    messages = [
+        message(1, 'Аня', '3'),
+        message(2, 'Виолетта', '1', violetta=True),
+        message(3, 'Аня', '2'),
+        message(4, 'Виолетта', '3', violetta=True),
+    ]
+    grouper = QAGrouper(messages)
+    assert grouper.thread_root('3') == '1'
+    assert grouped_ids(grouper.group_questions_answers()) == [(['1'], ['2']), (['3'], ['4'])]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        QAGrouper(thread_policy='threads')
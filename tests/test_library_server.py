@@ -0,0 +1,147 @@
+"""HTTP-сервис запросов к базе библиотеки"""
+
+import http.client
+import json
+import os
+import threading
+from urllib.parse import quote
+
+import pytest
+
+from create_library import QAGrouper
+from library_server import create_server
+from test_database import build_database
+
+
+class Client:
+    """Keep-alive клиент сервиса: запрос возвращает (статус, заголовки, JSON)"""
+    
+    def __init__(self, port: int):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    
+    def get(self, path: str, headers: dict = None) -> tuple:
+        self.conn.request('GET', path, headers=headers or {})
+        response = self.conn.getresponse()
+        body = response.read()
+        return response.status, response.headers, json.loads(body) if body else None
+    
+    def close(self):
+        self.conn.close()
+
+
+@pytest.fixture
+def library(export_messages, tmp_path):
+    """Запущенный сервер над базой выгрузки: (клиент, путь к базе, пары)"""
+    db_path = str(tmp_path / 'library.db')
+    build_database(db_path, export_messages)
+    qa_pairs = QAGrouper(export_messages).group_questions_answers()
+    
+    server = create_server(db_path, port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05},
+                              daemon=True)
+    thread.start()
+    client = Client(server.server_address[1])
+    yield client, db_path, qa_pairs
+    client.close()
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def replace_database(db_path: str, messages) -> None:
+    """Пересобирает базу в соседнем файле и подменяет ее одним os.replace"""
+    staging = db_path + '.new'
+    build_database(staging, messages)
+    os.replace(staging, db_path)
+
+
+def test_list_pages_and_tag_filter(library):
+    client, db_path, qa_pairs = library
+    status, _, first = client.get('/api/qa?per_page=40')
+    assert status == 200
+    assert first['total'] == len(qa_pairs)
+    assert [item['question_ids'] for item in first['items']] == \
+        [qa['question_ids'] for qa in qa_pairs[:40]]
+    _, _, second = client.get('/api/qa?page=2&per_page=40')
+    assert second['items'][0]['question_ids'] == qa_pairs[40]['question_ids']
+    
+    tag = qa_pairs[0]['tags'][0]
+    _, _, tagged = client.get(f"/api/qa?tag={quote(tag.lstrip('#'))}&per_page=500")
+    assert tagged['total'] == sum(tag in qa['tags'] for qa in qa_pairs)
+    assert all(tag in item['tags'] for item in tagged['items'])
+
+
+def test_search_and_tags(library):
+    client, db_path, qa_pairs = library
+    word = qa_pairs[0]['answer_text'].split()[0].strip('.,').lower()
+    status, _, result = client.get(f'/api/search?q={quote(word)}&per_page=500')
+    assert status == 200
+    assert result['items'] and not result['has_more']
+    assert all(word in (item['question_text'] + item['answer_text']).lower().replace('ё', 'е')
+               for item in result['items'])
+    
+    _, _, tags = client.get('/api/tags')
+    counts = {item['tag']: item['qa_pairs'] for item in tags['items']}
+    assert counts == {tag: sum(tag in qa['tags'] for qa in qa_pairs)
+                      for tag in {tag for qa in qa_pairs for tag in qa['tags']}}
+
+
+def test_thread(library, export_messages):
+    client, db_path, qa_pairs = library
+    qa = next(qa for qa in qa_pairs if len(qa['answer_ids']) > 1)
+    status, _, thread = client.get(f"/api/thread/{qa['answer_ids'][0]}")
+    assert status == 200
+    assert thread['message']['message_id'] == qa['answer_ids'][0]
+    assert thread['ancestors'][-1]['message_id'] == \
+        next(msg.reply_to for msg in export_messages if msg.message_id == qa['answer_ids'][0])
+    assert qa['question_ids'] in [pair['question_ids'] for pair in thread['qa_pairs']]
+    replies = {msg.message_id for msg in export_messages if msg.reply_to == qa['answer_ids'][0]}
+    assert replies <= {reply['message_id'] for reply in thread['replies'] if reply['depth'] == 1}
+    
+    assert client.get('/api/thread/999999')[0] == 404
+
+
+def test_bad_requests(library):
+    client, _, _ = library
+    assert client.get('/api/qa?page=0')[0] == 400
+    assert client.get('/api/qa?per_page=x')[0] == 400
+    assert client.get('/api/search')[0] == 400
+    assert client.get('/api/unknown')[0] == 404
+
+
+def test_etag_until_database_changes(library, export_messages):
+    client, db_path, _ = library
+    status, headers, _ = client.get('/api/tags')
+    etag = headers['ETag']
+    assert status == 200 and etag
+    status, _, body = client.get('/api/tags', {'If-None-Match': etag})
+    assert status == 304 and body is None
+    
+    replace_database(db_path, export_messages[:300])
+    status, headers, _ = client.get('/api/tags', {'If-None-Match': etag})
+    assert status == 200 and headers['ETag'] != etag
+
+
+def test_reopens_replaced_database(library, export_messages):
+    client, db_path, _ = library
+    # Все соединения пула успевают открыть прежний файл
+    for _ in range(8):
+        client.get('/api/qa?per_page=1')
+    
+    replace_database(db_path, export_messages[:300])
+    expected = len(QAGrouper(export_messages[:300]).group_questions_answers())
+    for _ in range(8):
+        status, _, result = client.get('/api/qa?per_page=1')
+        assert status == 200 and result['total'] == expected
+
+
+def test_missing_database_is_unavailable(library, export_messages):
+    client, db_path, qa_pairs = library
+    os.rename(db_path, db_path + '.moved')
+    status, _, result = client.get('/api/qa')
+    assert status == 503 and 'error' in result
+    
+    os.rename(db_path + '.moved', db_path)
+    status, _, result = client.get('/api/qa')
+    assert status == 200 and result['total'] == len(qa_pairs)
+
@@ -0,0 +1,99 @@
+"""Разбор выгрузки: потоковый парсер и кэш результатов разбора"""
+
+import os
+import pickle
+import subprocess
+import sys
+from dataclasses import asdict
+
+import pytest
+
+from conftest import ROOT_DIR
+from create_library import ChatParser, ParseCache
+
+
+def as_dicts(messages) -> list:
+    return [asdict(msg) for msg in messages]
+
+
+def run_script(*args: str, cwd: str) -> str:
+    """Запускает create_library.py как скрипт и возвращает его вывод"""
+    env = dict(os.environ, PYTHONIOENCODING='utf-8')
+    result = subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'create_library.py'), *args],
+                            cwd=cwd, env=env, capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def test_streaming_parser_matches_python_docx(export_docx):
+    pytest.importorskip('docx')
+    parser = ChatParser()
+    streamed = parser.parse_word_document(export_docx, streaming=True)
+    assert streamed
+    assert as_dicts(streamed) == as_dicts(parser.parse_word_document(export_docx, streaming=False))
+
+
+def test_streaming_parser_matches_paragraph_parser(export_docx, export_messages):
+    streamed = ChatParser().parse_word_document(export_docx, streaming=True)
+    assert as_dicts(streamed) == as_dicts(export_messages)
+
+
+def test_parse_cache_written_by_script_is_read_on_import(export_docx, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    run_script(export_docx, '--stages', 'parse', '--cache-dir', cache_dir, cwd=str(tmp_path))
+    
+    parser = ChatParser()
+    cache = ParseCache(cache_dir)
+    assert cache.contains(parser, export_docx)
+    cached = list(cache.iter_messages(parser, export_docx))
+    assert as_dicts(cached) == as_dicts(parser.parse_word_document(export_docx, streaming=True))
+    # Запись прочитана, а не разобрана и перезаписана заново
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_parse_cache_written_on_import_is_read_by_script(export_docx, export_messages, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    parser = ChatParser()
+    written = list(ParseCache(cache_dir).iter_messages(parser, export_docx))
+    assert as_dicts(written) == as_dicts(export_messages)
+    
+    # Этап group без parse требует готовой записи разбора
+    output = run_script(export_docx, '--stages', 'group', '--cache-dir', cache_dir,
+                        cwd=str(tmp_path))
+    assert 'взят из кэша' in output
+    assert f"Обработано сообщений: {len(export_messages)}" in output
+
+
+def test_unreadable_cache_entry_is_a_miss(export_docx, export_messages, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    parser = ChatParser()
+    cache = ParseCache(cache_dir)
+    list(cache.iter_messages(parser, export_docx))
+    entry_path = cache._entry_path(parser, export_docx)
+    with open(entry_path, 'wb') as f:
+        f.write(b'not a pickle')
+    
+    assert as_dicts(cache.iter_messages(parser, export_docx)) == as_dicts(export_messages)
+    assert as_dicts(ParseCache(cache_dir).iter_messages(parser, export_docx)) == as_dicts(export_messages)
+
+
+@pytest.mark.parametrize('cut', ['boundary', 'middle'])
+def test_truncated_cache_entry_is_a_miss(export_docx, export_messages, tmp_path, cut):
+    cache_dir = str(tmp_path / 'cache')
+    parser = ChatParser()
+    cache = ParseCache(cache_dir)
+    list(cache.iter_messages(parser, export_docx))
+    entry_path = cache._entry_path(parser, export_docx)
+    size = os.path.getsize(entry_path)
+    
+    # Обрыв после половины сообщений или внутри последнего объекта
+    with open(entry_path, 'rb') as f:
+        for _ in range(len(export_messages) // 2 + 1):
+            pickle.load(f)
+        boundary = f.tell()
+    with open(entry_path, 'r+b') as f:
+        f.truncate(boundary if cut == 'boundary' else size - 3)
+    
+    assert as_dicts(cache.iter_messages(parser, export_docx)) == as_dicts(export_messages)
+    assert os.path.getsize(entry_path) == size
+    assert as_dicts(ParseCache(cache_dir).iter_messages(parser, export_docx)) == as_dicts(export_messages)
@@ -0,0 +1,81 @@
+"""Выбор этапов сборки (--stages): недостающие результаты берутся из кэша"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT_DIR
+from create_library import PIPELINE_STAGES, main, parse_stages
+
+
+@pytest.fixture
+def run_stages(export_docx, tmp_path):
+    """main() с выбранными этапами и путями внутри tmp_path"""
+    def run(*stages: str) -> None:
+        main(input_paths=[export_docx], stages=stages, output_dir=str(tmp_path / 'src'),
+             db_path=str(tmp_path / 'library.db'), json_file=str(tmp_path / 'library.json'),
+             cache_dir=str(tmp_path / 'cache'))
+    return run
+
+
+def read_pairs(tmp_path) -> list:
+    with open(tmp_path / 'src' / 'data.json', encoding='utf-8') as f:
+        return [qa['question_ids'] for qa in json.load(f)['data']]
+
+
+def test_parse_stages_keeps_pipeline_order():
+    assert parse_stages('html, parse,group') == ['parse', 'group', 'html']
+    assert parse_stages(','.join(PIPELINE_STAGES)) == list(PIPELINE_STAGES)
+    for value in ('', 'parse,render'):
+        with pytest.raises(ValueError):
+            parse_stages(value)
+
+
+def test_unknown_stage_is_a_usage_error(tmp_path):
+    result = subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'create_library.py'),
+                             '--stages', 'parse,render'],
+                            cwd=str(tmp_path), capture_output=True, text=True, encoding='utf-8',
+                            env=dict(os.environ, PYTHONIOENCODING='utf-8'))
+    assert result.returncode == 2
+    assert 'render' in result.stderr
+
+
+def test_later_stages_use_cached_results(run_stages, tmp_path):
+    run_stages('parse', 'group')
+    assert not os.path.exists(tmp_path / 'library.db')
+    assert not os.path.exists(tmp_path / 'src')
+    
+    # Веб-приложение из сохраненных пар: документ не разбирается, SQLite не создается
+    run_stages('html')
+    assert not os.path.exists(tmp_path / 'library.db')
+    cached_pairs = read_pairs(tmp_path)
+    
+    run_stages('sqlite', 'json')
+    with sqlite3.connect(str(tmp_path / 'library.db')) as conn:
+        count, = conn.execute('SELECT COUNT(*) FROM qa_pairs').fetchone()
+    conn.close()
+    with open(tmp_path / 'library.json', encoding='utf-8') as f:
+        assert len(json.load(f)['data']) == count == len(cached_pairs)
+    
+    # Полная сборка дает те же пары
+    run_stages(*PIPELINE_STAGES)
+    assert read_pairs(tmp_path) == cached_pairs
+
+
+@pytest.mark.parametrize('stages, hint', [
+    (['html'], 'добавьте этап group'),
+    (['group'], 'добавьте этап parse'),
+    # Новой базе нужны готовые пары, а группировке - разбор
+    (['sqlite'], 'добавьте этап group'),
+    (['group', 'sqlite'], 'добавьте этап parse'),
+])
+def test_stage_without_cached_input_stops(run_stages, tmp_path, capsys, stages, hint):
+    run_stages(*stages)
+    assert hint in capsys.readouterr().out
+    assert not os.path.exists(tmp_path / 'src')
+    assert not os.path.exists(tmp_path / 'library.json')
+    assert not os.path.exists(tmp_path / 'library.db')
@@ -0,0 +1,120 @@
+"""Режим наблюдения: хвостовые обновления и подмена базы и src/"""
+
+import os
+import sqlite3
+from dataclasses import replace
+
+import pytest
+
+from conftest import EXPORT_SETTINGS, parse_export
+from create_library import DatabaseManager, LibraryWatcher, QAGrouper, _qa_pair_key, staged_directory
+from generate_chat_export import write_chat_export
+from test_database import build_database, snapshot
+
+
+def write_export(path: str, messages: int) -> str:
+    # Выгрузки с одним seed совпадают в начале: меньшая - префикс большей
+    return write_chat_export(path, replace(EXPORT_SETTINGS, messages=messages))
+
+
+def make_watcher(tmp_path, docx_file: str) -> LibraryWatcher:
+    return LibraryWatcher(docx_file, db_path=str(tmp_path / 'library.db'),
+                          output_dir=str(tmp_path / 'src'), interval=0, json_file=None)
+
+
+def assert_matches_full_build(watcher: LibraryWatcher, tmp_path, messages: int):
+    expected = QAGrouper(parse_export(replace(EXPORT_SETTINGS, messages=messages))).group_questions_answers()
+    assert set(watcher.qa_pairs) == {_qa_pair_key(qa) for qa in expected}
+    rebuilt = build_database(str(tmp_path / 'rebuilt.db'),
+                             parse_export(replace(EXPORT_SETTINGS, messages=messages)))
+    assert snapshot(watcher.db_path) == snapshot(rebuilt.db_path)
+    assert os.path.exists(os.path.join(watcher.output_dir, 'index.html'))
+
+
+def test_tail_update_matches_full_build(tmp_path, capsys):
+    docx_file = write_export(str(tmp_path / 'chat.docx'), 300)
+    watcher = make_watcher(tmp_path, docx_file)
+    assert watcher.check()
+    assert not watcher.check()
+    
+    write_export(docx_file, 400)
+    assert watcher.check()
+    assert 'Новых сообщений в конце выгрузки: 100' in capsys.readouterr().out
+    assert_matches_full_build(watcher, tmp_path, 400)
+
+
+def test_failed_tail_update_is_retried_with_full_build(tmp_path, monkeypatch):
+    docx_file = write_export(str(tmp_path / 'chat.docx'), 300)
+    watcher = make_watcher(tmp_path, docx_file)
+    watcher.check()
+    before = snapshot(watcher.db_path)
+    
+    def locked(self, *args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(DatabaseManager, 'sync_sqlite', locked)
+    write_export(docx_file, 400)
+    assert not watcher.check()
+    # Группировщик не держит сообщения, которых нет в базе
+    assert watcher.grouper is None
+    assert snapshot(watcher.db_path) == before
+    
+    monkeypatch.undo()
+    assert watcher.check()
+    assert_matches_full_build(watcher, tmp_path, 400)
+
+
+def test_failed_web_app_swap_is_retried(tmp_path, monkeypatch):
+    docx_file = write_export(str(tmp_path / 'chat.docx'), 300)
+    watcher = make_watcher(tmp_path, docx_file)
+    watcher.check()
+    
+    def disk_full(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(LibraryWatcher, '_write_web_app', disk_full)
+    write_export(docx_file, 400)
+    assert not watcher.check()
+    
+    monkeypatch.undo()
+    assert watcher.check()
+    assert_matches_full_build(watcher, tmp_path, 400)
+
+
+def test_staged_directory_restores_previous_when_swap_fails(tmp_path, monkeypatch):
+    path = str(tmp_path / 'src')
+    os.makedirs(path)
+    with open(os.path.join(path, 'index.html'), 'w') as f:
+        f.write('old')
+    
+    real_replace = os.replace
+    def replace_file(source, target):
+        if '.staging-' in source:
+            raise PermissionError('занято')
+        real_replace(source, target)
+    monkeypatch.setattr(os, 'replace', replace_file)
+    
+    with pytest.raises(PermissionError):
+        with staged_directory(path) as staging:
+            with open(os.path.join(staging, 'index.html'), 'w') as f:
+                f.write('new')
+    monkeypatch.undo()
+    
+    with open(os.path.join(path, 'index.html')) as f:
+        assert f.read() == 'old'
+    assert os.listdir(tmp_path) == ['src']
+
+
+def test_staged_directory_recovers_interrupted_swap(tmp_path):
+    path = str(tmp_path / 'src')
+    # Процесс прервался между переименованиями: src/ нет, есть прежняя версия
+    os.makedirs(f"{path}.previous-12345")
+    with open(os.path.join(f"{path}.previous-12345", 'index.html'), 'w') as f:
+        f.write('old')
+    
+    with staged_directory(path) as staging:
+        with open(os.path.join(staging, 'index.html')) as f:
+            assert f.read() == 'old'
+        with open(os.path.join(staging, 'styles.css'), 'w') as f:
+            f.write('new')
+    
+    assert sorted(os.listdir(path)) == ['index.html', 'styles.css']
+    assert os.listdir(tmp_path) == ['src']
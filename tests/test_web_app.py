@@ -0,0 +1,240 @@
+"""Веб-приложение: файлы src/ и поведение сгенерированного скрипта"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from create_library import (QAGrouper, brotli, build_search_index, build_tag_table, create_interactive_html,
+                            search_fields, search_index_grams)
+
+# Запуск сценария приложения в Node без браузера: Worker и DOM заменены
+# заглушками, init() не вызывается, проверяется только поиск
+NODE_HARNESS = r'''
+const fs = require('fs');
+const html = fs.readFileSync(process.argv[2], 'utf8');
+const scripts = [...html.matchAll(/<script[^>]*>([\s\S]*?)<\/script>/g)].map(m => m[1]);
+let worker = null;
+global.Worker = class {
+    constructor() { worker = this; this.terminated = false; }
+    postMessage() {}
+    terminate() { this.terminated = true; }
+};
+global.document = {
+    getElementById: id => id === 'searchEngineSource' ? { textContent: scripts[0] } : null,
+    addEventListener() {},
+};
+global.window = { addEventListener() {} };
+global.URL = { createObjectURL: () => 'blob:search' };
+global.Blob = class {};
+eval(scripts.join('\n').replace('this.init();', '') + '\nObject.assign(globalThis, { LibraryApp, SearchEngine });');
+'''
+
+
+def build_web_app(qa_pairs, output_dir: str, **options) -> str:
+    html_file, _ = create_interactive_html(qa_pairs, output_dir, **options)
+    return html_file
+
+
+def run_node(script: str, *args: str) -> dict:
+    """Выполняет script после NODE_HARNESS; process.argv[2:] - args, результат - последняя строка JSON"""
+    node = shutil.which('node')
+    if node is None:
+        pytest.skip('нужен Node.js')
+    script_file = os.path.join(os.path.dirname(os.path.dirname(args[0])), 'harness.js')
+    with open(script_file, 'w', encoding='utf-8') as f:
+        f.write(NODE_HARNESS + script)
+    result = subprocess.run([node, script_file, *args],
+                            capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope='module')
+def qa_pairs(export_messages) -> list:
+    return QAGrouper(export_messages).group_questions_answers()
+
+
+def read_json(path: str):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_shards_and_manifest_cover_all_pairs(qa_pairs, tmp_path):
+    output_dir = str(tmp_path / 'src')
+    html_file = build_web_app(qa_pairs, output_dir, shard_size=100)
+    manifest = read_json(os.path.join(output_dir, 'data', 'manifest.json'))
+    
+    assert manifest['total_entries'] == len(qa_pairs)
+    assert manifest['shard_size'] == 100
+    assert [(shard['start'], shard['count']) for shard in manifest['shards']] == [
+        (start, min(100, len(qa_pairs) - start)) for start in range(0, len(qa_pairs), 100)]
+    records = [record for shard in manifest['shards']
+               for record in read_json(os.path.join(output_dir, *shard['file'].split('/')))]
+    assert [record['question_ids'] for record in records] == [qa['question_ids'] for qa in qa_pairs]
+    assert all(0 <= tag_id < len(manifest['tags']) for record in records for tag_id in record['tag_ids'])
+    
+    # Данные не встроены в страницу
+    with open(html_file, encoding='utf-8') as f:
+        assert qa_pairs[0]['question_text'] not in f.read()
+    
+    # Части от прошлой сборки с другим размером удаляются
+    build_web_app(qa_pairs, output_dir, shard_size=len(qa_pairs))
+    assert sorted(os.listdir(os.path.join(output_dir, 'data'))) == [
+        'manifest.json', 'qa-00000.json', 'search-index.json']
+
+
+def published_files(output_dir: str) -> set:
+    return {os.path.relpath(os.path.join(root, name), output_dir).replace(os.sep, '/')
+            for root, _, names in os.walk(output_dir) for name in names}
+
+
+def test_publish_hashes_and_compresses_files(qa_pairs, tmp_path):
+    output_dir = str(tmp_path / 'src')
+    html_file = build_web_app(qa_pairs, output_dir, shard_size=100, publish=True)
+    files = read_json(os.path.join(output_dir, 'asset-manifest.json'))['files']
+    
+    # Сам asset-manifest.json не перечисляет себя, но тоже сжимается
+    expected = {'asset-manifest.json', 'asset-manifest.json.gz'}
+    if brotli is not None:
+        expected.add('asset-manifest.json.br')
+    for name, entry in files.items():
+        with open(os.path.join(output_dir, *entry['file'].split('/')), 'rb') as f:
+            data = f.read()
+        assert entry['sha256'] == hashlib.sha256(data).hexdigest()
+        assert entry['bytes'] == len(data)
+        if name != 'index.html':
+            stem, ext = os.path.splitext(name)
+            assert entry['file'] == f"{stem}.{entry['sha256'][:10]}{ext}"
+        if len(data) >= 1024:
+            with gzip.open(os.path.join(output_dir, *entry['encodings']['gzip']['file'].split('/'))) as f:
+                assert f.read() == data
+            if brotli is not None:
+                with open(os.path.join(output_dir, *entry['encodings']['br']['file'].split('/')), 'rb') as f:
+                    assert brotli.decompress(f.read()) == data
+        expected.add(entry['file'])
+        expected.update(encoded['file'] for encoded in entry.get('encodings', {}).values())
+    assert published_files(output_dir) == expected
+    
+    with open(html_file, encoding='utf-8') as f:
+        html = f.read()
+    assert f'href="{files["styles.css"]["file"]}"' in html
+    assert json.dumps(files['data/manifest.json']['file']) in html
+    manifest = read_json(os.path.join(output_dir, *files['data/manifest.json']['file'].split('/')))
+    assert [shard['file'] for shard in manifest['shards']] == [
+        entry['file'] for name, entry in sorted(files.items()) if name.startswith('data/qa-')]
+    
+    # Те же данные дают те же имена, измененные - новые, а старые файлы удаляются
+    build_web_app(qa_pairs, output_dir, shard_size=100, publish=True)
+    assert read_json(os.path.join(output_dir, 'asset-manifest.json'))['files'] == files
+    build_web_app(qa_pairs[:-1], output_dir, shard_size=100, publish=True)
+    changed = read_json(os.path.join(output_dir, 'asset-manifest.json'))['files']
+    assert changed['data.json']['file'] != files['data.json']['file']
+    assert files['data.json']['file'] not in published_files(output_dir)
+
+
+def decode_postings(encoded: str) -> list:
+    record_ids = []
+    value = shift = previous = 0
+    for byte in base64.b64decode(encoded):
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += value
+        record_ids.append(previous)
+        value = shift = 0
+    return record_ids
+
+
+def decode_bitmap(encoded: str) -> list:
+    bitmap = base64.b64decode(encoded)
+    return [record_id for record_id in range(len(bitmap) * 8)
+            if bitmap[record_id >> 3] >> (record_id & 7) & 1]
+
+
+def test_search_index_postings_match_records(qa_pairs):
+    _, tag_ids = build_tag_table(qa_pairs)
+    records = [search_fields(qa, tag_ids) for qa in qa_pairs]
+    index = build_search_index(records)
+    
+    assert index['records'] == len(records)
+    record_grams = [search_index_grams(record['search_key']) for record in records]
+    assert set(index['grams']) == set().union(*record_grams)
+    for gram, encoded in index['grams'].items():
+        assert decode_postings(encoded) == [record_id for record_id, grams in enumerate(record_grams)
+                                            if gram in grams]
+    for tag_id in tag_ids.values():
+        assert decode_bitmap(index['tags'][str(tag_id)]) == [
+            record_id for record_id, record in enumerate(records) if tag_id in record['tag_ids']]
+
+
+def test_indexed_search_matches_full_scan(qa_pairs, tmp_path):
+    html_file = build_web_app(qa_pairs, str(tmp_path / 'src'))
+    words = re.findall(r'\w{4,}', ' '.join(qa['answer_text'] for qa in qa_pairs[:5]))
+    # Слова длиннее и короче n-граммы, фраза, отсутствующее слово и пустой запрос
+    terms = [*words[:6], words[0][:2], f'{words[1]} {words[2]}', 'несуществующееслово', '']
+    result = run_node('''
+        const app = new LibraryApp();
+        const records = app.searchFields(app.qaData);
+        const indexed = new SearchEngine();
+        indexed.addRecords(records);
+        indexed.setIndex(app.searchIndex);
+        const scan = new SearchEngine();
+        scan.addRecords(records);
+        const masks = [null, records[0].tag_mask, records[1].tag_mask];
+        const cases = JSON.parse(process.argv[3]).flatMap(term => masks.map(mask => [term, mask]));
+        console.log(JSON.stringify(cases.map(([term, mask]) => [
+            Array.from(indexed.query(term, mask)), Array.from(scan.query(term, mask))])));
+    ''', html_file, json.dumps(terms, ensure_ascii=False))
+    
+    assert any(indexed for indexed, _ in result)
+    for indexed, scanned in result:
+        assert indexed == scanned
+
+
+def test_tags_count_matches_normalized_tags(qa_pairs, tmp_path):
+    spellings = [['#Мотивация', '#ответвиолетты'], ['#мотивация'], ['мотивация', '#Ответвиолетты']]
+    tagged = [dict(qa, tags=tags) for qa, tags in zip(qa_pairs, spellings)]
+    html_file = build_web_app(tagged, str(tmp_path / 'src'))
+    with open(html_file, encoding='utf-8') as f:
+        initial = int(re.search(r'<span id="tagsCount">(\d+)</span>', f.read()).group(1))
+    result = run_node('''
+        console.log(JSON.stringify({ tags: new LibraryApp().sortedTags.length }));
+    ''', html_file)
+    
+    assert initial == result['tags'] == 2
+
+
+def test_search_worker_failure_falls_back_to_main_thread(qa_pairs, tmp_path):
+    html_file = build_web_app(qa_pairs, str(tmp_path / 'src'))
+    term = re.findall(r'\w{4,}', qa_pairs[0]['question_text'])[0]
+    result = run_node('''
+        (async () => {
+            const app = new LibraryApp();
+            const query = app.runQuery(process.argv[3], null);
+            const pending = app.pendingQueries.size;
+            worker.onerror({ message: 'сбой', preventDefault() {} });
+            const ids = await query;
+            const expected = new SearchEngine();
+            expected.addRecords(app.searchFields(app.qaData));
+            console.log(JSON.stringify({
+                pending,
+                terminated: worker.terminated,
+                worker: app.searchWorker,
+                ids: Array.from(ids),
+                expected: Array.from(expected.query(process.argv[3], null)),
+                next: Array.from(await app.runQuery(process.argv[3], null)),
+            }));
+        })();
+    ''', html_file, term)
+    
+    assert result['pending'] == 1
+    assert result['terminated'] and result['worker'] is None
+    assert result['ids'] and result['ids'] == result['expected'] == result['next']